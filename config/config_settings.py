@@ -56,6 +56,8 @@ class Config:
 
     n_markers = 34
 
+    markers_to_load = None  # Marker names or the name of a marker cluster to read, None reads all markers
+
     if data_resolution == "hires":
         brain_region_point_ranges = [(1, 16), (17, 32), (33, 48)]
     elif data_resolution == "medres":
@@ -78,6 +80,7 @@ class Config:
     masks_dir = os.path.join("/media/large_storage/oliveria_data/masks", data_resolution)
     point_dir = "Point"
     tifs_dir = "TIFs"
+    multipage_tiff_name = None  # Name of a multi-page or OME-TIFF file in tifs_dir holding every marker of a point
 
     caud_hip_mfg_separate_dir = data_resolution == "medres"
 
@@ -96,9 +99,21 @@ class Config:
     else:
         n_points_per_dir = n_points
 
+    load_rgb_segmentation_masks = False  # Read masks as 3-channel RGB images instead of single channel binary images
     show_segmentation_masks_when_reading = False
     describe_markers_when_reading = False
 
+    n_reading_workers = 1  # Number of points to read concurrently, 1 reads points serially
+    reading_executor = "thread"  # "thread" or "process"
+    prefetch_queue_depth = 2  # Number of points to read ahead while the pipeline processes a point, 0 disables it
+    trace_reading_allocations = False  # Log the peak bytes allocated while reading each point
+
+    marker_data_dtype = None  # Data type to downcast marker counts to when reading ex. "uint8", None keeps the TIF dtype
+    sparse_marker_data = False  # Keep only the nonzero ion counts of each marker channel in memory
+    manifest_path = None  # Set to an index file path to keep the dataset manifest between runs
+    validate_dataset_before_run = True  # Check every marker TIF and mask against the manifest before a run
+    point_cache_dir = None  # Set to a directory to memory map points from a one-time ingest instead of decoding TIFs
+
     # Settings for extracting vessels from segmentation mask
 
     show_vessel_contours_when_extracting = False
@@ -116,6 +131,15 @@ class Config:
     expression_type = "area_normalized_counts"
     transformation_type = "arcsinh"
     normalization_type = "percentile"
+    feature_precision = "float64"  # "float32" or "float64", precision used to compute and store expression features
+    use_ring_histogram = True  # Reduce every outward expansion ring of a point in one pass instead of once per ring
+    n_expansion_workers = 1  # Number of processes to compute expansion data of points in, 1 computes points serially
+    share_marker_data_with_workers = True  # Publish marker stacks to expansion workers in shared memory, not pickled
+    execution_order = "expansion"  # "expansion" keeps every point's marker data for the run and can use expansion
+    # workers, "point" computes all expansions of each point as soon as it is read and releases its marker data
+    checkpoint_dir = None  # Set to a directory to persist the features of each point as it finishes and resume from it
+    stage_cache_dir = None  # Set to a directory to reuse vessels and features of earlier runs with the same settings
+    stage_cache_max_bytes = 10 * 1024 ** 3  # Least recently used stage outputs are evicted past this size
 
     if normalization_type == "percentile":
         percentile_to_normalize = 99
@@ -0,0 +1,34 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from utils.expression_rows import ExpressionRows
+
+
+class TestExpressionRows(unittest.TestCase):
+
+    def test_to_dataframe(self):
+        marker_names = ["A", "B"]
+
+        first = ExpressionRows(marker_names,
+                               [(1, 0, 0, "Data"), (1, 1, 0, "Data")],
+                               np.array([[1, 2], [3, 4]], np.float32),
+                               np.array([10.0, 200.0]))
+        second = ExpressionRows(marker_names,
+                                [(2, 0, 1, "Vascular Space")],
+                                np.array([[5, 6]], np.float32),
+                                np.array([50.0]))
+
+        rows = ExpressionRows.concat([first, ExpressionRows(marker_names), second])
+        features = rows.to_dataframe(large_vessel_threshold=100)
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(list(features.columns), marker_names + ["Contour Area", "Vessel Size"])
+        self.assertEqual(features[marker_names].to_numpy().dtype, np.float32)
+        self.assertEqual(list(features["Vessel Size"]), ["Small", "Large", "Small"])
+        self.assertEqual(features.loc[pd.IndexSlice[2, 0, 1, "Vascular Space"], "B"], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from utils.expression_rows import ExpressionRows
+from utils.feature_store import FeatureStore
+
+
+class TestFeatureStore(unittest.TestCase):
+
+    def setUp(self):
+        self.marker_names = ["A", "B"]
+
+        index = []
+        for point_num, n_vessels in [(1, 2), (2, 3)]:
+            for vessel in range(n_vessels):
+                index.append((point_num, vessel, 0, "Data"))
+                index.append((point_num, vessel, 1, "Data"))
+                index.append((point_num, vessel, 1, "Non-Vascular Space"))
+                index.append((point_num, vessel, 1, "Vascular Space"))
+
+                # Only the first vessel of each point could contract
+                if vessel == 0:
+                    index.append((point_num, vessel, -1, "Data"))
+
+        values = np.arange(len(index) * 2, dtype=np.float64).reshape(-1, 2)
+        contour_areas = np.array([50.0 + 100 * row[1] for row in index])
+
+        self.rows = ExpressionRows(self.marker_names, index, values, contour_areas)
+        self.features = self.rows.to_dataframe(large_vessel_threshold=120).sort_index()
+        self.features.index.rename(['Point', 'Vessel', 'Expansion', 'Data Type'], inplace=True)
+
+        self.feature_store = FeatureStore.from_dataframe(self.features, self.marker_names)
+
+    def test_round_trip(self):
+        pd.testing.assert_frame_equal(self.feature_store.to_dataframe(large_vessel_threshold=120), self.features)
+
+    def test_from_rows(self):
+        order = np.random.RandomState(0).permutation(len(self.rows))
+        rows = ExpressionRows(self.marker_names,
+                              [self.rows.index[i] for i in order],
+                              self.rows.values[order],
+                              self.rows.contour_areas[order])
+
+        feature_store = FeatureStore.from_rows(rows)
+
+        pd.testing.assert_frame_equal(feature_store.to_dataframe(large_vessel_threshold=120), self.features)
+
+    def test_get(self):
+        idx = pd.IndexSlice
+
+        self.assertEqual(self.feature_store.n_vessels(), 5)
+        self.assertEqual(self.feature_store.n_vessels(2), 3)
+
+        np.testing.assert_array_equal(self.feature_store.get(expansion=1, data_type="Vascular Space"),
+                                      self.features.loc[idx[:, :, 1, "Vascular Space"], self.marker_names].to_numpy())
+        np.testing.assert_array_equal(self.feature_store.get(point_num=2, expansion=0, markers="B"),
+                                      self.features.loc[idx[2, :, 0, "Data"], "B"].to_numpy())
+        np.testing.assert_array_equal(self.feature_store.get(expansion=-1),
+                                      self.features.loc[idx[:, :, -1, "Data"], self.marker_names].to_numpy())
+
+    def test_get_ranges(self):
+        idx = pd.IndexSlice
+
+        np.testing.assert_array_equal(
+            self.feature_store.get(point_num=slice(2, 2), expansion=slice(0, 1), data_type="Data"),
+            self.features.loc[idx[2:2, :, 0:1, "Data"], self.marker_names].to_numpy())
+        np.testing.assert_array_equal(
+            self.feature_store.get(point_num=slice(1, 2), expansion=None, data_type="Vascular Space"),
+            self.features.loc[idx[:, :, :, "Vascular Space"], self.marker_names].to_numpy())
+
+    def test_sma_presence_round_trip(self):
+        features = self.features.copy()
+        features["SMA Presence"] = np.where(features["A"] > 10, "Positive", "Negative").astype(object)
+
+        feature_store = FeatureStore.from_dataframe(features, self.marker_names)
+
+        pd.testing.assert_frame_equal(feature_store.to_dataframe(large_vessel_threshold=120), features)
+
+    def test_to_dataframe_selection(self):
+        idx = pd.IndexSlice
+
+        pd.testing.assert_frame_equal(
+            self.feature_store.to_dataframe(large_vessel_threshold=120, expansion=slice(None, 0), data_type="Data"),
+            self.features.loc[idx[:, :, :0, "Data"], :])
+        pd.testing.assert_frame_equal(
+            self.feature_store.to_dataframe(large_vessel_threshold=120, point_num=2, expansion=1),
+            self.features.loc[idx[2, :, 1, :], :])
+        pd.testing.assert_frame_equal(
+            self.feature_store.to_dataframe(large_vessel_threshold=120, point_num=slice(2, 2),
+                                            data_type="Vascular Space"),
+            self.features.loc[idx[2:2, :, :, "Vascular Space"], :])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,10 +2,12 @@ import os
 import unittest
 
 import numpy as np
+import cv2 as cv
 
 from config.config_settings import Config
 from utils.object_extractor import ObjectExtractor
-from utils.markers_feature_gen import calculate_composition_marker_expression
+from utils.markers_feature_gen import calculate_composition_marker_expression, get_vessel_owner_labels, \
+    get_marker_expression_vector, preprocess_marker_data
 from utils.mibi_reader import MIBIReader
 from utils.utils_functions import get_contour_areas_list
 
@@ -41,6 +43,81 @@ class TestMarkersFeatureGen(unittest.TestCase):
 
         self.assertEqual(len(data), len(contours))
 
+    def test_vessel_owner_labels(self):
+        img_shape = (48, 64)
+        contours = []
+
+        for center in [(10, 10), (50, 12), (30, 38)]:
+            mask = np.zeros(img_shape, np.uint8)
+            cv.circle(mask, center, 4, 255, cv.FILLED)
+            contours.extend(cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)[-2])
+
+        owner_labels = get_vessel_owner_labels(contours, img_shape)
+
+        # Brute force distance from every pixel to every vessel
+        distances = []
+
+        for i in range(len(contours)):
+            inverted = np.ones(img_shape, np.uint8)
+            cv.drawContours(inverted, contours, i, 0, cv.FILLED)
+            distances.append(cv.distanceTransform(inverted, cv.DIST_L2, cv.DIST_MASK_PRECISE))
+
+        distances = np.array(distances)
+        sorted_distances = np.sort(distances, axis=0)
+        not_tied = sorted_distances[1] - sorted_distances[0] > 1e-3
+
+        expected_owner_labels = np.argmin(distances, axis=0)
+
+        self.assertEqual(owner_labels.dtype, np.int32)
+        np.testing.assert_array_equal(owner_labels[not_tied], expected_owner_labels[not_tied])
+        self.assertEqual(get_vessel_owner_labels([], img_shape).max(), -1)
+
+    def test_marker_expression_vector(self):
+        img_shape = (32, 40)
+        marker_data = np.random.default_rng(0).integers(0, 3, (4,) + img_shape).astype(np.float32)
+
+        mask = np.zeros(img_shape, np.uint8)
+        cv.circle(mask, (20, 16), 6, 1, cv.FILLED)
+        window = (slice(8, 26), slice(12, 30))
+
+        for expression_type in ["mean", "area_normalized_counts", "counts"]:
+            expected = [preprocess_marker_data(cv.bitwise_and(marker, marker, mask=mask), mask, expression_type)
+                        for marker in marker_data]
+
+            np.testing.assert_array_equal(get_marker_expression_vector(marker_data, mask, expression_type), expected)
+            np.testing.assert_array_equal(get_marker_expression_vector(marker_data,
+                                                                       np.ascontiguousarray(mask[window]),
+                                                                       expression_type,
+                                                                       window=window), expected)
+
+    def test_feature_precision_sets_feature_dtype(self):
+        img_shape = (48, 64)
+        marker_names = ["A", "B", "C"]
+        marker_data = np.random.default_rng(0).poisson(2.0, (len(marker_names),) + img_shape).astype(np.uint8)
+
+        mask = np.zeros(img_shape, np.uint8)
+        cv.circle(mask, (16, 20), 6, 255, cv.FILLED)
+        cv.circle(mask, (44, 28), 8, 255, cv.FILLED)
+        contours = cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)[-2]
+
+        data = {}
+
+        for feature_precision in ["float32", "float64"]:
+            config = Config()
+            config.feature_precision = feature_precision
+
+            rows = calculate_composition_marker_expression(config,
+                                                           marker_data,
+                                                           contours,
+                                                           get_contour_areas_list(contours),
+                                                           marker_names,
+                                                           return_rows=True)
+            data[feature_precision] = rows.values
+
+            self.assertEqual(rows.values.dtype, np.dtype(feature_precision))
+
+        np.testing.assert_allclose(data["float32"], data["float64"], rtol=1e-6)
+
 
 if __name__ == '__main__':
     unittest.main()
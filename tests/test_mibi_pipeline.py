@@ -0,0 +1,176 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from utils.mibi_pipeline import MIBIPipeline
+from utils.utils_functions import get_contour_areas_list
+from tests.test_mibi_reader import create_synthetic_dataset
+
+
+class TestMIBIPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = create_synthetic_dataset(self.root)
+        self.config.perform_inward_expansions = True
+        self.config.max_inward_expansion = 2
+        self.config.visualization_results_dir = os.path.join(self.root, "results")
+        self.config.save_to_csv = False
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _get_expansion_data(self):
+        pipeline = MIBIPipeline(self.config)
+
+        masks, marker_data, marker_names = pipeline.mibi_reader.get_all_point_data()
+        contours = [pipeline.object_extractor.extract(mask, point_name="Point%s" % (i + 1))[1]
+                    for i, mask in enumerate(masks)]
+        areas = [get_contour_areas_list(point_contours) for point_contours in contours]
+
+        return pipeline._get_expansion_data(contours, areas, marker_data, marker_names, self.config.pixel_interval, 3)
+
+    @staticmethod
+    def _get_features(pipeline):
+        return pipeline.feature_store.to_dataframe(pipeline.config.large_vessel_threshold)
+
+    def test_parallel_expansion_data_matches_serial(self):
+        serial_outward, serial_inward, serial_n_inward = self._get_expansion_data()
+
+        self.config.n_expansion_workers = 2
+        outward, inward, n_inward = self._get_expansion_data()
+
+        self.assertEqual(n_inward, serial_n_inward)
+
+        for rows, serial_rows in [(outward, serial_outward), (inward, serial_inward)]:
+            self.assertEqual(rows.index, serial_rows.index)
+            np.testing.assert_array_equal(rows.values, serial_rows.values)
+            np.testing.assert_array_equal(rows.contour_areas, serial_rows.contour_areas)
+
+    def test_point_major_matches_expansion_major(self):
+        self.config.max_expansions = 3
+
+        pipeline = MIBIPipeline(self.config)
+        pipeline.load_preprocess_data()
+
+        self.config.execution_order = "point"
+        point_major_pipeline = MIBIPipeline(self.config)
+        point_major_pipeline.load_preprocess_data()
+
+        pd.testing.assert_frame_equal(self._get_features(point_major_pipeline),
+                                      self._get_features(pipeline))
+
+        # The marker data is read again when the visualizer needs it
+        self.assertIsNone(point_major_pipeline.visualizer.all_points_marker_data)
+
+        for (point_idx, marker_data, marker_names), (expected_idx, expected_data, expected_names) in \
+                zip(point_major_pipeline.visualizer._iter_point_marker_data(),
+                    pipeline.visualizer._iter_point_marker_data()):
+            self.assertEqual(point_idx, expected_idx)
+            self.assertEqual(list(marker_names), list(expected_names))
+            np.testing.assert_array_equal(marker_data, expected_data)
+
+    def test_resume_from_checkpoint(self):
+        self.config.max_expansions = 3
+        self.config.checkpoint_dir = os.path.join(self.root, "checkpoint")
+
+        pipeline = MIBIPipeline(self.config)
+        pipeline.load_preprocess_data()
+
+        self.assertEqual(pipeline.checkpoint.completed_points(), [1, 2, 3])
+
+        def fail(*args, **kwargs):
+            raise AssertionError("Point was computed again")
+
+        for execution_order in ["expansion", "point"]:
+            self.config.execution_order = execution_order
+
+            resumed_pipeline = MIBIPipeline(self.config)
+            resumed_pipeline._get_point_expansion_data = fail
+            resumed_pipeline.load_preprocess_data()
+
+            pd.testing.assert_frame_equal(self._get_features(resumed_pipeline),
+                                          self._get_features(pipeline))
+
+        # A fully resumed run never starts the process pool
+        self.config.execution_order = "expansion"
+        self.config.n_expansion_workers = 2
+
+        with mock.patch("utils.mibi_pipeline.ProcessPoolExecutor", side_effect=fail):
+            resumed_pipeline = MIBIPipeline(self.config)
+            resumed_pipeline.load_preprocess_data()
+
+        pd.testing.assert_frame_equal(self._get_features(resumed_pipeline),
+                                      self._get_features(pipeline))
+
+        # Changing the marker clusters changes the markers that are read, so every point is computed again
+        self.config.n_expansion_workers = 1
+        self.config.marker_clusters = {key: markers[::-1] for key, markers in self.config.marker_clusters.items()}
+
+        with mock.patch.object(MIBIPipeline, "_get_point_expansion_data", autospec=True,
+                               side_effect=MIBIPipeline._get_point_expansion_data) as compute_point:
+            recomputed_pipeline = MIBIPipeline(self.config)
+            recomputed_pipeline.load_preprocess_data()
+
+        self.assertEqual(compute_point.call_count, 3)
+        self.assertEqual(list(recomputed_pipeline.visualizer.markers_names),
+                         recomputed_pipeline.mibi_reader.get_marker_names())
+
+    def test_stage_cache_skips_cached_stages(self):
+        self.config.max_expansions = 3
+        self.config.stage_cache_dir = os.path.join(self.root, "stage_cache")
+
+        pipeline = MIBIPipeline(self.config)
+        pipeline.load_preprocess_data()
+
+        def fail(*args, **kwargs):
+            raise AssertionError("Stage was computed again")
+
+        # Plotting settings do not invalidate any stage
+        self.config.create_expansion_violin_plots = not self.config.create_expansion_violin_plots
+
+        cached_pipeline = MIBIPipeline(self.config)
+        cached_pipeline._read_and_expand = fail
+        cached_pipeline.normalize_data = fail
+        cached_pipeline.load_preprocess_data()
+
+        pd.testing.assert_frame_equal(self._get_features(cached_pipeline),
+                                      self._get_features(pipeline))
+        self.assertIsNone(cached_pipeline.visualizer.all_points_marker_data)
+
+        # Normalization settings only invalidate the normalization stage
+        self.config.scaling_factor *= 2
+
+        normalized_pipeline = MIBIPipeline(self.config)
+        normalized_pipeline._read_and_expand = fail
+        normalized_pipeline.load_preprocess_data()
+
+        self.config.stage_cache_dir = None
+
+        expected_pipeline = MIBIPipeline(self.config)
+        expected_pipeline.load_preprocess_data()
+
+        pd.testing.assert_frame_equal(self._get_features(normalized_pipeline),
+                                      self._get_features(expected_pipeline))
+
+        # Changing the marker clusters changes the markers that are read, so no stage is reused
+        self.config.stage_cache_dir = os.path.join(self.root, "stage_cache")
+        self.config.marker_clusters = {key: markers[::-1] for key, markers in self.config.marker_clusters.items()}
+
+        with mock.patch.object(MIBIPipeline, "_read_and_expand", autospec=True,
+                               side_effect=MIBIPipeline._read_and_expand) as read_and_expand:
+            reordered_pipeline = MIBIPipeline(self.config)
+            reordered_pipeline.load_preprocess_data()
+
+        self.assertEqual(read_and_expand.call_count, 1)
+        self.assertEqual(list(self._get_features(reordered_pipeline).columns[:3]),
+                         reordered_pipeline.mibi_reader.get_marker_names()[:3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,266 @@
+import json
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+
+import numpy as np
+import cv2 as cv
+from tifffile import imwrite
+
+from config.config_settings import Config
+from utils.mibi_reader import MIBIReader
+
+
+def create_synthetic_dataset(root: str, n_points: int = 3, point_size: (int, int) = (64, 64)) -> Config:
+    """
+    Write a small synthetic dataset in the MIBI directory layout and return a matching configuration
+
+    :param root: str, Directory to write the dataset into
+    :param n_points: int, Number of points to create
+    :param point_size: tuple, Point data size
+    :return: Config, configuration settings pointing at the synthetic dataset
+    """
+
+    config = Config()
+    config.data_dir = os.path.join(root, "data")
+    config.masks_dir = os.path.join(root, "masks")
+    config.caud_hip_mfg_separate_dir = False
+    config.n_points = n_points
+    config.n_points_per_dir = n_points
+    config.segmentation_mask_size = point_size
+
+    rng = np.random.RandomState(0)
+
+    for point_idx in range(n_points):
+        fov = config.point_dir + str(point_idx + 1)
+
+        tifs_dir = os.path.join(config.data_dir, fov, config.tifs_dir)
+        os.makedirs(tifs_dir)
+
+        for marker_cluster in config.marker_clusters.values():
+            for marker_name in marker_cluster:
+                counts = rng.poisson(0.2, point_size).astype(np.uint8)
+                imwrite(os.path.join(tifs_dir, "%s.tif" % marker_name), counts)
+
+        mask_dir = os.path.join(config.masks_dir, fov)
+        os.makedirs(mask_dir)
+
+        mask = np.zeros(point_size, np.uint8)
+        cv.circle(mask, (16, 16), 6, 255, cv.FILLED)
+        cv.circle(mask, (44, 40), 8, 255, cv.FILLED)
+        imwrite(os.path.join(mask_dir, config.selected_segmentation_mask_type + ".tif"), mask)
+
+    return config
+
+
+class TestMIBIReader(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = create_synthetic_dataset(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_concurrent_reading_preserves_point_order(self):
+        serial_masks, serial_data, serial_names = MIBIReader(self.config).get_all_point_data()
+
+        self.config.n_reading_workers = 3
+        mibi_reader = MIBIReader(self.config)
+        masks, data, names = mibi_reader.get_all_point_data()
+
+        self.assertEqual(names, serial_names)
+        self.assertEqual(len(data), self.config.n_points)
+        self.assertEqual(list(mibi_reader.point_read_times.keys()), ["Point1", "Point2", "Point3"])
+
+        for point_data, serial_point_data in zip(data, serial_data):
+            np.testing.assert_array_equal(point_data, serial_point_data)
+
+    def test_process_reading_matches_serial_reading(self):
+        serial_masks, serial_data, serial_names = MIBIReader(self.config).get_all_point_data()
+
+        self.config.n_reading_workers = 2
+        self.config.reading_executor = "process"
+        masks, data, names = MIBIReader(self.config).get_all_point_data()
+
+        self.assertEqual(names, serial_names)
+
+        for point_data, serial_point_data in zip(data, serial_data):
+            np.testing.assert_array_equal(point_data, serial_point_data)
+
+        for mask, serial_mask in zip(masks, serial_masks):
+            np.testing.assert_array_equal(mask, serial_mask)
+
+    def test_iter_point_data_yields_points_in_order(self):
+        self.config.n_reading_workers = 2
+        mibi_reader = MIBIReader(self.config)
+
+        point_nums = []
+
+        for point_num, segmentation_mask, marker_data, marker_names in mibi_reader.iter_point_data():
+            point_nums.append(point_num)
+            self.assertEqual(len(marker_data), len(marker_names))
+            self.assertEqual(segmentation_mask.shape[:2], marker_data.shape[1:])
+
+        self.assertEqual(point_nums, [1, 2, 3])
+
+    def test_markers_to_load_selects_markers(self):
+        masks, data, names = MIBIReader(self.config).get_all_point_data()
+
+        self.config.markers_to_load = "Vessels"
+        vessel_masks, vessel_data, vessel_names = MIBIReader(self.config).get_all_point_data()
+
+        expected_names = [name for name in self.config.marker_clusters["Vessels"]
+                          if name not in self.config.markers_to_ignore]
+        self.assertEqual(vessel_names, expected_names)
+
+        # The subset is read in stacking order, not in the order it is given
+        self.config.markers_to_load = ["GFAP", "SMA"]
+        subset_masks, subset_data, subset_names = MIBIReader(self.config).get_all_point_data()
+
+        self.assertEqual(subset_names, ["SMA", "GFAP"])
+
+        for point_idx in range(self.config.n_points):
+            self.assertEqual(vessel_data[point_idx].shape,
+                             (len(expected_names),) + tuple(self.config.segmentation_mask_size))
+            self.assertEqual(subset_data[point_idx].shape, (2,) + tuple(self.config.segmentation_mask_size))
+
+            for marker_names, marker_data in [(vessel_names, vessel_data), (subset_names, subset_data)]:
+                for marker_idx, marker_name in enumerate(marker_names):
+                    np.testing.assert_array_equal(marker_data[point_idx][marker_idx],
+                                                  data[point_idx][names.index(marker_name)])
+
+    def test_reading_allocations_are_traced_per_point(self):
+        self.config.trace_reading_allocations = True
+        mibi_reader = MIBIReader(self.config)
+
+        # Every point stays referenced, so the peaks only stay level if the trace is reset between points
+        masks, data, names = mibi_reader.get_all_point_data()
+        peaks = [mibi_reader.point_peak_allocations[fov] for fov in ["Point1", "Point2", "Point3"]]
+
+        self.assertEqual(len(mibi_reader.point_peak_allocations), self.config.n_points)
+        self.assertFalse(tracemalloc.is_tracing())
+
+        for peak, marker_data in zip(peaks, data):
+            self.assertGreaterEqual(peak, marker_data.nbytes)
+
+        self.assertLess(max(peaks), 2 * min(peaks))
+
+    def test_point_cache_returns_memory_mapped_views(self):
+        masks, data, names = MIBIReader(self.config).get_all_point_data()
+
+        self.config.point_cache_dir = os.path.join(self.root, "point_cache")
+        mibi_reader = MIBIReader(self.config)
+        mibi_reader.ingest_point_cache()
+        cached_masks, cached_data, cached_names = mibi_reader.get_all_point_data()
+
+        self.assertEqual(cached_names, names)
+
+        for point_idx in range(self.config.n_points):
+            self.assertIsInstance(cached_data[point_idx], np.memmap)
+            np.testing.assert_array_equal(cached_data[point_idx], data[point_idx])
+            np.testing.assert_array_equal(cached_masks[point_idx], masks[point_idx])
+
+    def test_point_cache_is_invalidated_by_sources_and_settings(self):
+        self.config.point_cache_dir = os.path.join(self.root, "point_cache")
+        mibi_reader = MIBIReader(self.config)
+        fov, data_loc, mask_loc = mibi_reader.get_point_locations()[0]
+        mibi_reader.read(data_loc, mask_loc)
+
+        # Edit a marker TIF after it was cached
+        counts = np.full(self.config.segmentation_mask_size, 7, np.uint8)
+        imwrite(os.path.join(data_loc, "SMA.tif"), counts)
+        os.utime(os.path.join(data_loc, "SMA.tif"), ns=(0, 0))
+
+        segmentation_mask, marker_data, marker_names = mibi_reader.read(data_loc, mask_loc)
+        np.testing.assert_array_equal(marker_data[marker_names.index("SMA")], counts)
+
+        self.config.marker_data_dtype = "uint16"
+        segmentation_mask, marker_data, marker_names = MIBIReader(self.config).read(data_loc, mask_loc)
+        self.assertEqual(marker_data.dtype, np.uint16)
+        np.testing.assert_array_equal(marker_data[marker_names.index("SMA")], counts)
+
+    def test_marker_data_dtype_refuses_lossy_cast(self):
+        mibi_reader = MIBIReader(self.config)
+        fov, data_loc, mask_loc = mibi_reader.get_point_locations()[0]
+
+        self.config.marker_data_dtype = "uint16"
+        segmentation_mask, marker_data, marker_names = MIBIReader(self.config).read(data_loc, mask_loc)
+        self.assertEqual(marker_data.dtype, np.uint16)
+
+        # Counts above 255 cannot be held by uint8
+        counts = np.full(self.config.segmentation_mask_size, 300, np.uint16)
+        imwrite(os.path.join(data_loc, "SMA.tif"), counts)
+
+        self.config.marker_data_dtype = "uint8"
+
+        with self.assertRaises(ValueError) as context:
+            MIBIReader(self.config).read(data_loc, mask_loc)
+
+        self.assertIn("SMA.tif", str(context.exception))
+
+    def test_validate_dataset_reports_missing_marker(self):
+        self.config.manifest_path = os.path.join(self.root, "manifest.json")
+        MIBIReader(self.config).validate_dataset()
+
+        self.assertTrue(os.path.isfile(self.config.manifest_path))
+
+        os.remove(os.path.join(self.config.data_dir, "Point2", self.config.tifs_dir, "CD105.tif"))
+
+        with self.assertRaises(ValueError) as context:
+            MIBIReader(self.config).validate_dataset()
+
+        self.assertIn("Point2: missing marker CD105", str(context.exception))
+
+    def test_multipage_ome_tiff_matches_single_tifs(self):
+        mibi_reader = MIBIReader(self.config)
+        masks, data, names = mibi_reader.get_all_point_data()
+
+        # Write every point as an OME-TIFF stack with the channels in reverse order
+        for point_idx, (fov, data_loc, mask_loc) in enumerate(mibi_reader.get_point_locations()):
+            imwrite(os.path.join(data_loc, "stack.ome.tif"),
+                    data[point_idx][::-1],
+                    ome=True,
+                    metadata={"axes": "CYX", "Channel": {"Name": names[::-1]}})
+
+        self.config.multipage_tiff_name = "stack.ome.tif"
+        mibi_reader = MIBIReader(self.config)
+        mibi_reader.validate_dataset()
+        stack_masks, stack_data, stack_names = mibi_reader.get_all_point_data()
+
+        self.assertEqual(stack_names, names)
+
+        for point_idx in range(self.config.n_points):
+            np.testing.assert_array_equal(stack_data[point_idx], data[point_idx])
+
+    def test_validate_dataset_checks_multipage_channels(self):
+        self.config.manifest_path = os.path.join(self.root, "manifest.json")
+        mibi_reader = MIBIReader(self.config)
+        mibi_reader.validate_dataset()
+        masks, data, names = mibi_reader.get_all_point_data()
+
+        # Every stack is missing the SMA channel
+        kept = [marker_idx for marker_idx, name in enumerate(names) if name != "SMA"]
+
+        for point_idx, (fov, data_loc, mask_loc) in enumerate(mibi_reader.get_point_locations()):
+            imwrite(os.path.join(data_loc, "stack.ome.tif"),
+                    data[point_idx][kept],
+                    ome=True,
+                    metadata={"axes": "CYX", "Channel": {"Name": [names[marker_idx] for marker_idx in kept]}})
+
+        # The manifest of the separate TIFs must not be reused for the stacks
+        self.config.multipage_tiff_name = "stack.ome.tif"
+
+        with self.assertRaises(ValueError) as context:
+            MIBIReader(self.config).validate_dataset()
+
+        self.assertIn("Point1: missing marker SMA from the channels", str(context.exception))
+
+        with open(self.config.manifest_path, "r") as f:
+            self.assertEqual(json.load(f)["multipage_tiff_name"], "stack.ome.tif")
+
+
+if __name__ == '__main__':
+    unittest.main()
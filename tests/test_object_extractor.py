@@ -0,0 +1,46 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from utils.mibi_reader import MIBIReader
+from utils.object_extractor import ObjectExtractor
+from tests.test_mibi_reader import create_synthetic_dataset
+
+
+class TestObjectExtractor(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = create_synthetic_dataset(self.root, n_points=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_single_channel_and_rgb_masks_give_the_same_contours(self):
+        fov, data_loc, mask_loc = MIBIReader(self.config).get_point_locations()[0]
+
+        self.config.load_rgb_segmentation_masks = False
+        mask = MIBIReader(self.config).read_segmentation_mask(mask_loc)
+        rois, contours, removed_contours = ObjectExtractor(self.config).extract(mask)
+
+        self.config.load_rgb_segmentation_masks = True
+        rgb_mask = MIBIReader(self.config).read_segmentation_mask(mask_loc)
+        rgb_rois, rgb_contours, rgb_removed_contours = ObjectExtractor(self.config).extract(rgb_mask)
+
+        self.assertEqual(mask.ndim, 2)
+        self.assertEqual(rgb_mask.ndim, 3)
+        self.assertEqual(len(contours), 2)
+        self.assertEqual(len(contours), len(rgb_contours))
+        self.assertEqual(len(removed_contours), len(rgb_removed_contours))
+
+        for cnt, rgb_cnt in zip(contours, rgb_contours):
+            np.testing.assert_array_equal(cnt, rgb_cnt)
+
+        for roi, rgb_roi in zip(rois, rgb_rois):
+            self.assertEqual(roi.shape, rgb_roi.shape[:2])
+
+
+if __name__ == '__main__':
+    unittest.main()
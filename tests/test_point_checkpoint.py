@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from config.config_settings import Config
+from utils.point_checkpoint import PointCheckpoint
+from utils.utils_functions import config_fingerprint
+
+
+class TestPointCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.run_dir = tempfile.mkdtemp()
+        self.config = Config()
+
+    def tearDown(self):
+        shutil.rmtree(self.run_dir)
+
+    def test_config_fingerprint(self):
+        fields = ["pixel_interval", "expression_type"]
+        fingerprint = config_fingerprint(self.config, fields)
+
+        self.config.segmentation_mask_size = (16, 16)
+        self.assertEqual(config_fingerprint(self.config, fields), fingerprint)
+
+        self.config.pixel_interval += 1
+        self.assertNotEqual(config_fingerprint(self.config, fields), fingerprint)
+
+    def test_save_and_load(self):
+        checkpoint = PointCheckpoint(self.run_dir, self.config)
+
+        self.assertIsNone(checkpoint.load(1))
+
+        checkpoint.save(2, ([1, 2], [0, 1]))
+        checkpoint.save(10, ([3], [0]))
+
+        self.assertEqual(checkpoint.completed_points(), [2, 10])
+        self.assertEqual(PointCheckpoint(self.run_dir, self.config).load(2), ([1, 2], [0, 1]))
+
+        # Only the manifest and the point blocks are left behind
+        self.assertEqual(sorted(os.listdir(self.run_dir)), ["Point10.pkl", "Point2.pkl", "checkpoint.json"])
+
+    def test_stale_points_are_discarded(self):
+        PointCheckpoint(self.run_dir, self.config).save(1, "features")
+
+        self.config.expression_type = "mean"
+        checkpoint = PointCheckpoint(self.run_dir, self.config)
+
+        self.assertEqual(checkpoint.completed_points(), [])
+        self.assertIsNone(checkpoint.load(1))
+
+    def test_marker_changes_discard_points(self):
+        marker_names = ["SMA", "CD31"]
+
+        PointCheckpoint(self.run_dir, self.config, marker_names=marker_names).save(1, "features")
+        self.assertEqual(PointCheckpoint(self.run_dir, self.config, marker_names=marker_names).load(1), "features")
+
+        # The same markers stacked in a different order
+        checkpoint = PointCheckpoint(self.run_dir, self.config, marker_names=marker_names[::-1])
+        self.assertEqual(checkpoint.completed_points(), [])
+
+        checkpoint.save(1, "features")
+
+        self.config.marker_clusters = dict(self.config.marker_clusters, Extra=["SMA"])
+        checkpoint = PointCheckpoint(self.run_dir, self.config, marker_names=marker_names[::-1])
+        self.assertEqual(checkpoint.completed_points(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
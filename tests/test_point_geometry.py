@@ -0,0 +1,164 @@
+import unittest
+
+import numpy as np
+import cv2 as cv
+from scipy import ndimage
+
+from config.config_settings import Config
+from utils.markers_feature_gen import contract_vessel_region, expand_vessel_region, \
+    calculate_microenvironment_marker_expression, calculate_inward_microenvironment_marker_expression
+from utils.point_geometry import PointGeometry
+
+
+class TestPointGeometry(unittest.TestCase):
+
+    def test_rings_match_per_expansion_masks(self):
+        img_shape = (48, 64)
+        contours = []
+
+        for center, radius in [((12, 12), 5), ((48, 30), 8)]:
+            mask = np.zeros(img_shape, np.uint8)
+            cv.circle(mask, center, radius, 255, cv.FILLED)
+            contours.extend(cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)[-2])
+
+        geometry = PointGeometry(contours, img_shape)
+
+        for idx, cnt in enumerate(contours):
+            for lower_bound, upper_bound in [(0, 3), (3, 6), (6, 9), (-2, 4), (0, 0.5)]:
+                np.testing.assert_array_equal(geometry.expand(idx, upper_bound, lower_bound),
+                                              expand_vessel_region(cnt, img_shape, upper_bound, lower_bound))
+                np.testing.assert_array_equal(geometry.contract(idx, upper_bound, lower_bound),
+                                              contract_vessel_region(cnt, img_shape, upper_bound, lower_bound))
+
+            np.testing.assert_array_equal(geometry.vessel_mask(idx),
+                                          cv.drawContours(np.zeros(img_shape, np.uint8), [cnt], -1, 1, cv.FILLED))
+
+        self.assertEqual(len(geometry._signed_distances), len(contours))
+
+        geometry.release()
+
+        self.assertIsNone(geometry._owner_labels)
+        self.assertEqual(len(geometry._signed_distances), 0)
+
+    def test_windowed_expression_matches_full_frame(self):
+        config = Config()
+        img_shape = (48, 64)
+        contours = []
+
+        # The second vessel touches the edge of the image
+        for center, radius in [((20, 20), 5), ((60, 40), 6)]:
+            mask = np.zeros(img_shape, np.uint8)
+            cv.circle(mask, center, radius, 255, cv.FILLED)
+            contours.extend(cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)[-2])
+
+        marker_names = ["A", "B", "C"]
+        marker_data = np.random.default_rng(0).integers(0, 5, (len(marker_names),) + img_shape).astype(np.float32)
+        areas = [cv.contourArea(cnt) for cnt in contours]
+
+        full_frame = PointGeometry(contours, img_shape)
+        windowed = PointGeometry(contours, img_shape, max_distance=6)
+
+        for lower_bound, upper_bound in [(0, 3), (3, 6)]:
+            expected = calculate_microenvironment_marker_expression(config, marker_data, contours, areas, marker_names,
+                                                                    pixel_expansion_upper_bound=upper_bound,
+                                                                    pixel_expansion_lower_bound=lower_bound,
+                                                                    geometry=full_frame)[0]
+            result = calculate_microenvironment_marker_expression(config, marker_data, contours, areas, marker_names,
+                                                                  pixel_expansion_upper_bound=upper_bound,
+                                                                  pixel_expansion_lower_bound=lower_bound,
+                                                                  geometry=windowed)[0]
+            np.testing.assert_array_equal(result[marker_names].to_numpy(), expected[marker_names].to_numpy())
+
+            expected = calculate_inward_microenvironment_marker_expression(config, marker_data, 1, -1, set(),
+                                                                           contours, areas, marker_names,
+                                                                           pixel_expansion_upper_bound=upper_bound,
+                                                                           pixel_expansion_lower_bound=lower_bound,
+                                                                           geometry=full_frame)[0]
+            result = calculate_inward_microenvironment_marker_expression(config, marker_data, 1, -1, set(),
+                                                                         contours, areas, marker_names,
+                                                                         pixel_expansion_upper_bound=upper_bound,
+                                                                         pixel_expansion_lower_bound=lower_bound,
+                                                                         geometry=windowed)[0]
+            np.testing.assert_array_equal(result[marker_names].to_numpy(), expected[marker_names].to_numpy())
+
+    def test_equidistant_pixels_are_not_owned(self):
+        img_shape = (48, 64)
+
+        rng = np.random.RandomState(0)
+        layouts = [[((16, 24), 5), ((40, 24), 5)], [((12, 12), 4), ((36, 36), 4), ((12, 36), 4)]]
+        layouts += [[((rng.randint(64), rng.randint(48)), rng.randint(2, 6)) for _ in range(4)] for _ in range(5)]
+
+        for layout in layouts:
+            contours = []
+
+            for center, radius in layout:
+                mask = np.zeros(img_shape, np.uint8)
+                cv.circle(mask, center, radius, 255, cv.FILLED)
+                contours.extend(cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)[-2])
+
+            # Regions as assigned by comparing one distance transform per vessel, and the exact distances, whose ties
+            # the float32 distance transforms can break either way
+            distances = []
+            exact_distances = []
+
+            for i in range(len(contours)):
+                inverted = np.ones(img_shape, np.uint8)
+                cv.drawContours(inverted, contours, i, 0, cv.FILLED)
+                distances.append(cv.distanceTransform(inverted, cv.DIST_L2, cv.DIST_MASK_PRECISE))
+                exact_distances.append(ndimage.distance_transform_edt(inverted))
+
+            regions = [np.all([distances[i] < distances[j] for j in range(len(contours)) if j != i], axis=0)
+                       for i in range(len(contours))]
+
+            exact_distances = np.sort(exact_distances, axis=0)
+            tied = exact_distances[0] == exact_distances[1]
+
+            owner_labels = PointGeometry(contours, img_shape).owner_labels
+
+            np.testing.assert_array_equal(owner_labels[tied], -1)
+
+            for idx, cnt in enumerate(contours):
+                np.testing.assert_array_equal(owner_labels == idx, regions[idx] & ~tied)
+
+                for upper_bound in [3, 6]:
+                    expanded = expand_vessel_region(cnt, img_shape, upper_bound)
+
+                    np.testing.assert_array_equal(cv.bitwise_and(expanded, (owner_labels == idx).astype(np.uint8)),
+                                                  cv.bitwise_and(expanded, (regions[idx] & ~tied).astype(np.uint8)))
+
+            if layout == layouts[0]:
+                # The vessels are mirror images, so the middle column is owned by neither
+                self.assertTrue(np.all(owner_labels[:, 28] == -1))
+
+    def test_ties_far_from_the_vessels_are_not_owned(self):
+        img_shape = (120, 160)
+
+        rng = np.random.RandomState(6)
+
+        for _ in range(3):
+            contours = []
+
+            # Vessels clustered in one corner, so the cells of the outer vessels stretch across the empty frame
+            for _ in range(8):
+                mask = np.zeros(img_shape, np.uint8)
+                cv.circle(mask, (rng.randint(30), rng.randint(30)), rng.randint(0, 4), 255, cv.FILLED)
+                contours.extend(cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)[-2])
+
+            exact_distances = []
+
+            for i in range(len(contours)):
+                inverted = np.ones(img_shape, np.uint8)
+                cv.drawContours(inverted, contours, i, 0, cv.FILLED)
+                exact_distances.append(ndimage.distance_transform_edt(inverted))
+
+            exact_distances = np.array(exact_distances)
+            closest_distances = exact_distances.min(axis=0)
+
+            expected = np.where(np.sum(exact_distances == closest_distances, axis=0) > 1, -1,
+                                np.argmin(exact_distances, axis=0))
+
+            np.testing.assert_array_equal(PointGeometry(contours, img_shape).owner_labels, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+from utils.prefetcher import Prefetcher
+
+
+class TestPrefetcher(unittest.TestCase):
+
+    def test_items_are_yielded_in_order(self):
+        prefetcher = Prefetcher(iter(range(10)), depth=3)
+
+        self.assertEqual(list(prefetcher), list(range(10)))
+        self.assertEqual(len(prefetcher.stall_times), 10)
+
+    def test_producer_exceptions_are_raised_in_consumer(self):
+        def points():
+            yield 1
+            raise FileNotFoundError("Point2")
+
+        with self.assertRaises(FileNotFoundError):
+            list(Prefetcher(points()))
+
+    def test_source_is_closed_when_consumer_stops_early(self):
+        closed = []
+
+        def points():
+            try:
+                for point_num in range(100):
+                    yield point_num
+            finally:
+                closed.append(True)
+
+        source = points()
+        prefetcher = Prefetcher(source, depth=2)
+        items = iter(prefetcher)
+
+        for point_num in items:
+            if point_num == 3:
+                break
+
+        # The source is still referenced, so only the prefetcher can close it
+        items.close()
+
+        self.assertEqual(closed, [True])
+        self.assertFalse(prefetcher._thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+
+import numpy as np
+import cv2 as cv
+
+from config.config_settings import Config
+from utils.markers_feature_gen import calculate_microenvironment_marker_expression
+from utils.point_geometry import PointGeometry
+from utils.sparse_markers import SparseMarkerData
+
+
+class TestRingHistogram(unittest.TestCase):
+
+    def test_ring_sums_match_ring_masks(self):
+        img_shape = (64, 80)
+        contours = []
+
+        for center, radius in [((15, 15), 4), ((40, 30), 7), ((70, 55), 5)]:
+            mask = np.zeros(img_shape, np.uint8)
+            cv.circle(mask, center, radius, 255, cv.FILLED)
+            contours.extend(cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)[-2])
+
+        marker_data = np.random.default_rng(0).integers(0, 4, (3,) + img_shape).astype(np.float32)
+        upper_bounds = [2.5, 5.0, 7.5, 10.0]
+
+        geometry = PointGeometry(contours, img_shape, max_distance=12.5)
+
+        for data in [marker_data, SparseMarkerData.from_dense(marker_data)]:
+            ring_histogram = geometry.ring_histogram(data, upper_bounds)
+            geometry.release()
+
+            for idx in range(len(contours)):
+                region = geometry.region(idx)
+                lower_mask = geometry.vessel_mask(idx)
+
+                for ring_num, upper_bound in enumerate(upper_bounds, start=1):
+                    upper_mask = geometry.expand(idx, upper_bound=upper_bound)
+                    ring_mask = cv.bitwise_and(upper_mask - lower_mask, region)
+                    lower_mask = upper_mask
+
+                    np.testing.assert_array_equal(ring_histogram.sums[idx, ring_num],
+                                                  (marker_data * ring_mask).sum(axis=(1, 2)))
+                    np.testing.assert_array_equal(ring_histogram.nonzero_counts[idx, ring_num],
+                                                  ((marker_data * ring_mask) != 0).sum(axis=(1, 2)))
+                    self.assertEqual(ring_histogram.pixel_counts[idx, ring_num], cv.countNonZero(ring_mask))
+
+                self.assertEqual(ring_histogram.pixel_counts[idx, 0], cv.countNonZero(geometry.vessel_mask(idx)))
+                self.assertEqual(ring_histogram.pixel_counts[idx].sum(), cv.countNonZero(region))
+
+                for ring_num, upper_bound in enumerate(upper_bounds, start=1):
+                    vascular_mask = cv.bitwise_and(geometry.expand(idx, upper_bound=upper_bound), region)
+                    dark_space_mask = region - vascular_mask
+
+                    for (sums, nonzero_counts, area), space_mask in [(ring_histogram.within(idx, ring_num),
+                                                                      vascular_mask),
+                                                                     (ring_histogram.beyond(idx, ring_num),
+                                                                      dark_space_mask)]:
+                        np.testing.assert_array_equal(sums, (marker_data * space_mask).sum(axis=(1, 2)))
+                        np.testing.assert_array_equal(nonzero_counts,
+                                                      ((marker_data * space_mask) != 0).sum(axis=(1, 2)))
+                        self.assertEqual(area, cv.countNonZero(space_mask))
+
+    def test_expression_from_histogram_matches_masks(self):
+        config = Config()
+        img_shape = (64, 80)
+        contours = []
+
+        for center, radius in [((20, 20), 5), ((50, 40), 6)]:
+            mask = np.zeros(img_shape, np.uint8)
+            cv.circle(mask, center, radius, 255, cv.FILLED)
+            contours.extend(cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)[-2])
+
+        marker_names = ["A", "B", "C"]
+        marker_data = np.random.default_rng(0).integers(0, 4, (len(marker_names),) + img_shape).astype(np.float32)
+        areas = [cv.contourArea(cnt) for cnt in contours]
+
+        geometry = PointGeometry(contours, img_shape, max_distance=10)
+        ring_histogram = geometry.ring_histogram(marker_data, [5, 10])
+
+        for expansion_num, (lower_bound, upper_bound) in enumerate([(0, 5), (5, 10)], start=1):
+            kwargs = dict(pixel_expansion_upper_bound=upper_bound,
+                          pixel_expansion_lower_bound=lower_bound,
+                          expansion_num=expansion_num,
+                          geometry=geometry,
+                          return_rows=True)
+
+            expected, expected_images, expected_stopped = calculate_microenvironment_marker_expression(
+                config, marker_data, contours, areas, marker_names, **kwargs)
+            rows, expression_images, stopped = calculate_microenvironment_marker_expression(
+                config, marker_data, contours, areas, marker_names, ring_histogram=ring_histogram, **kwargs)
+
+            np.testing.assert_allclose(rows.values, expected.values)
+            self.assertEqual(stopped, expected_stopped)
+            self.assertEqual(len(expected_images), len(contours))
+
+            # No ring masks or expression images are built when the histogram holds the sums
+            self.assertEqual(expression_images, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from unittest import mock
+
+import numpy as np
+
+from utils.shared_arena import SharedArena, SharedArrayHandle
+
+
+def _sum_shared_array(handle: SharedArrayHandle) -> float:
+    attached = handle.attach()
+
+    try:
+        return float(attached.array.sum())
+    finally:
+        attached.close()
+
+
+class TestSharedArena(unittest.TestCase):
+
+    def test_workers_attach_by_name(self):
+        marker_data = np.random.default_rng(0).integers(0, 10, (4, 32, 48)).astype(np.uint8)
+
+        with SharedArena() as arena:
+            handle = arena.publish(0, marker_data)
+
+            attached = handle.attach()
+            np.testing.assert_array_equal(attached.array, marker_data)
+            self.assertFalse(attached.array.flags.writeable)
+            attached.close()
+
+            with ProcessPoolExecutor(max_workers=2) as executor:
+                self.assertEqual(executor.submit(_sum_shared_array, handle).result(), float(marker_data.sum()))
+
+    def test_only_the_arena_tracks_its_segments(self):
+        with mock.patch.object(resource_tracker, "register", wraps=resource_tracker.register) as register:
+            with SharedArena() as arena:
+                handle = arena.publish(0, np.ones((2, 8, 8), np.float32))
+
+                attached = handle.attach()
+                attached.close()
+
+        self.assertEqual(register.call_count, 1)
+
+    def test_segments_are_unlinked(self):
+        arena = SharedArena()
+        handles = [arena.publish(i, np.ones((2, 8, 8), np.float32)) for i in range(3)]
+
+        arena.release(0)
+        self.assertEqual(len(arena), 2)
+
+        with self.assertRaises(FileNotFoundError):
+            handles[0].attach()
+
+        with self.assertRaises(ValueError):
+            with arena:
+                raise ValueError
+
+        self.assertEqual(len(arena), 0)
+
+        for handle in handles[1:]:
+            with self.assertRaises(FileNotFoundError):
+                handle.attach()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+import numpy as np
+import cv2 as cv
+
+from utils.markers_feature_gen import get_marker_expression_vector
+from utils.sparse_markers import SparseMarkerData
+
+
+class TestSparseMarkerData(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.marker_data = rng.poisson(0.1, (5, 32, 32)).astype(np.uint8)
+        self.sparse_marker_data = SparseMarkerData.from_dense(self.marker_data)
+
+        self.mask = np.zeros((32, 32), np.uint8)
+        cv.circle(self.mask, (12, 14), 7, 1, cv.FILLED)
+
+    def test_dense_round_trip(self):
+        self.assertEqual(self.sparse_marker_data.shape, self.marker_data.shape)
+        np.testing.assert_array_equal(self.sparse_marker_data.toarray(), self.marker_data)
+        np.testing.assert_array_equal(self.sparse_marker_data[3], self.marker_data[3])
+        np.testing.assert_array_equal(self.sparse_marker_data.crop(4, 6, 10, 8), self.marker_data[:, 6:14, 4:14])
+
+    def test_expression_matches_dense(self):
+        for expression_type in ["mean", "area_normalized_counts", "counts"]:
+            dense = get_marker_expression_vector(self.marker_data, self.mask, expression_type=expression_type)
+            sparse = get_marker_expression_vector(self.sparse_marker_data, self.mask, expression_type=expression_type)
+
+            np.testing.assert_allclose(sparse, dense)
+
+    def test_windowed_expression_matches_dense(self):
+        window = (slice(5, 23), slice(3, 22))
+
+        for expression_type in ["mean", "area_normalized_counts", "counts"]:
+            dense = get_marker_expression_vector(self.marker_data, self.mask, expression_type=expression_type)
+            sparse = get_marker_expression_vector(self.sparse_marker_data,
+                                                  self.mask[window],
+                                                  expression_type=expression_type,
+                                                  window=window)
+
+            np.testing.assert_allclose(sparse, dense)
+
+    def test_nbytes_counts_every_array(self):
+        sparse_marker_data = self.sparse_marker_data
+
+        self.assertEqual(sparse_marker_data.nbytes,
+                         sparse_marker_data.data.nbytes
+                         + sparse_marker_data.marker_indices.nbytes
+                         + sparse_marker_data.indptr.nbytes)
+        self.assertEqual(sparse_marker_data.marker_indices.dtype, np.uint8)
+
+        # Typical ion counts are mostly zero, so the sparse layout has to be smaller than the dense stack
+        marker_data = np.random.RandomState(1).poisson(0.05, (40, 128, 128)).astype(np.uint8)
+        self.assertLess(SparseMarkerData.from_dense(marker_data).nbytes, marker_data.nbytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
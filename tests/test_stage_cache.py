@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from config.config_settings import Config
+from utils.stage_cache import StageCache, input_fingerprint
+
+
+class TestStageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.config = Config()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_stage_keys_follow_stage_settings(self):
+        keys = StageCache.stage_keys(self.config, "inputs")
+
+        self.config.create_expansion_violin_plots = not self.config.create_expansion_violin_plots
+        self.assertEqual(StageCache.stage_keys(self.config, "inputs"), keys)
+
+        self.config.scaling_factor += 1
+        normalize_keys = StageCache.stage_keys(self.config, "inputs")
+        self.assertEqual(normalize_keys["expand"], keys["expand"])
+        self.assertNotEqual(normalize_keys["normalize"], keys["normalize"])
+
+        self.config.pixel_interval += 1
+        expand_keys = StageCache.stage_keys(self.config, "inputs")
+        self.assertEqual(expand_keys["extract"], keys["extract"])
+        self.assertNotEqual(expand_keys["expand"], keys["expand"])
+        self.assertNotEqual(expand_keys["normalize"], normalize_keys["normalize"])
+
+        self.assertEqual(list(expand_keys.keys()), ["extract", "expand", "normalize"])
+
+        for stage, key in StageCache.stage_keys(self.config, "changed inputs").items():
+            self.assertNotEqual(key, expand_keys[stage])
+
+    def test_input_fingerprint(self):
+        data_loc = os.path.join(self.cache_dir, "Point1")
+        os.makedirs(data_loc)
+        mask_loc = os.path.join(self.cache_dir, "mask.tif")
+
+        with open(mask_loc, "wb") as f:
+            f.write(b"mask")
+
+        point_locations = [("Point1", data_loc, mask_loc)]
+        marker_names = ["SMA", "CD31"]
+
+        fingerprint = input_fingerprint(self.config, point_locations, marker_names)
+
+        # The same markers stacked in a different order
+        self.assertNotEqual(input_fingerprint(self.config, point_locations, marker_names[::-1]), fingerprint)
+
+        self.config.marker_clusters = dict(self.config.marker_clusters, Extra=["SMA"])
+        self.assertNotEqual(input_fingerprint(self.config, point_locations, marker_names), fingerprint)
+
+        fingerprint = input_fingerprint(self.config, point_locations, marker_names)
+
+        with open(os.path.join(data_loc, "SMA.tif"), "wb") as f:
+            f.write(b"SMA")
+
+        self.assertNotEqual(input_fingerprint(self.config, point_locations, marker_names), fingerprint)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = StageCache(self.cache_dir)
+        payload = b"0" * 1000
+
+        for stage in ["extract", "expand", "normalize"]:
+            cache.put(stage, "key", payload)
+            time.sleep(0.01)
+
+        self.assertEqual(cache.get("expand", "key"), payload)
+        self.assertIsNone(cache.get("expand", "other key"))
+
+        cache.max_bytes = 2 * os.path.getsize(cache.path("expand", "key"))
+        cache.evict()
+
+        # The expand entry was used after the normalize entry was stored, so only the extract entry is evicted
+        self.assertIsNone(cache.get("extract", "key"))
+        self.assertEqual(cache.get("normalize", "key"), payload)
+        self.assertEqual(cache.get("expand", "key"), payload)
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+import json
+import os
+import logging
+
+from config.config_settings import Config
+from utils import tiff_reader
+
+'''
+Authors: Aswin Visva, John-Paul Oliveria, Ph.D
+'''
+
+
+def describe_file(path: str, stack: bool = False) -> dict:
+    """
+    Describe a TIF file from its file system entry and TIFF header, without decoding any pixels
+
+    :param path: str, Path to file
+    :param stack: bool, The file is a multi-page stack, also describe the channel names of its pages
+    :return: dict, Path, shape, data type, size in bytes and modification time of the file
+    """
+
+    stat = os.stat(path)
+    shape, dtype = tiff_reader.read_header(path)
+
+    description = {
+        "path": path,
+        "shape": list(shape),
+        "dtype": dtype.str,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime
+    }
+
+    if stack:
+        try:
+            description["channels"] = tiff_reader.read_channel_names(path)
+        except ValueError:
+            description["channels"] = None
+
+    return description
+
+
+class DatasetManifest:
+
+    def __init__(self, config: Config, points: list = None, multipage_tiff_name: str = None):
+        """
+        Dataset Manifest class
+
+        Index of every marker TIF and segmentation mask of the dataset, so that a run can be validated before it starts
+        and point paths do not need to be rebuilt from the directory layout
+
+        :param config: Config, configuration settings
+        :param points: list, [n_points] -> Point entries holding the name, marker data directory, segmentation mask
+        path and file descriptions of a point
+        :param multipage_tiff_name: str, Name of the multi-page stack holding the markers of each point, None if every
+        marker is a separate TIF
+        """
+        self.config = config
+        self.points = points if points is not None else []
+        self.multipage_tiff_name = multipage_tiff_name
+
+    @classmethod
+    def build(cls, config: Config, point_locations: list, marker_names: list):
+        """
+        Scan the dataset once and describe every file from its TIFF header
+
+        :param config: Config, configuration settings
+        :param point_locations: list, [n_points] -> (Point name, Marker data directory, Segmentation mask path)
+        :param marker_names: array_like, [n_markers] -> Names of markers
+        :return: DatasetManifest, Manifest of the dataset
+        """
+
+        points = []
+        stack = config.multipage_tiff_name is not None
+
+        for fov, data_loc, mask_loc in point_locations:
+            markers = {}
+            descriptions = {}
+
+            for marker_name in marker_names:
+                # Markers are either separate TIFs or pages of one multi-page stack, which is only described once
+                if stack:
+                    path = os.path.join(data_loc, config.multipage_tiff_name)
+                else:
+                    path = os.path.join(data_loc, "%s.tif" % marker_name)
+
+                if path not in descriptions:
+                    descriptions[path] = describe_file(path, stack=stack) if os.path.isfile(path) else {"path": path}
+
+                markers[marker_name] = dict(descriptions[path])
+
+            mask = describe_file(mask_loc) if os.path.isfile(mask_loc) else {"path": mask_loc}
+
+            points.append({
+                "name": fov,
+                "data_loc": data_loc,
+                "mask_loc": mask_loc,
+                "markers": markers,
+                "mask": mask
+            })
+
+        return cls(config, points, config.multipage_tiff_name)
+
+    @classmethod
+    def load(cls, config: Config, path: str):
+        """
+        Load a manifest from an index file
+
+        :param config: Config, configuration settings
+        :param path: str, Path to index file
+        :return: DatasetManifest, Manifest of the dataset
+        """
+
+        with open(path, "r") as f:
+            manifest = json.load(f)
+
+        return cls(config, manifest["points"], manifest.get("multipage_tiff_name"))
+
+    def save(self, path: str):
+        """
+        Save the manifest to an index file
+
+        :param path: str, Path to index file
+        """
+
+        tmp_path = "%s.tmp%s" % (path, os.getpid())
+
+        with open(tmp_path, "w") as f:
+            json.dump({"multipage_tiff_name": self.multipage_tiff_name, "points": self.points}, f)
+
+        os.replace(tmp_path, path)
+
+    def get_point_locations(self) -> list:
+        """
+        Get the marker data directory and segmentation mask path of every point
+
+        :return: list, [n_points] -> (Point name, Marker data directory, Segmentation mask path)
+        """
+
+        return [(point["name"], point["data_loc"], point["mask_loc"]) for point in self.points]
+
+    def matches(self, point_locations: list, marker_names: list) -> bool:
+        """
+        Check if the manifest indexes exactly the given points and markers, read from the configured multi-page stack
+
+        :param point_locations: list, [n_points] -> (Point name, Marker data directory, Segmentation mask path)
+        :param marker_names: array_like, [n_markers] -> Names of markers
+        :return: bool, True if the manifest matches
+        """
+
+        return self.multipage_tiff_name == self.config.multipage_tiff_name and \
+            self.get_point_locations() == [tuple(location) for location in point_locations] and \
+            all(list(point["markers"].keys()) == list(marker_names) for point in self.points)
+
+    def validate(self) -> list:
+        """
+        Validate the dataset against the manifest. Files are checked with a single stat call, and only files which
+        changed since the manifest was built have their TIFF header read again.
+
+        :return: list, Description of every problem found, empty if the dataset is valid
+        """
+
+        expected_shape = list(self.config.segmentation_mask_size)
+        stack = self.multipage_tiff_name is not None
+        problems = []
+
+        for point in self.points:
+            for marker_name, entry in point["markers"].items():
+                entry = self._refresh(entry, stack=stack)
+
+                if entry is None or "shape" not in entry:
+                    problems.append("%s: missing marker %s (%s)" % (point["name"], marker_name,
+                                                                   point["markers"][marker_name]["path"]))
+                elif entry["shape"][-2:] != expected_shape:
+                    problems.append("%s: marker %s has shape %s, expected %s" % (point["name"],
+                                                                                marker_name,
+                                                                                str(entry["shape"]),
+                                                                                str(expected_shape)))
+                elif stack and entry.get("channels") is None:
+                    problems.append("%s: could not read the channel names of %s" % (point["name"], entry["path"]))
+                elif stack and marker_name not in entry["channels"]:
+                    problems.append("%s: missing marker %s from the channels of %s" % (point["name"],
+                                                                                       marker_name,
+                                                                                       entry["path"]))
+
+            mask = self._refresh(point["mask"])
+
+            if mask is None or "shape" not in mask:
+                logging.warning("%s: missing segmentation mask %s, a blank mask will be used" % (point["name"],
+                                                                                                point["mask_loc"]))
+            elif mask["shape"][:2] != expected_shape:
+                problems.append("%s: segmentation mask has shape %s, expected %s" % (point["name"],
+                                                                                    str(mask["shape"]),
+                                                                                    str(expected_shape)))
+
+        return problems
+
+    @staticmethod
+    def _refresh(entry: dict, stack: bool = False) -> dict:
+        """
+        Get the current description of a file, re-reading its TIFF header only if its size or modification time
+        changed
+
+        :param entry: dict, File description stored in the manifest
+        :param stack: bool, The file is a multi-page stack, also describe the channel names of its pages
+        :return: dict, Current file description, None if the file does not exist
+        """
+
+        try:
+            stat = os.stat(entry["path"])
+        except FileNotFoundError:
+            return None
+
+        if entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+            return entry
+
+        entry.update(describe_file(entry["path"], stack=stack))
+
+        return entry
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+'''
+Authors: Aswin Visva, John-Paul Oliveria, Ph.D
+'''
+
+
+class ExpressionRows:
+
+    def __init__(self,
+                 marker_names: list,
+                 index: list = None,
+                 values: np.ndarray = None,
+                 contour_areas: np.ndarray = None):
+        """
+        Expression Rows class
+
+        Holds expression vectors in a NumPy array along with the (Point, Vessel, Expansion, Data Type) index and the
+        vessel contour area of every row, so that feature DataFrames are only built once all rows are collected.
+
+        :param marker_names: list, [n_markers] -> Marker names
+        :param index: list, [n_rows] -> (Point, Vessel, Expansion, Data Type) of every row
+        :param values: array_like, [n_rows, n_markers] -> Expression vectors
+        :param contour_areas: array_like, [n_rows] -> Contour area of the vessel of every row
+        """
+        self.marker_names = marker_names
+        self.index = index if index is not None else []
+        self.values = values if values is not None else np.zeros((0, len(marker_names)))
+        self.contour_areas = contour_areas if contour_areas is not None else np.zeros(0)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @classmethod
+    def concat(cls, all_rows: list):
+        """
+        Concatenate expression rows
+
+        :param all_rows: list, [n_blocks] -> Expression rows to concatenate, in order
+        :return: ExpressionRows, Concatenated expression rows
+        """
+        marker_names = all_rows[0].marker_names
+
+        # Empty blocks would otherwise promote the precision of the others
+        all_rows = [rows for rows in all_rows if len(rows) > 0] or all_rows[:1]
+
+        index = [row_index for rows in all_rows for row_index in rows.index]
+        values = np.concatenate([rows.values for rows in all_rows])
+        contour_areas = np.concatenate([rows.contour_areas for rows in all_rows])
+
+        return cls(marker_names, index, values, contour_areas)
+
+    def to_dataframe(self, large_vessel_threshold: float) -> pd.DataFrame:
+        """
+        Build the feature DataFrame
+
+        :param large_vessel_threshold: float, Contour area above which a vessel is large
+        :return: pd.DataFrame, [n_rows, n_markers + 2] -> Expression features indexed by (Point, Vessel, Expansion,
+        Data Type) with the contour area and vessel size of every row
+        """
+        features = pd.DataFrame(self.values,
+                                columns=self.marker_names,
+                                index=pd.MultiIndex.from_tuples(self.index) if len(self.index) > 0 else None)
+
+        features["Contour Area"] = self.contour_areas
+        features["Vessel Size"] = np.where(self.contour_areas > large_vessel_threshold, "Large", "Small").astype(object)
+
+        return features
@@ -0,0 +1,300 @@
+import numpy as np
+import pandas as pd
+
+from utils.expression_rows import ExpressionRows
+
+'''
+Authors: Aswin Visva, John-Paul Oliveria, Ph.D
+'''
+
+
+class FeatureStore:
+    data_types = ["Data", "Non-Vascular Space", "Vascular Space"]
+
+    def __init__(self,
+                 marker_names: list,
+                 point_nums: np.ndarray,
+                 vessel_offsets: np.ndarray,
+                 expansions: np.ndarray,
+                 values: np.ndarray,
+                 present: np.ndarray,
+                 contour_areas: np.ndarray,
+                 sma_positive: np.ndarray = None):
+        """
+        Feature Store class
+
+        Stores expression features in a dense [vessel, expansion, data type, marker] array. The vessels of all points
+        are stacked along the first axis and the vessels of a point are found through its offset, so selecting a
+        point, an expansion or a data type is a slice rather than a scan over a MultiIndex.
+
+        :param marker_names: list, [n_markers] -> Marker names
+        :param point_nums: array_like, [n_points] -> Point numbers, in order
+        :param vessel_offsets: array_like, [n_points + 1] -> Row of the first vessel of every point, followed by the
+        total number of vessels
+        :param expansions: array_like, [n_expansions] -> Expansion numbers, in increasing order
+        :param values: array_like, [n_vessels, n_expansions, n_data_types, n_markers] -> Expression features
+        :param present: array_like, [n_vessels, n_expansions, n_data_types] -> Whether each entry holds a feature
+        :param contour_areas: array_like, [n_vessels] -> Vessel contour areas
+        :param sma_positive: array_like, [n_vessels, n_expansions, n_data_types] -> Whether each entry is SMA positive,
+        None if the SMA presence has not been assigned
+        """
+        self.marker_names = list(marker_names)
+        self.point_nums = np.asarray(point_nums)
+        self.vessel_offsets = np.asarray(vessel_offsets)
+        self.expansions = np.asarray(expansions)
+        self.values = values
+        self.present = present
+        self.contour_areas = contour_areas
+        self.sma_positive = sma_positive
+
+        self._point_index = {point_num: i for i, point_num in enumerate(self.point_nums.tolist())}
+        self._expansion_index = {expansion: i for i, expansion in enumerate(self.expansions.tolist())}
+        self._data_type_index = {data_type: i for i, data_type in enumerate(self.data_types)}
+        self._marker_index = {marker: i for i, marker in enumerate(self.marker_names)}
+
+    @classmethod
+    def from_dataframe(cls, features: pd.DataFrame, marker_names: list):
+        """
+        Create a feature store from a feature DataFrame indexed by (Point, Vessel, Expansion, Data Type)
+
+        :param features: pd.DataFrame, Expression features
+        :param marker_names: list, [n_markers] -> Marker names
+        :return: FeatureStore, Feature store
+        """
+        sma_positive = None
+
+        if "SMA Presence" in features:
+            sma_positive = features["SMA Presence"].to_numpy() == "Positive"
+
+        return cls._from_arrays(marker_names,
+                                features.index.get_level_values(0).to_numpy(),
+                                features.index.get_level_values(1).to_numpy(),
+                                features.index.get_level_values(2).to_numpy(),
+                                features.index.get_level_values(3).to_numpy(),
+                                features[marker_names].to_numpy(),
+                                features["Contour Area"].to_numpy() if "Contour Area" in features else None,
+                                sma_positive)
+
+    @classmethod
+    def from_rows(cls, rows: ExpressionRows):
+        """
+        Create a feature store from expression rows, without building a feature DataFrame
+
+        :param rows: ExpressionRows, Expression rows indexed by (Point, Vessel, Expansion, Data Type)
+        :return: FeatureStore, Feature store
+        """
+        index = np.array(rows.index, dtype=object).reshape(-1, 4)
+
+        return cls._from_arrays(rows.marker_names,
+                                index[:, 0].astype(np.int64),
+                                index[:, 1],
+                                index[:, 2].astype(np.int64),
+                                index[:, 3],
+                                rows.values,
+                                rows.contour_areas)
+
+    @classmethod
+    def _from_arrays(cls,
+                     marker_names: list,
+                     points: np.ndarray,
+                     vessels: np.ndarray,
+                     expansions: np.ndarray,
+                     data_types: np.ndarray,
+                     marker_values: np.ndarray,
+                     row_contour_areas: np.ndarray = None,
+                     row_sma_positive: np.ndarray = None):
+        """
+        Create a feature store from the index and features of every row
+
+        :param marker_names: list, [n_markers] -> Marker names
+        :param points: array_like, [n_rows] -> Point number of every row
+        :param vessels: array_like, [n_rows] -> Vessel of every row, numbered from 0 within every point
+        :param expansions: array_like, [n_rows] -> Expansion number of every row
+        :param data_types: array_like, [n_rows] -> Data type of every row
+        :param marker_values: array_like, [n_rows, n_markers] -> Expression features of every row
+        :param row_contour_areas: array_like, [n_rows] -> Contour area of the vessel of every row, None for zeros
+        :param row_sma_positive: array_like, [n_rows] -> Whether every row is SMA positive, None if the SMA presence
+        has not been assigned
+        :return: FeatureStore, Feature store
+        """
+        vessels = np.asarray(vessels).astype(np.int64)
+
+        point_nums, point_positions = np.unique(points, return_inverse=True)
+
+        # Vessels are numbered from 0 within every point
+        n_vessels = np.zeros(len(point_nums), np.int64)
+        np.maximum.at(n_vessels, point_positions, vessels + 1)
+        vessel_offsets = np.concatenate([[0], np.cumsum(n_vessels)])
+
+        expansion_nums, expansion_positions = np.unique(expansions, return_inverse=True)
+        data_type_positions = pd.Index(cls.data_types).get_indexer(data_types)
+
+        assert (data_type_positions >= 0).all(), "Unrecognized data type!"
+
+        rows = vessel_offsets[point_positions] + vessels
+
+        values = np.zeros((vessel_offsets[-1], len(expansion_nums), len(cls.data_types), len(marker_names)),
+                          marker_values.dtype)
+        present = np.zeros(values.shape[:3], bool)
+        contour_areas = np.zeros(vessel_offsets[-1])
+
+        values[rows, expansion_positions, data_type_positions] = marker_values
+        present[rows, expansion_positions, data_type_positions] = True
+
+        if row_contour_areas is not None:
+            contour_areas[rows] = row_contour_areas
+
+        sma_positive = None
+
+        if row_sma_positive is not None:
+            sma_positive = np.zeros(values.shape[:3], bool)
+            sma_positive[rows, expansion_positions, data_type_positions] = row_sma_positive
+
+        return cls(marker_names, point_nums, vessel_offsets, expansion_nums, values, present, contour_areas,
+                   sma_positive)
+
+    def point_rows(self, point_num) -> slice:
+        """
+        Get the rows holding the vessels of a point, or of a range of points
+
+        :param point_num: int or slice, Point number, or a slice of point numbers including both ends as with
+        DataFrame.loc, None for all points
+        :return: slice, Vessel rows
+        """
+        if point_num is None:
+            return slice(0, self.vessel_offsets[-1])
+
+        if isinstance(point_num, slice):
+            first, last = self._label_range(self.point_nums, point_num)
+
+            return slice(self.vessel_offsets[first], self.vessel_offsets[last])
+
+        i = self._point_index[point_num]
+
+        return slice(self.vessel_offsets[i], self.vessel_offsets[i + 1])
+
+    @staticmethod
+    def _label_range(labels: np.ndarray, label_slice: slice) -> (int, int):
+        """
+        Get the positions of a slice of sorted labels, including both ends as with DataFrame.loc
+
+        :param labels: array_like, [n_labels] -> Labels, in increasing order
+        :param label_slice: slice, Slice of labels
+        :return: int, Position of the first label, int, Position after the last label
+        """
+        first = 0 if label_slice.start is None else np.searchsorted(labels, label_slice.start, side="left")
+        last = len(labels) if label_slice.stop is None else np.searchsorted(labels, label_slice.stop, side="right")
+
+        return int(first), int(max(first, last))
+
+    def _expansion_positions(self, expansion):
+        """
+        Get the position of an expansion, or the positions of a range of expansions
+
+        :param expansion: int or slice, Expansion number, or a slice of expansion numbers including both ends as with
+        DataFrame.loc, None for all expansions
+        :return: int or slice, Expansion positions
+        """
+        if expansion is None:
+            return slice(None)
+
+        if isinstance(expansion, slice):
+            return slice(*self._label_range(self.expansions, expansion))
+
+        return self._expansion_index[expansion]
+
+    def n_vessels(self, point_num: int = None) -> int:
+        """
+        Get the number of vessels in a point, or in all points
+
+        :param point_num: int, Point number, None for all points
+        :return: int, Number of vessels
+        """
+        if point_num is None:
+            return int(self.vessel_offsets[-1])
+
+        rows = self.point_rows(point_num)
+
+        return int(rows.stop - rows.start)
+
+    def get(self,
+            point_num: int = None,
+            expansion: int = 0,
+            data_type: str = "Data",
+            markers=None) -> np.ndarray:
+        """
+        Get the features of every vessel for an expansion and data type, skipping vessels without a feature there.
+        Ranges of points or expansions are returned in the order of a sorted feature DataFrame.
+
+        :param point_num: int or slice, Point number or range of point numbers, None for all points
+        :param expansion: int or slice, Expansion number or range of expansion numbers, None for all expansions
+        :param data_type: str, Data type
+        :param markers: str or list, Marker name or names, None for all markers
+        :return: array_like, [n_rows, n_markers] -> Features, [n_rows] if a single marker name is given
+        """
+        entry = (self.point_rows(point_num), self._expansion_positions(expansion), self._data_type_index[data_type])
+
+        if markers is None:
+            values = self.values[entry]
+        elif isinstance(markers, str):
+            values = self.values[entry + (self._marker_index[markers],)]
+        else:
+            values = self.values[entry][:, [self._marker_index[marker] for marker in markers]]
+
+        present = self.present[entry]
+
+        if present.ndim == 1 and present.all():
+            return values
+
+        return values[present]
+
+    def to_dataframe(self,
+                     large_vessel_threshold: float,
+                     point_num=None,
+                     expansion=None,
+                     data_type: str = None) -> pd.DataFrame:
+        """
+        Convert to a feature DataFrame sorted by (Point, Vessel, Expansion, Data Type)
+
+        :param large_vessel_threshold: float, Contour area above which a vessel is large
+        :param point_num: int or slice, Point number or range of point numbers to convert, None for all points
+        :param expansion: int or slice, Expansion number or range of expansion numbers to convert, None for all
+        expansions
+        :param data_type: str, Data type to convert, None for all data types
+        :return: pd.DataFrame, [n_rows, n_markers + 2] -> Expression features with the contour area and vessel size of
+        every row, and its SMA presence if it has been assigned
+        """
+        expansion_positions = self._expansion_positions(expansion)
+        data_type_positions = slice(None) if data_type is None else self._data_type_index[data_type]
+
+        # Select with slices only so the selection keeps every axis, then offset its positions by the slice starts
+        entry = tuple(positions if isinstance(positions, slice) else slice(positions, positions + 1)
+                      for positions in (self.point_rows(point_num), expansion_positions, data_type_positions))
+
+        rows, expansion_positions, data_type_positions = [
+            positions + (positions_slice.start or 0)
+            for positions, positions_slice in zip(np.nonzero(self.present[entry]), entry)]
+
+        point_positions = np.searchsorted(self.vessel_offsets, rows, side="right") - 1
+
+        index = pd.MultiIndex.from_arrays([self.point_nums[point_positions],
+                                           rows - self.vessel_offsets[point_positions],
+                                           self.expansions[expansion_positions],
+                                           np.asarray(self.data_types, dtype=object)[data_type_positions]],
+                                          names=['Point', 'Vessel', 'Expansion', 'Data Type'])
+
+        features = pd.DataFrame(self.values[rows, expansion_positions, data_type_positions],
+                                columns=self.marker_names,
+                                index=index)
+
+        contour_areas = self.contour_areas[rows]
+
+        features["Contour Area"] = contour_areas
+        features["Vessel Size"] = np.where(contour_areas > large_vessel_threshold, "Large", "Small").astype(object)
+
+        if self.sma_positive is not None:
+            features["SMA Presence"] = np.where(self.sma_positive[rows, expansion_positions, data_type_positions],
+                                                "Positive",
+                                                "Negative").astype(object)
+
+        return features
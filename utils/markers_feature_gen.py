@@ -18,6 +18,10 @@ from PIL import Image
 import pandas as pd
 
 from utils.utils_functions import mkdir_p
+from utils.sparse_markers import SparseMarkerData
+from utils.point_geometry import PointGeometry, get_vessel_owner_labels
+from utils.ring_histogram import RingHistogram
+from utils.expression_rows import ExpressionRows
 from config.config_settings import Config
 
 '''
@@ -36,31 +40,9 @@ def get_assigned_regions(per_point_contours: list, img_shape: (int, int)) -> lis
     expand
     """
 
-    dist_mats = []
-    regions = []
+    owner_labels = get_vessel_owner_labels(per_point_contours, img_shape)
 
-    # Iterate through all vessel contours and create distance transform matrices
-    for i in range(len(per_point_contours)):
-        sub_mask = np.ones(img_shape, np.uint8)
-        cv.drawContours(sub_mask, per_point_contours, i, (0, 0, 0), cv.FILLED)
-        dist = cv.distanceTransform(sub_mask, cv.DIST_L2, cv.DIST_MASK_PRECISE)
-        dist_mats.append(dist)
-
-    # Iterate through all contours and compare distance matrices to find all pixels "belonging" to a given vessel,
-    # this will create the region mask beyond which the vessel should not expand in order to avoid vessels from
-    # encroaching on other vessel's space
-
-    for i in range(len(per_point_contours)):
-        region = np.ones(img_shape, dtype=bool)
-        for j in range(len(per_point_contours)):
-            if i != j:
-                region = region & (dist_mats[i] < dist_mats[j])
-
-        regions.append(region)
-
-    del dist_mats
-
-    return regions
+    return [owner_labels == i for i in range(len(per_point_contours))]
 
 
 def arcsinh(data: list, cofactor: int = 5) -> np.ndarray:
@@ -132,27 +114,25 @@ def expand_vessel_region(cnt: np.ndarray, img_shape: (int, int),
     return ring
 
 
-def normalize_expression_data(config: Config,
-                              expression_data_df: pd.DataFrame,
-                              markers_names: list,
-                              transformation: str = "arcsinh",
-                              normalization: str = "percentile",
-                              scaling_factor: int = 100,
-                              n_markers: int = 34) -> np.ndarray:
+def normalize_expression_values(config: Config,
+                                expression_data: np.ndarray,
+                                transformation: str = "arcsinh",
+                                normalization: str = "percentile",
+                                scaling_factor: int = 100,
+                                n_markers: int = 34) -> np.ndarray:
     """
-    Normalize expression vectors
+    Normalize an array of expression vectors
 
     :param config: Config, configuration settings
-    :param markers_names: array_like, [n_markers] -> List of marker names
-    :param expression_data_df: pd.DataFrame, [n_vessels, n_markers] -> Marker expression data per vessel
+    :param expression_data: array_like, [n_vessels, n_markers] -> Marker expression data per vessel
     :param transformation: str, Transformation type
     :param normalization: str, Normalization type
     :param scaling_factor: int, Scaling factor
     :param n_markers: int, Number of markers
-    :return:
+    :return: array_like, [n_vessels, n_markers] -> Normalized marker expression data per vessel
     """
 
-    expression_data = expression_data_df[markers_names].to_numpy()
+    expression_data = np.asarray(expression_data, dtype=np.dtype(config.feature_precision))
     logging.debug(expression_data.shape)
 
     if scaling_factor > 0:
@@ -195,7 +175,35 @@ def normalize_expression_data(config: Config,
         # Scale data by Sklearn normalizer
         expression_data = normalize(expression_data, axis=0)
 
-    expression_data_df[markers_names] = expression_data
+    return expression_data.astype(np.dtype(config.feature_precision), copy=False)
+
+
+def normalize_expression_data(config: Config,
+                              expression_data_df: pd.DataFrame,
+                              markers_names: list,
+                              transformation: str = "arcsinh",
+                              normalization: str = "percentile",
+                              scaling_factor: int = 100,
+                              n_markers: int = 34) -> pd.DataFrame:
+    """
+    Normalize expression vectors
+
+    :param config: Config, configuration settings
+    :param markers_names: array_like, [n_markers] -> List of marker names
+    :param expression_data_df: pd.DataFrame, [n_vessels, n_markers] -> Marker expression data per vessel
+    :param transformation: str, Transformation type
+    :param normalization: str, Normalization type
+    :param scaling_factor: int, Scaling factor
+    :param n_markers: int, Number of markers
+    :return: pd.DataFrame, [n_vessels, n_markers] -> Marker expression data per vessel, normalized in place
+    """
+
+    expression_data_df[markers_names] = normalize_expression_values(config,
+                                                                    expression_data_df[markers_names].to_numpy(),
+                                                                    transformation=transformation,
+                                                                    normalization=normalization,
+                                                                    scaling_factor=scaling_factor,
+                                                                    n_markers=n_markers)
 
     return expression_data_df
 
@@ -232,11 +240,124 @@ def preprocess_marker_data(marker_data: np.ndarray,
     return marker_data
 
 
+def expression_from_sums(sums: np.ndarray,
+                         nonzero_counts: np.ndarray,
+                         mask_area: int,
+                         n_pixels: int,
+                         expression_type: str = "area_normalized_counts") -> np.ndarray:
+    """
+    Take per marker counts summed over a mask and return processed expression vectors, equivalent to calling
+    preprocess_marker_data for every marker
+
+    :param sums: array_like, [n_markers] -> Sum of marker counts inside the mask
+    :param nonzero_counts: array_like, [n_markers] -> Number of nonzero marker pixels inside the mask
+    :param mask_area: int, Number of nonzero pixels in the mask
+    :param n_pixels: int, Number of pixels in the point
+    :param expression_type: str, Expression type
+    :return: array_like, [n_markers] -> Marker data vector
+    """
+
+    assert expression_type in ["mean", "area_normalized_counts", "counts"], "Unrecognized expression type!"
+
+    sums = np.asarray(sums, dtype=np.float64)
+
+    if expression_type == "mean":
+        # Get mean intensity of marker, scaled by the reciprocal as cv.mean does
+        return sums * (1. / n_pixels)
+
+    elif expression_type == "area_normalized_counts":
+        # Get cell area normalized count of marker
+        return np.where(nonzero_counts != 0, sums / max(mask_area, 1), 0.0)
+
+    elif expression_type == "counts":
+        # Get cell area normalized count of marker
+        return np.asarray(nonzero_counts, dtype=np.float64)
+
+
+def get_marker_expression_vector(per_point_marker_data,
+                                 mask: np.ndarray,
+                                 expression_type: str = "area_normalized_counts",
+                                 dtype: np.dtype = np.float64,
+                                 window: (slice, slice) = None) -> np.ndarray:
+    """
+    Get the expression of every marker inside a mask
+
+    :param per_point_marker_data: array_like or SparseMarkerData, [n_markers, point_size[0], point_size[1]] -> Pixel
+    data for each marker
+    :param mask: array_like, [point_size[0], point_size[1]] -> Mask to compute the expression in, cropped to the
+    window if one is given
+    :param expression_type: str, Expression type
+    :param dtype: np.dtype, Precision of the returned expression
+    :param window: tuple, (rows, columns) -> Window slices the mask was cropped to, None if it is full size
+    :return: array_like, [n_markers] -> Marker data vector
+    """
+
+    if isinstance(per_point_marker_data, SparseMarkerData):
+        # Only the nonzero counts of the pixels inside the mask are visited
+        sums, nonzero_counts = per_point_marker_data.masked_sums(mask, window=window)
+
+        return expression_from_sums(sums,
+                                    nonzero_counts,
+                                    cv.countNonZero(mask),
+                                    per_point_marker_data.point_size[0] * per_point_marker_data.point_size[1],
+                                    expression_type=expression_type).astype(dtype)
+
+    per_point_marker_data = np.asarray(per_point_marker_data)
+
+    # Take the pixel coordinates of the mask once and gather every marker at them in a single operation, rather than
+    # masking a full copy of each marker image
+    rows, cols = np.nonzero(mask)
+
+    if window is not None:
+        rows += window[0].start
+        cols += window[1].start
+
+    masked_values = per_point_marker_data[:, rows, cols]
+
+    sums = masked_values.sum(axis=1, dtype=np.float64)
+    nonzero_counts = np.count_nonzero(masked_values, axis=1)
+
+    return expression_from_sums(sums,
+                                nonzero_counts,
+                                len(rows),
+                                per_point_marker_data[0].size,
+                                expression_type=expression_type).astype(dtype)
+
+
+def get_marker_expression_image(per_point_marker_data,
+                                mask: np.ndarray,
+                                cnt: np.ndarray,
+                                window: (slice, slice) = None) -> list:
+    """
+    Get the masked marker data inside the bounding box of a vessel
+
+    :param per_point_marker_data: array_like or SparseMarkerData, [n_markers, point_size[0], point_size[1]] -> Pixel
+    data for each marker
+    :param mask: array_like, [point_size[0], point_size[1]] -> Mask to keep marker data in, cropped to the window if
+    one is given
+    :param cnt: np.ndarray, Vessel contour
+    :param window: tuple, (rows, columns) -> Window slices the mask was cropped to, None if it is full size
+    :return: list, [n_markers, vessel_size[0], vessel_size[1]] -> ROI marker expressions
+    """
+
+    x, y, w, h = cv.boundingRect(cnt)
+    mask_y, mask_x = (y, x) if window is None else (y - window[0].start, x - window[1].start)
+    roi_mask = np.ascontiguousarray(mask[mask_y:mask_y + h, mask_x:mask_x + w])
+
+    if isinstance(per_point_marker_data, SparseMarkerData):
+        roi_markers = per_point_marker_data.crop(x, y, w, h)
+    else:
+        roi_markers = [marker[y:y + h, x:x + w] for marker in per_point_marker_data]
+
+    return [cv.bitwise_and(roi_marker, roi_marker, mask=roi_mask) for roi_marker in roi_markers]
+
+
 def expansion_ring_plots(per_point_contours: list,
                          expansion_image: np.ndarray,
                          pixel_expansion_upper_bound: int = 5,
                          pixel_expansion_lower_bound: int = 0,
-                         color: (int, int, int) = (255, 255, 255)):
+                         color: (int, int, int) = (255, 255, 255),
+                         geometry: PointGeometry = None):
     """
     Draw rings on vessel mask
 
@@ -245,30 +366,35 @@ def expansion_ring_plots(per_point_contours: list,
     :param expansion_image: array_like, image to draw vessel rings on
     :param pixel_expansion_upper_bound: int, Pixel upper bound to expand by
     :param pixel_expansion_lower_bound: int, Pixel lower bound to expand by
+    :param geometry: PointGeometry, Cached vessel geometry of the point, shared between expansions
     """
 
     img_shape = expansion_image.shape
-    regions = get_assigned_regions(per_point_contours, img_shape)
+
+    if geometry is None:
+        geometry = PointGeometry(per_point_contours, img_shape)
 
     for idx, cnt in enumerate(per_point_contours):
 
         if pixel_expansion_upper_bound < 0:
-            mask_expanded = contract_vessel_region(cnt, img_shape, upper_bound=pixel_expansion_upper_bound)
+            mask_expanded = geometry.contract(idx, upper_bound=pixel_expansion_upper_bound)
         else:
-            mask_expanded = expand_vessel_region(cnt, img_shape, upper_bound=pixel_expansion_upper_bound)
+            mask_expanded = geometry.expand(idx, upper_bound=pixel_expansion_upper_bound)
 
         if pixel_expansion_lower_bound != 0:
             if pixel_expansion_lower_bound < 0:
-                mask = contract_vessel_region(cnt, img_shape, upper_bound=pixel_expansion_lower_bound)
+                mask = geometry.contract(idx, upper_bound=pixel_expansion_lower_bound)
             else:
-                mask = expand_vessel_region(cnt, img_shape, upper_bound=pixel_expansion_lower_bound)
+                mask = geometry.expand(idx, upper_bound=pixel_expansion_lower_bound)
         else:
             mask = np.zeros(img_shape, np.uint8)
 
+        region = geometry.region(idx)
+
         result_mask = mask_expanded - mask
-        result_mask = cv.bitwise_and(result_mask, regions[idx].astype(np.uint8))
+        result_mask = cv.bitwise_and(result_mask, region)
 
-        _, temp_contours, _ = cv.findContours(regions[idx].astype(np.uint8), cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
+        _, temp_contours, _ = cv.findContours(region, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
         cv.drawContours(expansion_image, temp_contours, 0, (255, 255, 255), 1)
         expansion_image[np.where(result_mask != 0)] = color[0]
 
@@ -289,7 +415,7 @@ def get_microenvironment_masks(per_point_marker_data: np.ndarray,
     microenvironment_masks = []
 
     img_shape = per_point_marker_data[0].shape
-    regions = get_assigned_regions(per_point_vessel_contours, img_shape)
+    owner_labels = get_vessel_owner_labels(per_point_vessel_contours, img_shape)
 
     for idx, cnt in enumerate(per_point_vessel_contours):
         microenvironment_mask = []
@@ -308,7 +434,7 @@ def get_microenvironment_masks(per_point_marker_data: np.ndarray,
             mask = cv.drawContours(np.zeros(img_shape, np.uint8), [cnt], -1, (1, 1, 1), cv.FILLED)
 
         result_mask = mask_expanded - mask
-        result_mask = cv.bitwise_and(result_mask, regions[idx].astype(np.uint8))
+        result_mask = cv.bitwise_and(result_mask, (owner_labels == idx).astype(np.uint8))
 
         for marker in per_point_marker_data:
             x, y, w, h = cv.boundingRect(cnt)
@@ -333,7 +459,9 @@ def calculate_inward_microenvironment_marker_expression(config: Config,
                                                         per_point_vessel_areas: list,
                                                         marker_names: list,
                                                         pixel_expansion_upper_bound: int = 5,
-                                                        pixel_expansion_lower_bound: int = 0) -> (np.ndarray, int):
+                                                        pixel_expansion_lower_bound: int = 0,
+                                                        geometry: PointGeometry = None,
+                                                        return_rows: bool = False) -> (np.ndarray, int):
     """
     Get normalized expression of markers in given cells
 
@@ -347,18 +475,27 @@ def calculate_inward_microenvironment_marker_expression(config: Config,
     :param pixel_expansion_upper_bound: int, Upper bound to expand
     :param per_point_marker_data: array_like, [n_markers, point_size[0], point_size[1]] -> Pixel data for each marker
     :param per_point_vessel_contours: list, [n_vessels] -> Contours of cells in image
+    :param geometry: PointGeometry, Cached vessel geometry of the point, shared between expansions
+    :param return_rows: bool, Return the expression data as ExpressionRows rather than a DataFrame
     :returns per_point_vessel_expression_data: array_like, [n_vessels, n_markers] -> Per point vessels expression data,
     stopped_vessels: int, Number of vessels which couldn't expand inwards
     """
 
     expression_type = config.expression_type
+    feature_dtype = np.dtype(config.feature_precision)
     plot = config.show_probability_distribution_for_expression
     n_markers = config.n_markers
 
-    per_point_features = []
+    # At most one row per vessel, trimmed to the vessels which could contract once they are all done
+    values = np.zeros((len(per_point_vessel_contours), len(marker_names)), feature_dtype)
+    contour_areas = np.zeros(len(per_point_vessel_contours))
+    index = []
 
     img_shape = per_point_marker_data[0].shape
 
+    if geometry is None:
+        geometry = PointGeometry(per_point_vessel_contours, img_shape, max_distance=0)
+
     stopped_vessels = 0
 
     for idx, cnt in enumerate(per_point_vessel_contours):
@@ -368,54 +505,42 @@ def calculate_inward_microenvironment_marker_expression(config: Config,
             continue
 
         if not stopped:
-            result_mask = contract_vessel_region(cnt, img_shape, upper_bound=pixel_expansion_upper_bound,
-                                                 lower_bound=pixel_expansion_lower_bound)
+            # Contracted rings stay inside the vessel, unless a negative lower bound takes in the pixels outside it
+            window = geometry.window(idx) if pixel_expansion_lower_bound >= 0 else geometry.window(idx, math.inf)
+
+            result_mask = geometry.contract(idx, upper_bound=pixel_expansion_upper_bound,
+                                            lower_bound=pixel_expansion_lower_bound,
+                                            window=window)
 
             if config.show_vessel_masks_when_generating_expression and point_num == 1 and idx == 1:
-                cv.imshow("Vessel Mask", result_mask * 255)
+                cv.imshow("Vessel Mask", geometry.to_full_frame(window, result_mask) * 255)
                 cv.waitKey(0)
 
             if cv.countNonZero(result_mask) == 0:
                 stopped_vessels += 1
                 continue
 
-        data_vec = []
-        expression_image = []
-
-        for marker in per_point_marker_data:
-            x, y, w, h = cv.boundingRect(cnt)
-
-            result = cv.bitwise_and(marker, marker, mask=result_mask)
-
-            roi_result = result[y:y + h, x:x + w]
-
-            expression_image.append(roi_result)
-
-            marker_data = preprocess_marker_data(result,
-                                                 result_mask,
-                                                 expression_type=expression_type)
-            data_vec.append(marker_data)
-
-        inward_microenvironment_features = pd.DataFrame(np.array([data_vec]), columns=marker_names)
-        inward_microenvironment_features.index = map(lambda a: (point_num, idx, expansion_num, "Data"),
-                                                     inward_microenvironment_features.index)
-
-        inward_microenvironment_features["Contour Area"] = per_point_vessel_areas[idx]
-        inward_microenvironment_features["Vessel Size"] = "Large" \
-            if per_point_vessel_areas[idx] > config.large_vessel_threshold else "Small"
-
-        per_point_features.append(inward_microenvironment_features)
-
-    if len(per_point_features) > 0:
-        inward_microenvironment_features = pd.concat(per_point_features).fillna(0)
-        inward_microenvironment_features.index = pd.MultiIndex.from_tuples(inward_microenvironment_features.index)
+        row = len(index)
+
+        values[row] = get_marker_expression_vector(per_point_marker_data,
+                                                   result_mask,
+                                                   expression_type=expression_type,
+                                                   dtype=feature_dtype,
+                                                   window=window)
+        contour_areas[row] = per_point_vessel_areas[idx]
+        index.append((point_num, idx, expansion_num, "Data"))
+
+    if len(index) > 0:
+        inward_microenvironment_features = ExpressionRows(marker_names,
+                                                          index,
+                                                          values[:len(index)],
+                                                          contour_areas[:len(index)])
     else:
         inward_microenvironment_features = None
 
     if plot:
         if inward_microenvironment_features is not None:
-            idx = pd.IndexSlice
-            d = inward_microenvironment_features.loc[idx[:, :, :, "Data"], :].to_numpy().flatten()
+            d = inward_microenvironment_features.values.flatten()
             plt.plot(np.array(d), stats.norm.pdf(np.array(d)))
 
             plt.xlabel('Area Normalized Marker Expression')
@@ -423,6 +548,9 @@ def calculate_inward_microenvironment_marker_expression(config: Config,
             plt.title('PDF of Marker Expression')
             plt.show()
 
+    if inward_microenvironment_features is not None and not return_rows:
+        inward_microenvironment_features = inward_microenvironment_features.to_dataframe(config.large_vessel_threshold)
+
     return inward_microenvironment_features, stopped_vessels
 
 
@@ -434,11 +562,14 @@ def calculate_microenvironment_marker_expression(config: Config,
                                                  pixel_expansion_upper_bound: int = 5,
                                                  pixel_expansion_lower_bound: int = 0,
                                                  point_num: int = 1,
-                                                 expansion_num: int = 1) -> (np.ndarray,
-                                                                             list,
-                                                                             int,
-                                                                             np.ndarray,
-                                                                             np.ndarray):
+                                                 expansion_num: int = 1,
+                                                 geometry: PointGeometry = None,
+                                                 ring_histogram: RingHistogram = None,
+                                                 return_rows: bool = False) -> (np.ndarray,
+                                                                                list,
+                                                                                int,
+                                                                                np.ndarray,
+                                                                                np.ndarray):
     """
     Get normalized expression of markers in given cells
 
@@ -451,112 +582,118 @@ def calculate_microenvironment_marker_expression(config: Config,
     :param per_point_marker_data: array_like, [n_markers, point_size[0], point_size[1]] -> Pixel data for each marker
     :param per_point_vessel_contours: list, [n_vessels] -> Contours of cells in image
     :param point_num: int, Point from which samples came from
+    :param geometry: PointGeometry, Cached vessel geometry of the point, shared between expansions
+    :param ring_histogram: RingHistogram, Marker sums of every ring of the point with bins indexed by expansion
+    number, to take the expression from instead of reducing over the masks
+    :param return_rows: bool, Return the expression data as ExpressionRows rather than a DataFrame
 
     :returns per_point_microenvironment_expression_data: pd.DataFrame, [n_vessels, n_markers] -> Per point
     microenvironment expression data,
-    expression_images: list, [n_vessels, n_markers] -> ROI marker expressions,
+    expression_images: list, [n_vessels, n_markers] -> ROI marker expressions, empty if ring_histogram is given,
     stopped_vessels: int, Number of vessels which couldn't expand inwards,
     """
 
     expression_type = config.expression_type
+    feature_dtype = np.dtype(config.feature_precision)
     plot = config.show_probability_distribution_for_expression
 
-    per_point_features = []
+    data_types = ["Data", "Non-Vascular Space", "Vascular Space"]
+
+    # One row per vessel for each data type
+    values = np.zeros((len(per_point_vessel_contours) * len(data_types), len(marker_names)), feature_dtype)
+    index = []
     expression_images = []
 
     img_shape = per_point_marker_data[0].shape
-    regions = get_assigned_regions(per_point_vessel_contours, img_shape)
+
+    if geometry is None:
+        geometry = PointGeometry(per_point_vessel_contours, img_shape,
+                                 max_distance=max(pixel_expansion_upper_bound, pixel_expansion_lower_bound))
 
     stopped_vessels = 0
 
     for idx, cnt in enumerate(per_point_vessel_contours):
-        data_vec = []
-        dark_space_vec = []
-        vessel_space_vec = []
-        area = cv.contourArea(cnt)
+        row = idx * len(data_types)
 
-        expression_image = []
+        # The masks are only built when the expression is reduced over them or they are shown, the ring histogram
+        # already holds the sums over every ring
+        if ring_histogram is None or config.show_vessel_masks_when_generating_expression:
+            # The expanded rings only cover the window around the vessel, the region it owns may reach further
+            window = geometry.window(idx, max(pixel_expansion_upper_bound, pixel_expansion_lower_bound))
 
-        mask_expanded = expand_vessel_region(cnt, img_shape, upper_bound=pixel_expansion_upper_bound)
+            mask_expanded = geometry.expand(idx, upper_bound=pixel_expansion_upper_bound, window=window)
 
-        if pixel_expansion_lower_bound != 0:
-            mask = expand_vessel_region(cnt, img_shape, upper_bound=pixel_expansion_lower_bound)
-        else:
-            mask = cv.drawContours(np.zeros(img_shape, np.uint8), [cnt], -1, (1, 1, 1), cv.FILLED)
+            if pixel_expansion_lower_bound != 0:
+                mask = geometry.expand(idx, upper_bound=pixel_expansion_lower_bound, window=window)
+            else:
+                mask = geometry.vessel_mask(idx, window=window)
 
-        result_mask = mask_expanded - mask
-        result_mask = cv.bitwise_and(result_mask, regions[idx].astype(np.uint8))
-        mask_expanded = cv.bitwise_and(mask_expanded, regions[idx].astype(np.uint8))
-        dark_space_mask = regions[idx].astype(np.uint8) - mask_expanded
+            window_region = geometry.region(idx, window=window)
+
+            result_mask = mask_expanded - mask
+            result_mask = cv.bitwise_and(result_mask, window_region)
+            mask_expanded = cv.bitwise_and(mask_expanded, window_region)
+
+            # Write the expanded mask back into the region sparsely
+            dark_space_mask = geometry.region(idx)
+            dark_space_mask[window] -= mask_expanded
 
         if config.show_vessel_masks_when_generating_expression:
-            cv.imshow("Microenvironment Mask", result_mask * 255)
+            cv.imshow("Microenvironment Mask", geometry.to_full_frame(window, result_mask) * 255)
             cv.imshow("Dark Space Mask", dark_space_mask * 255)
-            cv.imshow("Expanded Mask", mask_expanded * 255)
+            cv.imshow("Expanded Mask", geometry.to_full_frame(window, mask_expanded) * 255)
             cv.waitKey(0)
 
-        if cv.countNonZero(result_mask) == 0:
+        if ring_histogram is not None:
+            # The ring, the vessel expanded up to the ring and the rest of the region partition the region the vessel
+            # owns, so all three come from the sums over its bins
+            for offset, (sums, nonzero_counts, area) in enumerate([ring_histogram.ring(idx, expansion_num),
+                                                                   ring_histogram.beyond(idx, expansion_num),
+                                                                   ring_histogram.within(idx, expansion_num)]):
+                values[row + offset] = expression_from_sums(sums,
+                                                            nonzero_counts,
+                                                            area,
+                                                            img_shape[0] * img_shape[1],
+                                                            expression_type=expression_type).astype(feature_dtype)
+
+            ring_area = ring_histogram.pixel_counts[idx, expansion_num]
+        else:
+            expression_images.append(get_marker_expression_image(per_point_marker_data,
+                                                                 result_mask,
+                                                                 cnt,
+                                                                 window=window))
+
+            values[row] = get_marker_expression_vector(per_point_marker_data,
+                                                       result_mask,
+                                                       expression_type=expression_type,
+                                                       dtype=feature_dtype,
+                                                       window=window)
+
+            values[row + 1] = get_marker_expression_vector(per_point_marker_data,
+                                                           dark_space_mask,
+                                                           expression_type=expression_type,
+                                                           dtype=feature_dtype)
+
+            values[row + 2] = get_marker_expression_vector(per_point_marker_data,
+                                                           mask_expanded,
+                                                           expression_type=expression_type,
+                                                           dtype=feature_dtype,
+                                                           window=window)
+
+            ring_area = cv.countNonZero(result_mask)
+
+        if ring_area == 0:
             stopped_vessels += 1
 
-        for marker in per_point_marker_data:
-            x, y, w, h = cv.boundingRect(cnt)
-
-            result = cv.bitwise_and(marker, marker, mask=result_mask)
-            dark_space_result = cv.bitwise_and(marker, marker, mask=dark_space_mask)
-            vessel_space_result = cv.bitwise_and(marker, marker, mask=mask_expanded)
-
-            roi_result = result[y:y + h, x:x + w]
-
-            expression_image.append(roi_result)
-
-            marker_data = preprocess_marker_data(result,
-                                                 result_mask,
-                                                 expression_type=expression_type)
-
-            dark_space_data = preprocess_marker_data(dark_space_result,
-                                                     dark_space_mask,
-                                                     expression_type=expression_type)
-
-            vessel_space_data = preprocess_marker_data(vessel_space_result,
-                                                       mask_expanded,
-                                                       expression_type=expression_type)
-
-            data_vec.append(marker_data)
-            dark_space_vec.append(dark_space_data)
-            vessel_space_vec.append(vessel_space_data)
+        index.extend([(point_num, idx, expansion_num, data_type) for data_type in data_types])
 
-        features = []
-
-        microenvironment_features = pd.DataFrame(np.array([data_vec]), columns=marker_names)
-        microenvironment_features.index = map(lambda a: (point_num, idx, expansion_num, "Data"),
-                                              microenvironment_features.index)
-        features.append(microenvironment_features)
-
-        nonvascular_features = pd.DataFrame(np.array([dark_space_vec]), columns=marker_names)
-        nonvascular_features.index = map(lambda a: (point_num, idx, expansion_num, "Non-Vascular Space"),
-                                         nonvascular_features.index)
-        features.append(nonvascular_features)
-
-        vascular_features = pd.DataFrame(np.array([vessel_space_vec]), columns=marker_names)
-        vascular_features.index = map(lambda a: (point_num, idx, expansion_num, "Vascular Space"),
-                                      vascular_features.index)
-        features.append(vascular_features)
-
-        all_features = pd.concat(features).fillna(0)
-        all_features["Contour Area"] = per_point_vessel_areas[idx]
-        all_features["Vessel Size"] = "Large" if per_point_vessel_areas[idx] > config.large_vessel_threshold \
-            else "Small"
-
-        per_point_features.append(all_features)
-
-        expression_images.append(expression_image)
-
-    all_samples_features = pd.concat(per_point_features).fillna(0)
-    all_samples_features.index = pd.MultiIndex.from_tuples(all_samples_features.index)
+    all_samples_features = ExpressionRows(marker_names,
+                                          index,
+                                          values,
+                                          np.repeat(np.asarray(per_point_vessel_areas, np.float64), len(data_types)))
 
     if plot:
-        idx = pd.IndexSlice
-        d = all_samples_features.loc[idx[:, :, :, "Data"], :].to_numpy().flatten()
+        d = values[0::len(data_types)].flatten()
         plt.plot(np.array(d), stats.norm.pdf(np.array(d)))
 
         plt.xlabel('Area Normalized Marker Expression')
@@ -564,6 +701,9 @@ def calculate_microenvironment_marker_expression(config: Config,
         plt.title('PDF of Marker Expression')
         plt.show()
 
+    if not return_rows:
+        all_samples_features = all_samples_features.to_dataframe(config.large_vessel_threshold)
+
     return all_samples_features, expression_images, stopped_vessels
 
 
@@ -572,7 +712,9 @@ def calculate_composition_marker_expression(config: Config,
                                             per_point_vessel_contours: list,
                                             per_point_vessel_areas: list,
                                             marker_names: list,
-                                            point_num: int = 1) -> np.ndarray:
+                                            point_num: int = 1,
+                                            geometry: PointGeometry = None,
+                                            return_rows: bool = False) -> np.ndarray:
     """
     Get normalized expression of markers in given cells
 
@@ -582,18 +724,23 @@ def calculate_composition_marker_expression(config: Config,
     :param point_num: int, Point number for vessel ID plot
     :param per_point_marker_data: array_like, [n_markers, point_size[0], point_size[1]] -> Pixel data for each marker
     :param per_point_vessel_contours: list, [n_vessels] -> Contours of cells in image
+    :param geometry: PointGeometry, Cached vessel geometry of the point, shared between expansions
+    :param return_rows: bool, Return the expression data as ExpressionRows rather than a DataFrame
     :return: per_point_vessel_expression_data: pd.DataFrame, [n_vessels, n_markers] -> Per point vessel expression data
     """
 
     expression_type = config.expression_type
+    feature_dtype = np.dtype(config.feature_precision)
     plot = config.show_probability_distribution_for_expression
     vessel_id_plot = config.create_vessel_id_plot
     embedded_id_plot = config.create_embedded_vessel_id_masks
 
-    # per_point_vessel_expression_data = []
-    per_point_features = []
+    values = np.zeros((len(per_point_vessel_contours), len(marker_names)), feature_dtype)
     img_shape = per_point_marker_data[0].shape
 
+    if geometry is None:
+        geometry = PointGeometry(per_point_vessel_contours, img_shape, max_distance=0)
+
     if vessel_id_plot:
         vessel_id_img = np.zeros(per_point_marker_data[0].shape)
 
@@ -601,14 +748,13 @@ def calculate_composition_marker_expression(config: Config,
         embedded_id_img = np.zeros(per_point_marker_data[0].shape, np.uint8)
 
     for idx, cnt in enumerate(per_point_vessel_contours):
-        data_vec = []
         vessel_id = idx + 1  # Index from 1 rather than from 0
 
-        mask = np.zeros(img_shape, np.uint8)
-        cv.drawContours(mask, [cnt], -1, (1, 1, 1), cv.FILLED)
+        window = geometry.window(idx)
+        mask = geometry.vessel_mask(idx, window=window)
 
         if config.show_vessel_masks_when_generating_expression:
-            cv.imshow("Vessel Mask", mask * 255)
+            cv.imshow("Vessel Mask", geometry.to_full_frame(window, mask) * 255)
             cv.waitKey(0)
 
         if vessel_id_plot:
@@ -622,31 +768,17 @@ def calculate_composition_marker_expression(config: Config,
             cv.drawContours(embedded_id_img, [cnt], -1, (vessel_id, vessel_id, vessel_id), cv.FILLED)  # Give all
             # pixels in the contour region value of ID
 
-        for marker in per_point_marker_data:
-            result = cv.bitwise_and(marker, marker, mask=mask)
-
-            marker_data = preprocess_marker_data(result,
-                                                 mask,
-                                                 expression_type=expression_type)
-
-            data_vec.append(marker_data)
+        values[idx] = get_marker_expression_vector(per_point_marker_data,
+                                                   mask,
+                                                   expression_type=expression_type,
+                                                   dtype=feature_dtype,
+                                                   window=window)
 
-        vessel_features = pd.DataFrame(np.array([data_vec]), columns=marker_names)
-        vessel_features.index = map(lambda a: (point_num, idx, 0, "Data"),
-                                    vessel_features.index)
-
-        vessel_features["Contour Area"] = per_point_vessel_areas[idx]
-        vessel_features["Vessel Size"] = "Large" if per_point_vessel_areas[idx] > config.large_vessel_threshold \
-            else "Small"
-
-        per_point_features.append(vessel_features)
-
-    all_samples_features = pd.concat(per_point_features).fillna(0)
-    all_samples_features.index = pd.MultiIndex.from_tuples(all_samples_features.index)
+    index = [(point_num, idx, 0, "Data") for idx in range(len(per_point_vessel_contours))]
+    all_samples_features = ExpressionRows(marker_names, index, values, np.asarray(per_point_vessel_areas, np.float64))
 
     if plot:
-        idx = pd.IndexSlice
-        d = all_samples_features.loc[idx[:, :, :, "Data"], :].to_numpy().flatten()
+        d = values.flatten()
         plt.plot(np.array(d), stats.norm.pdf(np.array(d)))
         plt.xlabel('Area Normalized Marker Expression')
         plt.ylabel('Probability')
@@ -666,4 +798,7 @@ def calculate_composition_marker_expression(config: Config,
         im = Image.fromarray(embedded_id_img)
         im.save(os.path.join(output_dir, "embedded_id_plot_%s.tif" % vessel_id_label))
 
+    if not return_rows:
+        all_samples_features = all_samples_features.to_dataframe(config.large_vessel_threshold)
+
     return all_samples_features
@@ -1,4 +1,7 @@
 import logging
+import os
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from tqdm import tqdm
 
 from utils.object_extractor import ObjectExtractor
@@ -8,14 +11,45 @@ logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
 from utils.mibi_reader import MIBIReader
 from utils.object_extractor import ObjectExtractor
 from utils.markers_feature_gen import *
+from utils.point_geometry import PointGeometry
+from utils.expression_rows import ExpressionRows
+from utils.feature_store import FeatureStore
 from utils.utils_functions import get_contour_areas_list
 from utils.visualizer import Visualizer
+from utils.prefetcher import Prefetcher
+from utils.shared_arena import SharedArena, SharedArrayHandle
+from utils.point_checkpoint import PointCheckpoint
+from utils.stage_cache import StageCache, input_fingerprint
 from config.config_settings import Config
 
 '''
 Authors: Aswin Visva, John-Paul Oliveria, Ph.D
 '''
 
+# Pipeline of an expansion worker process, created once per process by _init_expansion_worker
+_worker_pipeline = None
+
+
+def _init_expansion_worker(config: Config):
+    """
+    Create the pipeline of an expansion worker process, so that only the inputs of each point are sent to it
+
+    :param config: Config, configuration settings
+    """
+    global _worker_pipeline
+
+    _worker_pipeline = MIBIPipeline(config)
+
+
+def _compute_point_expansion_data(*point_args) -> (list, list, list, list, int):
+    """
+    Compute the expansion data of a point in an expansion worker process
+
+    :param point_args: tuple, Arguments of MIBIPipeline._get_point_expansion_data
+    :return: tuple, Expansion data of the point as returned by MIBIPipeline._get_point_expansion_data
+    """
+    return _worker_pipeline._get_point_expansion_data(*point_args)
+
 
 class MIBIPipeline:
 
@@ -29,16 +63,23 @@ class MIBIPipeline:
         self.mibi_reader = MIBIReader(self.config)
         self.object_extractor = ObjectExtractor(self.config)
         self.visualizer = None
+        self.feature_store = None
+        self.prefetch_metrics = None
+        self.checkpoint = None
+        self.stage_cache = None
 
     def normalize_data(self,
-                       all_expansions_features: pd.DataFrame,
-                       markers_names: list):
+                       all_expansions_features: ExpressionRows,
+                       markers_names: list) -> FeatureStore:
         """
         Normalize Expansion Features
 
+        The features are collected into a feature store and normalized there, a feature DataFrame is only built from
+        the store when one is needed.
+
         :param markers_names: array_like, [n_markers] -> List of marker names
-        :param all_expansions_features: pd.DataFrame, Expansion features
-        :return: pd.DataFrame, Normalized expansion features
+        :param all_expansions_features: ExpressionRows, Expansion features
+        :return: FeatureStore, Normalized expansion features
         """
         logging.info("Performing data normalization:\n")
 
@@ -47,216 +88,459 @@ class MIBIPipeline:
         normalization = self.config.normalization_type
         n_markers = self.config.n_markers
 
-        all_expansions_features = normalize_expression_data(self.config,
-                                                            all_expansions_features,
-                                                            markers_names,
-                                                            transformation=transformation,
-                                                            normalization=normalization,
-                                                            scaling_factor=scaling_factor,
-                                                            n_markers=n_markers)
+        feature_store = FeatureStore.from_rows(all_expansions_features)
 
-        all_expansions_features["SMA Presence"] = ["Positive" if sma > self.config.SMA_positive_threshold
-                                                   else "Negative" for sma in all_expansions_features["SMA"]]
+        values = feature_store.values.astype(np.dtype(self.config.feature_precision), copy=False)
+        values[feature_store.present] = normalize_expression_values(self.config,
+                                                                    values[feature_store.present],
+                                                                    transformation=transformation,
+                                                                    normalization=normalization,
+                                                                    scaling_factor=scaling_factor,
+                                                                    n_markers=n_markers)
+        feature_store.values = values
 
-        all_expansions_features = all_expansions_features.sort_index()
-        all_expansions_features.index.rename(['Point', 'Vessel', 'Expansion', 'Data Type'], inplace=True)
+        feature_store.sma_positive = feature_store.present & \
+            (values[..., feature_store.marker_names.index("SMA")] > self.config.SMA_positive_threshold)
 
         if self.config.save_to_csv:
-            all_expansions_features.to_csv(self.config.csv_loc)
-
-        return all_expansions_features
-
-    def _get_outward_expansion_data(self,
-                                    all_points_vessel_contours: list,
-                                    all_points_vessel_contours_areas: list,
-                                    all_points_marker_data: list,
-                                    marker_names: list,
-                                    pixel_interval: int,
-                                    n_expansions: int) -> (list, list, list):
+            feature_store.to_dataframe(self.config.large_vessel_threshold).to_csv(self.config.csv_loc)
+
+        return feature_store
+
+    def _get_point_outward_expansion_data(self,
+                                          point_idx: int,
+                                          geometry: PointGeometry,
+                                          contours: list,
+                                          contour_areas: list,
+                                          marker_data: np.ndarray,
+                                          marker_names: list,
+                                          pixel_interval: int,
+                                          n_expansions: int) -> (list, list):
         """
-        Collect outward expansion data for each expansion, for each point, for each vessel
+        Collect outward expansion data for each expansion, for each vessel in a point
 
-        :param all_points_vessel_contours_areas: list -> Vessel contour areas
+        :param point_idx: int -> Point index
+        :param geometry: PointGeometry -> Cached vessel geometry of the point, shared between expansions
+        :param contours: list, [n_vessels] -> Vessel contours
+        :param contour_areas: list, [n_vessels] -> Vessel contour areas
+        :param marker_data: array_like, [n_markers, point_size[0], point_size[1]] -> Marker data
         :param marker_names: list -> Marker names
-        :param n_expansions: int -> Number of expansions to run
         :param pixel_interval: int -> Pixel interval
-        :param all_points_vessel_contours: array_like, [n_points, n_vessels] -> list of vessel contours for each point
-        :param all_points_marker_data: array_like, [n_points, n_markers, point_size[0], point_size[1]]
-        -> list of marker data for each point
+        :param n_expansions: int -> Number of expansions to run
 
-        :return: list, [n_expansions, n_points, n_vessels, n_markers] -> Outward microenvironment expansion data,
-        list, [n_expansions, n_points, n_vessels, n_markers] -> nonvessel space expansion data,
-        list, [n_expansions, n_points, n_vessels, n_markers] -> vessel space expansion data
+        :return: list, [n_expansions] -> Outward microenvironment expansion data,
+        list, [n_expansions] -> Number of vessels which could not expand for each expansion
         """
 
-        # Store all data in lists
         expansion_data = []
+        stopped_vessels_per_expansion = []
         current_interval = pixel_interval
-        n_points = self.config.n_points
+        ring_histogram = None
 
-        logging.info("Computing outward expansion data:\n")
+        if self.config.use_ring_histogram and n_expansions > 1:
+            # Upper bound of every outward ring, accumulated the same way as current_interval below
+            upper_bounds = [pixel_interval]
 
-        # Iterate through each expansion
-        for x in range(n_expansions):
+            for x in range(2, n_expansions):
+                upper_bounds.append(upper_bounds[-1] + pixel_interval)
 
-            logging.info("Expanding Distance... : %s%s\n" % (
-                str(x * self.config.pixels_to_distance * self.config.pixel_interval),
-                self.config.data_resolution_units))
-
-            current_expansion_data = []
-
-            all_points_stopped_vessels = 0
-
-            # Iterate through each point
-            for i in tqdm(range(n_points)):
-                contours = all_points_vessel_contours[i]
-                contour_areas = all_points_vessel_contours_areas[i]
-                marker_data = all_points_marker_data[i]
-                start_expression = datetime.datetime.now()
-
-                # If we are on the first expansion, calculate the marker expression within the vessel itself. Otherwise,
-                # calculate the marker expression in the outward microenvironment
-
-                if x == 0:
-                    data = calculate_composition_marker_expression(
-                        self.config,
-                        marker_data,
-                        contours,
-                        contour_areas,
-                        marker_names,
-                        point_num=i + 1)
-                else:
-                    data, expression_images, stopped_vessels = calculate_microenvironment_marker_expression(
-                        self.config,
-                        marker_data,
-                        contours,
-                        contour_areas,
-                        marker_names,
-                        pixel_expansion_upper_bound=current_interval,
-                        pixel_expansion_lower_bound=current_interval - pixel_interval,
-                        point_num=i + 1,
-                        expansion_num=x)
-
-                    all_points_stopped_vessels += stopped_vessels
-
-                end_expression = datetime.datetime.now()
-
-                logging.debug(
-                    "Finished calculating expression for Point %s in %s" % (
-                        str(i + 1), end_expression - start_expression))
-
-                current_expansion_data.append(data)
+            ring_histogram = geometry.ring_histogram(marker_data, upper_bounds)
 
-            logging.debug("There were %s vessels which could not expand inward/outward by %s pixels" % (
-                all_points_stopped_vessels, x * pixel_interval))
+        for x in range(n_expansions):
+            stopped_vessels = 0
 
-            all_points_features = pd.concat(current_expansion_data).fillna(0)
-            expansion_data.append(all_points_features)
+            # If we are on the first expansion, calculate the marker expression within the vessel itself. Otherwise,
+            # calculate the marker expression in the outward microenvironment
+            if x == 0:
+                data = calculate_composition_marker_expression(
+                    self.config,
+                    marker_data,
+                    contours,
+                    contour_areas,
+                    marker_names,
+                    point_num=point_idx + 1,
+                    geometry=geometry,
+                    return_rows=True)
+            else:
+                data, expression_images, stopped_vessels = calculate_microenvironment_marker_expression(
+                    self.config,
+                    marker_data,
+                    contours,
+                    contour_areas,
+                    marker_names,
+                    pixel_expansion_upper_bound=current_interval,
+                    pixel_expansion_lower_bound=current_interval - pixel_interval,
+                    point_num=point_idx + 1,
+                    expansion_num=x,
+                    geometry=geometry,
+                    ring_histogram=ring_histogram,
+                    return_rows=True)
 
-            if x != 0:
                 current_interval += pixel_interval
 
-            logging.debug("Current interval %s, previous interval %s" % (str(current_interval), str(current_interval -
-                                                                                                    pixel_interval)))
-        all_expansions_features = pd.concat(expansion_data).fillna(0)
+            expansion_data.append(data)
+            stopped_vessels_per_expansion.append(stopped_vessels)
+
+        return expansion_data, stopped_vessels_per_expansion
+
+    def _get_point_inward_expansion_data(self,
+                                         point_idx: int,
+                                         geometry: PointGeometry,
+                                         contours: list,
+                                         contour_areas: list,
+                                         marker_data: np.ndarray,
+                                         markers_names: list) -> (list, list):
+        """
+        Collect inward expansion data for each expansion, for each vessel in a point
+
+        :param point_idx: int -> Point index
+        :param geometry: PointGeometry -> Cached vessel geometry of the point, shared between expansions
+        :param contours: list, [n_vessels] -> Vessel contours
+        :param contour_areas: list, [n_vessels] -> Vessel contour areas
+        :param marker_data: array_like, [n_markers, point_size[0], point_size[1]] -> Marker data
+        :param markers_names: list -> Marker names
+
+        :return: list, [n_inward_expansions] -> Inward microenvironment expansion data, None where no vessel could
+        expand, list, [n_inward_expansions] -> Number of vessels which could not expand for each expansion
+        """
+
+        expansion_data = []
+        stopped_vessels_per_expansion = []
+        current_interval = self.config.pixel_interval
+        stopped_vessel_lookup = {}
+        expansion_num = 0
+
+        for current_expansion_no in range(self.config.max_inward_expansion):
+            expansion_num -= 1
+
+            data, stopped_vessels = calculate_inward_microenvironment_marker_expression(
+                self.config,
+                marker_data,
+                point_idx + 1,
+                expansion_num,
+                stopped_vessel_lookup,
+                contours,
+                contour_areas,
+                markers_names,
+                pixel_expansion_upper_bound=current_interval,
+                pixel_expansion_lower_bound=current_interval - self.config.pixel_interval,
+                geometry=geometry,
+                return_rows=True)
+
+            expansion_data.append(data)
+            stopped_vessels_per_expansion.append(stopped_vessels)
+
+            current_interval += self.config.pixel_interval
+
+        return expansion_data, stopped_vessels_per_expansion
+
+    def _get_point_expansion_data(self,
+                                  point_idx: int,
+                                  contours: list,
+                                  contour_areas: list,
+                                  marker_data: np.ndarray,
+                                  marker_names: list,
+                                  pixel_interval: int,
+                                  n_expansions: int) -> (list, list, list, list, int):
+        """
+        Collect the composition, inward and outward expansion data for each expansion, for each vessel in a point
+
+        The vessel geometry of the point is built once, shared by the composition and every expansion, and released
+        once they are all computed.
+
+        :param point_idx: int -> Point index
+        :param contours: list, [n_vessels] -> Vessel contours
+        :param contour_areas: list, [n_vessels] -> Vessel contour areas
+        :param marker_data: array_like, [n_markers, point_size[0], point_size[1]] -> Marker data, or the handle of
+        marker data published in shared memory
+        :param marker_names: list -> Marker names
+        :param pixel_interval: int -> Pixel interval
+        :param n_expansions: int -> Number of expansions to run
+
+        :return: list, [n_inward_expansions] -> Inward microenvironment expansion data (None if inward expansions
+        are disabled), list, [n_inward_expansions] -> Number of vessels which could not expand inward,
+        list, [n_expansions] -> Outward microenvironment expansion data, list, [n_expansions] -> Number of vessels
+        which could not expand outward, int -> Process id of the process which computed the point
+        """
+
+        if isinstance(marker_data, SharedArrayHandle):
+            # Published by the parent process, attach to it for the duration of the point
+            attached_marker_data = marker_data.attach()
 
-        return all_expansions_features
+            try:
+                return self._get_point_expansion_data(point_idx,
+                                                      contours,
+                                                      contour_areas,
+                                                      attached_marker_data.array,
+                                                      marker_names,
+                                                      pixel_interval,
+                                                      n_expansions)
+            finally:
+                attached_marker_data.close()
 
-    def _get_inward_expansion_data(self,
+        start_expression = datetime.datetime.now()
+
+        inward_data = None
+        inward_stopped_vessels = None
+
+        # No ring reaches further than the last outward expansion, so the vessel kernels can work on windows
+        geometry = PointGeometry(contours, marker_data[0].shape, max_distance=pixel_interval * n_expansions)
+
+        if self.config.perform_inward_expansions:
+            inward_data, inward_stopped_vessels = self._get_point_inward_expansion_data(point_idx,
+                                                                                        geometry,
+                                                                                        contours,
+                                                                                        contour_areas,
+                                                                                        marker_data,
+                                                                                        marker_names)
+
+        outward_data, outward_stopped_vessels = self._get_point_outward_expansion_data(point_idx,
+                                                                                       geometry,
+                                                                                       contours,
+                                                                                       contour_areas,
+                                                                                       marker_data,
+                                                                                       marker_names,
+                                                                                       pixel_interval,
+                                                                                       n_expansions)
+
+        geometry.release()
+
+        end_expression = datetime.datetime.now()
+
+        logging.debug(
+            "Finished calculating expression for Point %s in %s" % (
+                str(point_idx + 1), end_expression - start_expression))
+
+        return inward_data, inward_stopped_vessels, outward_data, outward_stopped_vessels, os.getpid()
+
+    def _load_point_expansion_data(self, point_idx: int):
+        """
+        Load the expansion data of a point persisted by an earlier run
+
+        :param point_idx: int -> Point index
+        :return: tuple, Expansion data of the point as returned by _get_point_expansion_data, with no process id,
+        None if the point has not been persisted
+        """
+
+        if self.checkpoint is None:
+            return None
+
+        point_data = self.checkpoint.load(point_idx + 1)
+
+        if point_data is None:
+            return None
+
+        return tuple(point_data) + (None,)
+
+    def _save_point_expansion_data(self, point_idx: int, point_data: tuple):
+        """
+        Persist the expansion data of a point, if checkpointing is enabled
+
+        :param point_idx: int -> Point index
+        :param point_data: tuple -> Expansion data of the point as returned by _get_point_expansion_data
+        """
+
+        if self.checkpoint is not None:
+            self.checkpoint.save(point_idx + 1, point_data[:-1])
+
+    def _iter_point_expansion_data(self,
                                    all_points_vessel_contours: list,
                                    all_points_vessel_contours_areas: list,
                                    all_points_marker_data: list,
-                                   markers_names: list) -> (list, int):
+                                   marker_names: list,
+                                   pixel_interval: int,
+                                   n_expansions: int):
         """
-        Collect inward expansion data for each expansion, for each point, for each vessel
+        Compute the inward and outward expansion data of each point
+
+        Points are computed in a process pool when n_expansion_workers > 1, with at most twice as many points in
+        flight as there are workers. The results are always yielded in point order, so they are identical to
+        computing the points serially. Dense marker stacks of the points in flight are published into shared memory
+        for the workers to attach to, and unlinked as soon as their point is collected. If checkpointing is enabled,
+        points persisted by an earlier run are loaded instead of computed, and every computed point is persisted.
 
-        :param all_points_vessel_contours_areas: list -> Vessel contour areas
-        :param markers_names: array_like, [n_markers] -> List of marker names
         :param all_points_vessel_contours: array_like, [n_points, n_vessels] -> list of vessel contours for each point
+        :param all_points_vessel_contours_areas: list -> Vessel contour areas
         :param all_points_marker_data: array_like, [n_points, n_markers, point_size[0], point_size[1]]
         -> list of marker data for each point
+        :param marker_names: list -> Marker names
+        :param pixel_interval: int -> Pixel interval
+        :param n_expansions: int -> Number of expansions to run
 
-        :return: list, [n_expansions, n_points, n_vessels, n_markers] -> Inward microenvironment expansion data,
-        int, Final number of expansions needed to complete
+        :return: generator, yields the expansion data of each point as returned by _get_point_expansion_data
         """
 
-        expansion_data = []
-        current_interval = self.config.pixel_interval
-        all_vessels_count = len([item for sublist in all_points_vessel_contours for item in sublist])
-        current_expansion_no = 0
         n_points = self.config.n_points
-        stopped_vessel_lookup = {}
-        expansion_num = 0
+        n_workers = max(1, self.config.n_expansion_workers)
 
-        stopped_vessel_dict = {
-            "Expansion Distance (%s)" % self.config.data_resolution_units: [],
-            "# of Stopped Vessels": []
-        }
+        # The pool is only started once a point has to be computed, a fully resumed run never starts it
+        executor = None
+        arena = SharedArena() if n_workers > 1 and self.config.share_marker_data_with_workers else None
 
-        logging.info("Computing inward expansion data:\n")
+        def point_args(point_idx):
+            marker_data = all_points_marker_data[point_idx]
 
-        # Continue expanding inward until all vessels have been stopped
-        while current_expansion_no < self.config.max_inward_expansion:
-            logging.info("Expanding Distance... : %s%s\n" % (str(current_expansion_no
-                                                                 * self.config.pixels_to_distance
-                                                                 * self.config.pixel_interval),
-                                                             self.config.data_resolution_units))
+            if arena is not None and isinstance(marker_data, np.ndarray):
+                # Workers attach to the marker stack by name rather than receiving a pickled copy of it
+                marker_data = arena.publish(point_idx, marker_data)
 
-            logging.debug(
-                "Current inward expansion: %s, Interval: %s" % (str(current_expansion_no), str(current_interval)))
-            expansion_num -= 1
+            return (point_idx,
+                    all_points_vessel_contours[point_idx],
+                    all_points_vessel_contours_areas[point_idx],
+                    marker_data,
+                    marker_names,
+                    pixel_interval,
+                    n_expansions)
+
+        logging.info("Computing expansion data using %s worker(s):\n" % n_workers)
+
+        in_flight = deque()
+        next_point = 0
+
+        # Number of points finished by each worker process
+        points_per_worker = Counter()
+        n_resumed = 0
+
+        try:
+            with tqdm(total=n_points) as progress:
+                # Iterate through each point
+                for i in range(n_points):
+                    if n_workers == 1:
+                        result = self._load_point_expansion_data(i)
+
+                        if result is None:
+                            result = self._get_point_expansion_data(*point_args(i))
+                    else:
+                        # Keep every worker busy without sending every point to the pool at once, futures are
+                        # consumed in submission order so the point order is deterministic
+                        while next_point < n_points and len(in_flight) < 2 * n_workers:
+                            resumed = self._load_point_expansion_data(next_point)
+
+                            if resumed is not None:
+                                future = Future()
+                                future.set_result(resumed)
+                            else:
+                                if executor is None:
+                                    executor = ProcessPoolExecutor(max_workers=n_workers,
+                                                                   initializer=_init_expansion_worker,
+                                                                   initargs=(self.config,))
+
+                                future = executor.submit(_compute_point_expansion_data, *point_args(next_point))
+
+                            in_flight.append(future)
+                            next_point += 1
+
+                            del resumed
+
+                        result = in_flight.popleft().result()
+
+                        if arena is not None:
+                            arena.release(i)
+
+                    # Points loaded from the checkpoint were not computed by any process in this run
+                    if result[-1] is None:
+                        n_resumed += 1
+                    else:
+                        self._save_point_expansion_data(i, result)
+                        points_per_worker[result[-1]] += 1
+
+                    progress.update()
+
+                    if n_workers > 1 and len(points_per_worker) > 0:
+                        progress.set_postfix(workers=len(points_per_worker),
+                                             points_per_worker="%s-%s" % (min(points_per_worker.values()),
+                                                                          max(points_per_worker.values())),
+                                             in_flight=len(in_flight))
+
+                    yield result
+                    del result
+        finally:
+            if executor is not None:
+                for future in in_flight:
+                    future.cancel()
+
+                executor.shutdown()
+
+            # Unlink the marker stacks of any points still published if a point failed
+            if arena is not None:
+                arena.close()
+
+        if n_workers > 1:
+            logging.debug("Points computed per worker: %s" % ", ".join(str(n) for n in points_per_worker.values()))
+
+        if n_resumed > 0:
+            logging.info("Resumed %s point(s) from the checkpoint in %s" % (n_resumed, self.checkpoint.run_dir))
+
+    def _collect_expansion_data(self,
+                                point_expansion_data,
+                                all_points_vessel_contours: list,
+                                marker_names: list,
+                                pixel_interval: int,
+                                n_expansions: int) -> (ExpressionRows, ExpressionRows, int):
+        """
+        Combine the inward and outward expansion data of each point, in point order
 
-            current_expansion_data = []
-            all_points_stopped_vessels = 0
+        :param point_expansion_data: iterable, Expansion data of each point as returned by _get_point_expansion_data
+        :param all_points_vessel_contours: array_like, [n_points, n_vessels] -> list of vessel contours for each
+        point, complete once point_expansion_data is exhausted
+        :param marker_names: list -> Marker names
+        :param pixel_interval: int -> Pixel interval
+        :param n_expansions: int -> Number of expansions to run
 
-            # Iterate through each point
-            for point_idx in tqdm(range(n_points)):
-                contours = all_points_vessel_contours[point_idx]
-                contour_areas = all_points_vessel_contours_areas[point_idx]
-                marker_data = all_points_marker_data[point_idx]
-                start_expression = datetime.datetime.now()
+        :return: ExpressionRows, Outward microenvironment expansion data, ExpressionRows, Inward microenvironment
+        expansion data (None if inward expansions are disabled), int, Final number of inward expansions
+        """
 
-                data, stopped_vessels = calculate_inward_microenvironment_marker_expression(
-                    self.config,
-                    marker_data,
-                    point_idx + 1,
-                    expansion_num,
-                    stopped_vessel_lookup,
-                    contours,
-                    contour_areas,
-                    markers_names,
-                    pixel_expansion_upper_bound=current_interval,
-                    pixel_expansion_lower_bound=current_interval - self.config.pixel_interval)
+        n_inward_expansions = self.config.max_inward_expansion if self.config.perform_inward_expansions else 0
 
-                all_points_stopped_vessels += stopped_vessels
+        outward_expansion_data = [[] for _ in range(n_expansions)]
+        outward_stopped_vessels = [0] * n_expansions
+        inward_expansion_data = [[] for _ in range(n_inward_expansions)]
+        inward_stopped_vessels = [0] * n_inward_expansions
 
-                if data is not None:
-                    current_expansion_data.append(data)
+        for point_inward_data, point_inward_stopped, point_outward_data, point_outward_stopped, _ in \
+                point_expansion_data:
+            for x in range(n_inward_expansions):
+                if point_inward_data[x] is not None:
+                    inward_expansion_data[x].append(point_inward_data[x])
+                inward_stopped_vessels[x] += point_inward_stopped[x]
 
-                end_expression = datetime.datetime.now()
+            for x in range(n_expansions):
+                outward_expansion_data[x].append(point_outward_data[x])
+                outward_stopped_vessels[x] += point_outward_stopped[x]
 
-                logging.debug(
-                    "Finished calculating expression for Point %s in %s" % (
-                        str(point_idx + 1), end_expression - start_expression))
+        for x in range(n_expansions):
+            logging.debug("There were %s vessels which could not expand inward/outward by %s pixels" % (
+                outward_stopped_vessels[x], x * pixel_interval))
 
-            if len(current_expansion_data) > 0:
-                all_points_features = pd.concat(current_expansion_data).fillna(0)
-                expansion_data.append(all_points_features)
+        all_expansions_features = ExpressionRows.concat([data for expansion_data in outward_expansion_data
+                                                         for data in expansion_data])
 
-            current_interval += self.config.pixel_interval
-            current_expansion_no += 1
+        if not self.config.perform_inward_expansions:
+            return all_expansions_features, None, 0
 
+        all_vessels_count = len([item for sublist in all_points_vessel_contours for item in sublist])
+
+        stopped_vessel_dict = {
+            "Expansion Distance (%s)" % self.config.data_resolution_units: [],
+            "# of Stopped Vessels": []
+        }
+
+        for x in range(n_inward_expansions):
             stopped_vessel_dict["Expansion Distance (%s)"
-                                % self.config.data_resolution_units].append(current_expansion_no
+                                % self.config.data_resolution_units].append((x + 1)
                                                                             * self.config.pixels_to_distance
                                                                             * self.config.pixel_interval)
-            stopped_vessel_dict["# of Stopped Vessels"].append(all_points_stopped_vessels)
+            stopped_vessel_dict["# of Stopped Vessels"].append(inward_stopped_vessels[x])
 
             logging.debug(
-                "There are %s / %s vessels which have failed to expand inward" % (str(all_points_stopped_vessels),
+                "There are %s / %s vessels which have failed to expand inward" % (str(inward_stopped_vessels[x]),
                                                                                   str(all_vessels_count)))
 
-        all_expansions_features = pd.concat(expansion_data).fillna(0)
+        # Every vessel may have failed to contract
+        all_inward_expansions_features = ExpressionRows.concat([ExpressionRows(marker_names)]
+                                                               + [data for expansion_data in inward_expansion_data
+                                                                  for data in expansion_data])
 
         stopped_vessel_df = pd.DataFrame.from_dict(stopped_vessel_dict)
         logging.info("\n" + stopped_vessel_df.to_markdown())
@@ -265,7 +549,46 @@ class MIBIPipeline:
             stopped_vessel_df.to_csv(
                 os.path.join(self.config.visualization_results_dir, "inward_vessel_expansion_summary.csv"))
 
-        return all_expansions_features, current_expansion_no
+        return all_expansions_features, all_inward_expansions_features, n_inward_expansions
+
+    def _get_expansion_data(self,
+                            all_points_vessel_contours: list,
+                            all_points_vessel_contours_areas: list,
+                            all_points_marker_data: list,
+                            marker_names: list,
+                            pixel_interval: int,
+                            n_expansions: int) -> (ExpressionRows, ExpressionRows, int):
+        """
+        Collect inward and outward expansion data for each point, for each expansion, for each vessel
+
+        The vessel geometry of a point (vessel fills, owner labels and distance fields) does not change between
+        expansions, so it is computed once per point, shared by all of its inward and outward expansions and evicted
+        once the point is finished.
+
+        :param all_points_vessel_contours_areas: list -> Vessel contour areas
+        :param marker_names: list -> Marker names
+        :param n_expansions: int -> Number of expansions to run
+        :param pixel_interval: int -> Pixel interval
+        :param all_points_vessel_contours: array_like, [n_points, n_vessels] -> list of vessel contours for each point
+        :param all_points_marker_data: array_like, [n_points, n_markers, point_size[0], point_size[1]]
+        -> list of marker data for each point
+
+        :return: ExpressionRows, Outward microenvironment expansion data, ExpressionRows, Inward microenvironment
+        expansion data (None if inward expansions are disabled), int, Final number of inward expansions
+        """
+
+        point_expansion_data = self._iter_point_expansion_data(all_points_vessel_contours,
+                                                               all_points_vessel_contours_areas,
+                                                               all_points_marker_data,
+                                                               marker_names,
+                                                               pixel_interval,
+                                                               n_expansions)
+
+        return self._collect_expansion_data(point_expansion_data,
+                                            all_points_vessel_contours,
+                                            marker_names,
+                                            pixel_interval,
+                                            n_expansions)
 
     def generate_visualizations(self):
         """
@@ -346,75 +669,212 @@ class MIBIPipeline:
             if self.config.create_allpoints_expansion_line_plots:
                 self.visualizer.all_points_plots(x + 1)
 
-    def load_preprocess_data(self):
+    def _read_and_expand(self, pixel_interval: int, n_expansions: int) -> (list, list, list, list, list,
+                                                                           ExpressionRows, int):
         """
-        Create the visualizations for inward and outward vessel expansions and populate all results in the directory
-        set in the configuration settings.
-        """
-
-        self.config.display()
-
-        n_expansions = self.config.max_expansions
-        interval = self.config.pixel_interval
-        expansions = self.config.expansion_to_run  # Expansions that you want to run
+        Read every point, extract its vessels and collect the expansion data of every vessel
 
-        n_expansions += 1  # Intuitively, 5 expansions means 5 expansions excluding the original composition of the
-        # vessel, but we mean 5 expansions including the original composition - thus 4 expansions. Therefore lets add 1
-        # so we are on the same page.
+        :param pixel_interval: int -> Pixel interval
+        :param n_expansions: int -> Number of expansions to run
 
-        assert n_expansions >= max(expansions), "More expansions selected than available!"
+        :return: array_like, [n_points, n_vessels] -> Vessel contours, array_like, [n_points, n_vessels] -> Vessel
+        contour areas, array_like, [n_points, n_removed_vessels] -> Removed vessel contours, array_like, [n_points,
+        n_markers, point_size[0], point_size[1]] -> Marker data (None if it was released in point-major order),
+        array_like, [n_markers] -> Names of markers, ExpressionRows -> Inward and outward expansion data,
+        int -> Final number of inward expansions
+        """
 
-        all_points_segmentation_masks, all_points_marker_data, markers_names = self.mibi_reader.get_all_point_data()  #
-        # Collect all marker and mask data
+        point_major = self.config.execution_order == "point"
 
+        all_points_marker_data = []
         all_points_vessel_contours = []
-        all_points_vessel_regions_of_interest = []
         all_points_removed_vessel_contours = []
         all_points_vessel_contours_areas = []
 
-        # Collect vessel contours from each segmentation mask
-        for point_idx, segmentation_mask in enumerate(all_points_segmentation_masks):
+        all_points_expansion_data = []
+
+        points = self.mibi_reader.iter_point_data()
+
+        # Read the next points on a background thread while the current point is being processed
+        if self.config.prefetch_queue_depth > 0:
+            points = Prefetcher(points, depth=self.config.prefetch_queue_depth)
+
+        start = datetime.datetime.now()
+
+        # Stream the points from the reader and collect vessel contours from each segmentation mask, the segmentation
+        # masks (and the vessel regions of interest, which are views into them) are released as soon as their
+        # contours have been extracted
+        for point_num, segmentation_mask, marker_data, markers_names in points:
             vessel_regions_of_interest, contours, removed_contours = self.object_extractor.extract(segmentation_mask,
                                                                                                    point_name=str(
-                                                                                                       point_idx + 1))
+                                                                                                       point_num))
+            contour_areas = get_contour_areas_list(contours)
+
+            if point_major:
+                # The composition and every expansion of the point only depend on this point, so compute them while
+                # the next point is read and release its marker data before moving to the next point
+                point_expansion_data = self._load_point_expansion_data(point_num - 1)
+
+                if point_expansion_data is None:
+                    point_expansion_data = self._get_point_expansion_data(point_num - 1,
+                                                                          contours,
+                                                                          contour_areas,
+                                                                          marker_data,
+                                                                          markers_names,
+                                                                          pixel_interval,
+                                                                          n_expansions)
+                    self._save_point_expansion_data(point_num - 1, point_expansion_data)
+
+                all_points_expansion_data.append(point_expansion_data)
+            else:
+                all_points_marker_data.append(marker_data)
+
             all_points_vessel_contours.append(contours)
-            all_points_vessel_contours_areas.append(get_contour_areas_list(contours))
-            all_points_vessel_regions_of_interest.append(vessel_regions_of_interest)
+            all_points_vessel_contours_areas.append(contour_areas)
             all_points_removed_vessel_contours.append(removed_contours)
 
-        # Inward expansion data
-        if self.config.perform_inward_expansions:
-            all_inward_expansions_features, current_expansion_no = self._get_inward_expansion_data(
+            del segmentation_mask, vessel_regions_of_interest, marker_data
+
+        end = datetime.datetime.now()
+
+        if isinstance(points, Prefetcher):
+            self.prefetch_metrics = {
+                "Queue Depth": points.depth,
+                "Stall Times": points.stall_times,
+                "Total Stall Time": points.total_stall_time,
+                "Total Time": (end - start).total_seconds()
+            }
+
+            logging.info("Stalled for %.2fs waiting for point data out of %.2fs reading and extracting vessels "
+                         "(queue depth %s)" % (points.total_stall_time,
+                                               (end - start).total_seconds(),
+                                               points.depth))
+
+        # Collect outward microenvironment expansion data, nonvessel space expansion data, vessel space expansion
+        # data and inward expansion data
+        if point_major:
+            all_expansions_features, all_inward_expansions_features, current_expansion_no = \
+                self._collect_expansion_data(all_points_expansion_data,
+                                             all_points_vessel_contours,
+                                             markers_names,
+                                             pixel_interval,
+                                             n_expansions)
+
+            # The marker data of every point was released once its features were computed, the visualizer reads
+            # points again as it needs them
+            all_points_marker_data = None
+        else:
+            all_expansions_features, all_inward_expansions_features, current_expansion_no = self._get_expansion_data(
                 all_points_vessel_contours,
                 all_points_vessel_contours_areas,
                 all_points_marker_data,
-                markers_names)
+                markers_names,
+                pixel_interval,
+                n_expansions)
 
+        if self.config.perform_inward_expansions:
             logging.debug("Finished inward expansions with a maximum of %s %s"
                           % (
                               str(
                                   current_expansion_no * self.config.pixel_interval * self.config.pixels_to_distance),
                               str(self.config.data_resolution_units)))
 
-        # Collect outward microenvironment expansion data, nonvessel space expansion data and vessel space expansion
-        # data
-        all_expansions_features = self._get_outward_expansion_data(all_points_vessel_contours,
-                                                                   all_points_vessel_contours_areas,
-                                                                   all_points_marker_data,
-                                                                   markers_names,
-                                                                   interval,
-                                                                   n_expansions)
-
         if self.config.perform_inward_expansions:
-            all_expansions_features = all_expansions_features.append(all_inward_expansions_features)
+            all_expansions_features = ExpressionRows.concat([all_expansions_features, all_inward_expansions_features])
+
+        return (all_points_vessel_contours,
+                all_points_vessel_contours_areas,
+                all_points_removed_vessel_contours,
+                all_points_marker_data,
+                markers_names,
+                all_expansions_features,
+                current_expansion_no)
+
+    def load_preprocess_data(self):
+        """
+        Create the visualizations for inward and outward vessel expansions and populate all results in the directory
+        set in the configuration settings.
+        """
+
+        self.config.display()
+
+        n_expansions = self.config.max_expansions
+        interval = self.config.pixel_interval
+        expansions = self.config.expansion_to_run  # Expansions that you want to run
+
+        n_expansions += 1  # Intuitively, 5 expansions means 5 expansions excluding the original composition of the
+        # vessel, but we mean 5 expansions including the original composition - thus 4 expansions. Therefore lets add 1
+        # so we are on the same page.
+
+        assert n_expansions >= max(expansions), "More expansions selected than available!"
 
-        # Normalize all features
-        all_expansions_features = self.normalize_data(all_expansions_features,
-                                                      markers_names)
+        # Check the whole dataset up front rather than failing on a missing or malformed TIF hours into the run
+        if self.config.validate_dataset_before_run:
+            self.mibi_reader.validate_dataset()
+
+        assert self.config.execution_order in ["expansion", "point"], "Unrecognized execution order!"
+
+        if self.config.checkpoint_dir is not None:
+            self.checkpoint = PointCheckpoint(self.config.checkpoint_dir,
+                                              self.config,
+                                              marker_names=self.mibi_reader.get_marker_names())
+
+        stage_keys = None
+        extracted = None
+        expanded = None
+        normalized = None
+
+        if self.config.stage_cache_dir is not None:
+            self.stage_cache = StageCache(self.config.stage_cache_dir, max_bytes=self.config.stage_cache_max_bytes)
+            stage_keys = StageCache.stage_keys(self.config, input_fingerprint(self.config,
+                                                                              self.mibi_reader.get_point_locations(),
+                                                                              self.mibi_reader.get_marker_names()))
+
+            # The vessels are needed for plotting, the expansion data only if the normalized features are not cached
+            extracted = self.stage_cache.get("extract", stage_keys["extract"])
+            normalized = self.stage_cache.get("normalize", stage_keys["normalize"])
+
+            if extracted is not None and normalized is None:
+                expanded = self.stage_cache.get("expand", stage_keys["expand"])
+
+        if extracted is None or (normalized is None and expanded is None):
+            (all_points_vessel_contours,
+             all_points_vessel_contours_areas,
+             all_points_removed_vessel_contours,
+             all_points_marker_data,
+             markers_names,
+             all_expansions_features,
+             current_expansion_no) = self._read_and_expand(interval, n_expansions)
+
+            if self.stage_cache is not None:
+                self.stage_cache.put("extract", stage_keys["extract"], (all_points_vessel_contours,
+                                                                        all_points_vessel_contours_areas,
+                                                                        all_points_removed_vessel_contours,
+                                                                        markers_names))
+                self.stage_cache.put("expand", stage_keys["expand"], (all_expansions_features, current_expansion_no))
+        else:
+            all_points_vessel_contours, all_points_vessel_contours_areas, all_points_removed_vessel_contours, \
+                markers_names = extracted
+
+            # No point was read, the visualizer reads points again as it needs them
+            all_points_marker_data = None
+
+            if expanded is not None:
+                all_expansions_features, current_expansion_no = expanded
+
+        if normalized is None:
+            # Normalize all features
+            self.feature_store = self.normalize_data(all_expansions_features,
+                                                     markers_names)
+
+            if self.stage_cache is not None:
+                self.stage_cache.put("normalize", stage_keys["normalize"], self.feature_store)
+        else:
+            self.feature_store = normalized
 
         self.visualizer = Visualizer(
             self.config,
-            all_expansions_features,
+            self.feature_store,
             markers_names,
             all_points_vessel_contours,
             all_points_removed_vessel_contours,
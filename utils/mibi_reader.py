@@ -1,9 +1,12 @@
 import datetime
+import hashlib
 import json
 import os
 import random
-from collections import Counter
+from collections import Counter, deque
 import logging
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from tqdm import tqdm
 
 import numpy as np
@@ -12,11 +15,39 @@ from PIL import Image
 
 from config.config_settings import Config
 from utils import tiff_reader
+from utils.dataset_manifest import DatasetManifest
+from utils.point_cache import PointCache
+from utils.sparse_markers import SparseMarkerData
 
 '''
 Authors: Aswin Visva, John-Paul Oliveria, Ph.D
 '''
 
+# Reader of a reading worker process, created once per process by _init_reading_worker
+_worker_reader = None
+
+
+def _init_reading_worker(config: Config):
+    """
+    Create the reader of a reading worker process, so that only the location of each point is sent to it
+
+    :param config: Config, configuration settings
+    """
+    global _worker_reader
+
+    _worker_reader = MIBIReader(config)
+
+
+def _read_point_in_worker(point_location: (str, str, str), markers=None) -> (np.ndarray, np.ndarray, list, float, int):
+    """
+    Read a single point in a reading worker process
+
+    :param point_location: tuple, (Point name, Marker data directory, Segmentation mask path)
+    :param markers: list or str, Marker names or the name of a marker cluster to load
+    :return: tuple, Point data as returned by MIBIReader._read_point
+    """
+    return _worker_reader._read_point(point_location, markers)
+
 
 class MIBIReader:
 
@@ -26,45 +57,52 @@ class MIBIReader:
         :param config: Config -> configuration settings
         """
         self.config = config
+        self.point_read_times = {}
+        self.point_peak_allocations = {}
+        self.manifest = None
 
-    def read(self, data_loc: str, mask_loc: str) -> (np.ndarray, np.ndarray, list):
+        if self.config.point_cache_dir is not None:
+            self.point_cache = PointCache(self.config.point_cache_dir)
+        else:
+            self.point_cache = None
+
+    def read(self, data_loc: str, mask_loc: str, markers=None) -> (np.ndarray, np.ndarray, list):
         """
         Read the MIBI data from a single point
 
+        If a point cache directory is configured, the point is decoded once, written to the cache and returned as
+        read-only memory mapped views into the cache file. If sparse_marker_data is set, the marker data is returned
+        as SparseMarkerData instead of a dense array.
+
         :param mask_loc: str -> Directory pointing to the segmentation masks
         :param data_loc: str -> Directory pointing to the marker data
+        :param markers: list or str, Marker names or the name of a marker cluster to load, defaults to markers_to_load
         :return: array_like, [n_markers, point_size[0], point_size[1]] -> Marker data,
         array_like, [point_size[0], point_size[1]] -> Segmentation mask
         """
 
-        # Get marker clusters, markers to ignore etc.
-        markers_to_ignore = self.config.markers_to_ignore
-        marker_clusters = self.config.marker_clusters
         plot = self.config.show_segmentation_masks_when_reading
-        plot_markers = self.config.describe_markers_when_reading
+        marker_names = self.get_marker_names(markers)
 
-        marker_names = []
-        marker_images = []
+        if self.point_cache is not None:
+            point_name = self._get_point_cache_name(data_loc, mask_loc)
 
-        for key in marker_clusters.keys():
-            for marker_name in marker_clusters[key]:
+            # Re-ingest the point if it was never cached, or it was cached from different files or with different
+            # settings, the cache always holds every marker so that any subset can be served from it
+            all_marker_names = self._get_all_marker_names()
+            source = self._get_point_cache_source(data_loc, mask_loc, all_marker_names)
 
-                # Path to marker tif file
-                path = os.path.join(data_loc, "%s.tif" % marker_name)
-                img = tiff_reader.read(path, describe=plot_markers)
+            if self.point_cache.read_source(point_name) != source:
+                self.point_cache.write(point_name, *self._decode(data_loc, mask_loc, all_marker_names), source=source)
 
-                if marker_name not in markers_to_ignore:
-                    marker_images.append(img.copy())
-                    marker_names.append(marker_name)
+            segmentation_mask, markers_img, cached_marker_names = self.point_cache.read(point_name)
 
-        markers_img = np.array(marker_images)
+            markers_img = self._select_markers(markers_img, cached_marker_names, marker_names)
+        else:
+            segmentation_mask, markers_img, marker_names = self._decode(data_loc, mask_loc, marker_names)
 
-        try:
-            segmentation_mask = np.array(Image.open(mask_loc).convert("RGB"))
-        except FileNotFoundError:
-            # If there is no segmentation mask, return a blank image
-            segmentation_mask = np.zeros((self.config.segmentation_mask_size[0], self.config.segmentation_mask_size[1], 3),
-                                         np.uint8)
+        if self.config.sparse_marker_data:
+            markers_img = SparseMarkerData.from_dense(markers_img)
 
         if plot:
             cv.imshow("Segmentation Mask", segmentation_mask)
@@ -72,66 +110,444 @@ class MIBIReader:
 
         return segmentation_mask, markers_img, marker_names
 
-    def get_all_point_data(self) -> (list, list, list):
+    def _decode(self, data_loc: str, mask_loc: str, marker_names: list) -> (np.ndarray, np.ndarray, list):
         """
-        Collect all points marker data, segmentation masks and marker names
+        Decode the TIFs of a single point
 
-        :return: array_like, [n_points, n_markers, point_size[0], point_size[1]] -> Marker data,
-        array_like, [n_points, point_size[0], point_size[1]] -> Segmentation masks,
-        array_like, [n_points, n_markers] -> Names of markers
+        :param mask_loc: str -> Directory pointing to the segmentation masks
+        :param data_loc: str -> Directory pointing to the marker data
+        :param marker_names: array_like, [n_markers] -> Names of markers to decode
+        :return: array_like, [point_size[0], point_size[1]] -> Segmentation mask,
+        array_like, [n_markers, point_size[0], point_size[1]] -> Marker data,
+        array_like, [n_markers] -> Names of markers
         """
 
-        fovs = [self.config.point_dir + str(i + 1) for i in range(self.config.n_points_per_dir)]
+        plot_markers = self.config.describe_markers_when_reading
 
-        all_points_segmentation_masks = []
-        all_points_marker_data = []
-        segmentation_type = self.config.selected_segmentation_mask_type
+        # Only the requested markers are decoded
+        if self.config.multipage_tiff_name is not None:
+            # All markers are pages of one multi-page or OME-TIFF stack, matched to marker names by page metadata
+            markers_img, marker_names = tiff_reader.read_stack(os.path.join(data_loc, self.config.multipage_tiff_name),
+                                                               marker_names,
+                                                               describe=plot_markers)
 
-        if self.config.caud_hip_mfg_separate_dir:
+            if self.config.marker_data_dtype is not None:
+                markers_img = tiff_reader.cast(markers_img, self.config.marker_data_dtype, data_loc)
 
-            brain_region_directories = [self.config.mfg_dir, self.config.hip_dir, self.config.caud_dir]
+            return self.read_segmentation_mask(mask_loc), markers_img, marker_names
+
+        paths = [os.path.join(data_loc, "%s.tif" % marker_name) for marker_name in marker_names]
+
+        # Allocate the marker stack once from the first TIF header and decode every TIF directly into its slice, the
+        # native TIF data type is kept unless a marker data type is configured
+        img_shape, img_dtype = tiff_reader.read_header(paths[0])
+
+        if self.config.marker_data_dtype is None:
+            markers_img = np.empty((len(paths),) + img_shape, dtype=img_dtype)
+
+            for marker_idx, path in enumerate(paths):
+                tiff_reader.read(path, describe=plot_markers, out=markers_img[marker_idx])
+        else:
+            markers_img = np.empty((len(paths),) + img_shape, dtype=np.dtype(self.config.marker_data_dtype))
+
+            for marker_idx, path in enumerate(paths):
+                markers_img[marker_idx] = tiff_reader.read(path,
+                                                           describe=plot_markers,
+                                                           dtype=markers_img.dtype)
+
+        segmentation_mask = self.read_segmentation_mask(mask_loc)
+
+        return segmentation_mask, markers_img, marker_names
+
+    def read_segmentation_mask(self, mask_loc: str) -> np.ndarray:
+        """
+        Read the segmentation mask of a single point
+
+        By default the mask is read as a single channel binary image, vessel pixels are 255 and background pixels are
+        0. If load_rgb_segmentation_masks is set, the mask is converted to a 3-channel RGB image instead.
 
-            for brain_region_directory in brain_region_directories:
-                for fov in fovs:
-                    # Get path to data selected through configuration settings
-                    data_loc = os.path.join(self.config.data_dir,
-                                            brain_region_directory,
-                                            fov,
-                                            self.config.tifs_dir)
+        :param mask_loc: str -> Path to the segmentation mask
+        :return: array_like, [point_size[0], point_size[1]] or [point_size[0], point_size[1], 3] -> Segmentation mask
+        """
+
+        mask_size = self.config.segmentation_mask_size
 
-                    # Get path to mask selected through configuration settings
-                    mask_loc = os.path.join(self.config.masks_dir,
-                                            brain_region_directory,
-                                            fov,
-                                            segmentation_type + '.tif')
+        if self.config.load_rgb_segmentation_masks:
+            try:
+                return np.array(Image.open(mask_loc).convert("RGB"))
+            except FileNotFoundError:
+                # If there is no segmentation mask, return a blank image
+                return np.zeros((mask_size[0], mask_size[1], 3), np.uint8)
 
-                    start = datetime.datetime.now()
-                    segmentation_mask, marker_data, marker_names = self.read(data_loc, mask_loc)
-                    end = datetime.datetime.now()
+        try:
+            segmentation_mask = tiff_reader.read(mask_loc)
+        except FileNotFoundError:
+            # If there is no segmentation mask, return a blank image
+            return np.zeros((mask_size[0], mask_size[1]), np.uint8)
 
-                    logging.debug("Finished reading %s in %s" % (fov, str(end - start)))
+        # Masks saved with colour channels are collapsed, any nonzero channel marks a vessel pixel
+        if segmentation_mask.ndim == 3:
+            channel_axis = 2 if segmentation_mask.shape[2] in [3, 4] else 0
+            segmentation_mask = np.any(segmentation_mask != 0, axis=channel_axis)
 
-                    all_points_segmentation_masks.append(segmentation_mask)
-                    all_points_marker_data.append(marker_data)
+        if segmentation_mask.dtype == np.uint8:
+            cv.threshold(segmentation_mask, 0, 255, cv.THRESH_BINARY, dst=segmentation_mask)
         else:
+            segmentation_mask = np.where(segmentation_mask != 0, 255, 0).astype(np.uint8)
+
+        return segmentation_mask
+
+    def get_marker_names(self, markers=None) -> list:
+        """
+        Get the names of the markers which are read for every point, in stacking order
+
+        :param markers: list or str, Marker names or the name of a marker cluster to load, defaults to
+        markers_to_load, all markers which are not ignored are loaded if both are None
+        :return: array_like, [n_markers] -> Names of markers
+        """
+
+        all_marker_names = self._get_all_marker_names()
+
+        if markers is None:
+            markers = self.config.markers_to_load
+
+        if markers is None:
+            return all_marker_names
+
+        if isinstance(markers, str):
+            assert markers in self.config.marker_clusters, "Unrecognized marker cluster %s!" % markers
+            markers = self.config.marker_clusters[markers]
+
+        unknown_markers = [marker_name for marker_name in markers if marker_name not in all_marker_names]
+        assert len(unknown_markers) == 0, "Unrecognized or ignored markers %s!" % str(unknown_markers)
+
+        return [marker_name for marker_name in all_marker_names if marker_name in markers]
+
+    def _get_all_marker_names(self) -> list:
+        """
+        Get the names of all markers which are not ignored, in stacking order
+
+        :return: array_like, [n_markers] -> Names of markers
+        """
+
+        return [marker_name
+                for key in self.config.marker_clusters.keys()
+                for marker_name in self.config.marker_clusters[key]
+                if marker_name not in self.config.markers_to_ignore]
+
+    @staticmethod
+    def _select_markers(marker_data: np.ndarray, available_marker_names: list, marker_names: list) -> np.ndarray:
+        """
+        Select a subset of markers from a marker stack, as a view if the markers are stacked contiguously
+
+        :param marker_data: array_like, [n_available_markers, point_size[0], point_size[1]] -> Marker data
+        :param available_marker_names: array_like, [n_available_markers] -> Names of markers in the stack
+        :param marker_names: array_like, [n_markers] -> Names of markers to select
+        :return: array_like, [n_markers, point_size[0], point_size[1]] -> Marker data
+        """
+
+        indices = [available_marker_names.index(marker_name) for marker_name in marker_names]
+
+        if indices == list(range(indices[0], indices[0] + len(indices))):
+            return marker_data[indices[0]:indices[0] + len(indices)]
+
+        return marker_data[indices]
+
+    def _get_point_cache_name(self, data_loc: str, mask_loc: str) -> str:
+        """
+        Get the name a point is stored under in the point cache
+
+        :param mask_loc: str -> Directory pointing to the segmentation masks
+        :param data_loc: str -> Directory pointing to the marker data
+        :return: str, Point cache name
+        """
+
+        point_dir = os.path.relpath(os.path.abspath(data_loc), os.path.abspath(self.config.data_dir))
+        segmentation_type = os.path.splitext(os.path.basename(mask_loc))[0]
+
+        return "%s_%s" % (point_dir.replace(os.sep, "_"), segmentation_type)
+
+    def _get_point_cache_source(self, data_loc: str, mask_loc: str, marker_names: list) -> str:
+        """
+        Fingerprint everything a cached point is decoded from: the size and modification time of its marker TIFs
+        and segmentation mask, and the settings which change how they are decoded
+
+        :param mask_loc: str -> Directory pointing to the segmentation masks
+        :param data_loc: str -> Directory pointing to the marker data
+        :param marker_names: array_like, [n_markers] -> Names of markers in the cached stack
+        :return: str, SHA-256 hex digest of the point sources
+        """
+
+        if self.config.multipage_tiff_name is not None:
+            paths = [os.path.join(data_loc, self.config.multipage_tiff_name)]
+        else:
+            paths = [os.path.join(data_loc, "%s.tif" % marker_name) for marker_name in marker_names]
+
+        files = {}
+
+        for path in paths + [mask_loc]:
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                files[path] = [stat.st_size, stat.st_mtime_ns]
+            else:
+                files[path] = None
+
+        source = {
+            "marker_names": list(marker_names),
+            "files": files,
+            "marker_data_dtype": self.config.marker_data_dtype,
+            "segmentation_mask_size": list(self.config.segmentation_mask_size),
+            "multipage_tiff_name": self.config.multipage_tiff_name,
+            "load_rgb_segmentation_masks": self.config.load_rgb_segmentation_masks
+        }
+
+        return hashlib.sha256(json.dumps(source, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def ingest_point_cache(self):
+        """
+        Decode every point once and write it to the point cache, points which are already cached are skipped
+        """
+
+        assert self.point_cache is not None, "Please set point_cache_dir in the configuration settings first!"
+
+        for fov, data_loc, mask_loc in tqdm(self.get_point_locations()):
+            start = datetime.datetime.now()
+            self.read(data_loc, mask_loc)
+            end = datetime.datetime.now()
+
+            logging.debug("Finished ingesting %s in %s" % (fov, str(end - start)))
+
+    def _read_point(self, point_location: (str, str, str), markers=None) -> (np.ndarray, np.ndarray, list, float, int):
+        """
+        Read a single point and time how long it took
+
+        If trace_reading_allocations is set, the peak number of bytes allocated while reading the point is traced as
+        well. The trace is process wide, so it is only attributable to a single point when points are read serially.
+
+        :param point_location: tuple, (Point name, Marker data directory, Segmentation mask path)
+        :param markers: list or str, Marker names or the name of a marker cluster to load
+        :return: array_like, [point_size[0], point_size[1]] -> Segmentation mask,
+        array_like, [n_markers, point_size[0], point_size[1]] -> Marker data,
+        array_like, [n_markers] -> Names of markers,
+        float, Seconds spent reading the point,
+        int, Peak bytes allocated while reading the point, None if allocations are not traced
+        """
+
+        fov, data_loc, mask_loc = point_location
+        trace = self.config.trace_reading_allocations
+        peak_allocation = None
+
+        if trace:
+            started_tracing = not tracemalloc.is_tracing()
+
+            if started_tracing:
+                tracemalloc.start()
+
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+
+        start = datetime.datetime.now()
+        segmentation_mask, marker_data, marker_names = self.read(data_loc, mask_loc, markers=markers)
+        end = datetime.datetime.now()
+
+        if trace:
+            _, peak = tracemalloc.get_traced_memory()
+            peak_allocation = peak - baseline
+
+            if started_tracing:
+                tracemalloc.stop()
+
+        return segmentation_mask, marker_data, marker_names, (end - start).total_seconds(), peak_allocation
+
+    def get_point_locations(self) -> list:
+        """
+        Get the marker data directory and segmentation mask path of every point, in the order points are indexed
+        throughout the pipeline. The locations are taken from the dataset manifest once it has been validated.
+
+        :return: list, [n_points] -> (Point name, Marker data directory, Segmentation mask path)
+        """
+
+        if self.manifest is not None:
+            return self.manifest.get_point_locations()
+
+        return self._get_configured_point_locations()
+
+    def validate_dataset(self) -> DatasetManifest:
+        """
+        Validate that every marker TIF and segmentation mask exists and has the configured shape before a run starts
+
+        The dataset manifest is loaded from manifest_path if it matches the configured points and markers, otherwise
+        it is built from the TIFF headers (and saved if manifest_path is set). No pixel data is decoded.
+
+        :return: DatasetManifest, Validated manifest of the dataset
+        """
+
+        manifest_path = self.config.manifest_path
+        point_locations = self._get_configured_point_locations()
+        marker_names = self.get_marker_names()
+        manifest = None
+
+        start = datetime.datetime.now()
+
+        if manifest_path is not None and os.path.isfile(manifest_path):
+            manifest = DatasetManifest.load(self.config, manifest_path)
+
+            if not manifest.matches(point_locations, marker_names):
+                logging.info("Dataset manifest %s does not match the configuration settings, rebuilding it"
+                             % manifest_path)
+                manifest = None
+
+        if manifest is None:
+            manifest = DatasetManifest.build(self.config, point_locations, marker_names)
+
+        problems = manifest.validate()
+
+        if manifest_path is not None:
+            manifest.save(manifest_path)
+
+        end = datetime.datetime.now()
+
+        if len(problems) > 0:
+            raise ValueError("Dataset validation failed with %s problem(s):\n%s" % (len(problems),
+                                                                                   "\n".join(problems)))
+
+        logging.info("Validated %s points in %s" % (len(point_locations), str(end - start)))
+
+        self.manifest = manifest
+
+        return manifest
+
+    def _get_configured_point_locations(self) -> list:
+        """
+        Build the marker data directory and segmentation mask path of every point from the configuration settings
+
+        :return: list, [n_points] -> (Point name, Marker data directory, Segmentation mask path)
+        """
+
+        fovs = [self.config.point_dir + str(i + 1) for i in range(self.config.n_points_per_dir)]
+        segmentation_type = self.config.selected_segmentation_mask_type
+
+        if self.config.caud_hip_mfg_separate_dir:
+            brain_region_directories = [self.config.mfg_dir, self.config.hip_dir, self.config.caud_dir]
+        else:
+            brain_region_directories = [""]
+
+        point_locations = []
+
+        for brain_region_directory in brain_region_directories:
             for fov in fovs:
                 # Get path to data selected through configuration settings
                 data_loc = os.path.join(self.config.data_dir,
+                                        brain_region_directory,
                                         fov,
                                         self.config.tifs_dir)
 
                 # Get path to mask selected through configuration settings
                 mask_loc = os.path.join(self.config.masks_dir,
+                                        brain_region_directory,
                                         fov,
                                         segmentation_type + '.tif')
 
-                start = datetime.datetime.now()
-                segmentation_mask, marker_data, marker_names = self.read(data_loc, mask_loc)
-                end = datetime.datetime.now()
+                point_locations.append((os.path.join(brain_region_directory, fov), data_loc, mask_loc))
+
+        return point_locations
+
+    def iter_point_data(self, markers=None):
+        """
+        Iterate over all points, reading them one at a time so that only the points currently being read and the
+        point handed to the caller are held in memory
+
+        Points are read concurrently when n_reading_workers > 1, with at most n_reading_workers points in flight,
+        the points are always yielded in point order
 
-                logging.debug("Finished reading %s in %s" % (fov, str(end - start)))
+        :param markers: list or str, Marker names or the name of a marker cluster to load, defaults to markers_to_load
+        :return: generator, yields (int, Point number starting from 1,
+        array_like, [point_size[0], point_size[1]] -> Segmentation mask,
+        array_like, [n_markers, point_size[0], point_size[1]] -> Marker data,
+        array_like, [n_markers] -> Names of markers)
+        """
+
+        point_locations = self.get_point_locations()
+        n_workers = max(1, self.config.n_reading_workers)
+
+        self.point_read_times = {}
+        self.point_peak_allocations = {}
+
+        if n_workers == 1:
+            executor = None
+        else:
+            assert self.config.reading_executor in ["thread", "process"], "Unrecognized reading executor!"
+
+            if self.config.reading_executor == "process":
+                executor = ProcessPoolExecutor(max_workers=n_workers,
+                                               initializer=_init_reading_worker,
+                                               initargs=(self.config,))
+                read_point = _read_point_in_worker
+            else:
+                executor = ThreadPoolExecutor(max_workers=n_workers)
+                read_point = self._read_point
+
+        start = datetime.datetime.now()
+        in_flight = deque()
+        next_location = 0
+
+        try:
+            for point_idx, (fov, _, _) in enumerate(point_locations):
+                if executor is None:
+                    result = self._read_point(point_locations[point_idx], markers)
+                else:
+                    # Keep the pool busy without reading further ahead than the number of workers, futures are
+                    # consumed in submission order so the point order is deterministic
+                    while next_location < len(point_locations) and len(in_flight) < n_workers:
+                        in_flight.append(executor.submit(read_point,
+                                                         point_locations[next_location],
+                                                         markers))
+                        next_location += 1
+
+                    result = in_flight.popleft().result()
+
+                segmentation_mask, marker_data, marker_names, read_time, peak_allocation = result
+                del result
+
+                logging.debug("Finished reading %s in %ss" % (fov, str(read_time)))
+                self.point_read_times[fov] = read_time
+
+                if peak_allocation is not None:
+                    logging.info("Peak allocation while reading %s: %.2fMB (%.2fx the marker stack)" % (
+                        fov, peak_allocation / 1e6, peak_allocation / float(max(marker_data.nbytes, 1))))
+                    self.point_peak_allocations[fov] = peak_allocation
+
+                yield point_idx + 1, segmentation_mask, marker_data, marker_names
+        finally:
+            if executor is not None:
+                for future in in_flight:
+                    future.cancel()
+
+                executor.shutdown()
+
+        end = datetime.datetime.now()
+
+        logging.info("Read %s points in %s using %s %s worker(s)" % (len(point_locations),
+                                                                    str(end - start),
+                                                                    n_workers,
+                                                                    self.config.reading_executor))
+
+    def get_all_point_data(self, markers=None) -> (list, list, list):
+        """
+        Collect all points marker data, segmentation masks and marker names
+
+        :param markers: list or str, Marker names or the name of a marker cluster to load, defaults to markers_to_load
+        :return: array_like, [n_points, n_markers, point_size[0], point_size[1]] -> Marker data,
+        array_like, [n_points, point_size[0], point_size[1]] -> Segmentation masks,
+        array_like, [n_points, n_markers] -> Names of markers
+        """
+
+        all_points_segmentation_masks = []
+        all_points_marker_data = []
+        marker_names = []
 
-                all_points_segmentation_masks.append(segmentation_mask)
-                all_points_marker_data.append(marker_data)
+        for point_num, segmentation_mask, marker_data, marker_names in self.iter_point_data(markers=markers):
+            all_points_segmentation_masks.append(segmentation_mask)
+            all_points_marker_data.append(marker_data)
 
         return all_points_segmentation_masks, all_points_marker_data, marker_names
@@ -45,8 +45,8 @@ class ObjectExtractor:
         if self.config.create_removed_vessels_mask:
             removed_vessels_img = np.zeros(self.config.segmentation_mask_size, np.uint8)
 
-        # If the segmentation mask is a 3-channel image, convert it to grayscale
-        if img.shape[2] == 3:
+        # If the segmentation mask is a 3-channel image, convert it to grayscale, single channel masks are used as is
+        if img.ndim == 3 and img.shape[2] == 3:
             imgray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
         else:
             imgray = img
@@ -119,7 +119,7 @@ class ObjectExtractor:
                        removed_vessels_img)
 
         if show:
-            copy = img.copy()
+            copy = cv.cvtColor(img, cv.COLOR_GRAY2BGR) if img.ndim == 2 else img.copy()
             cv.imshow("Segmented Cells", cv.drawContours(copy, usable_contours, -1, (0, 255, 0), 3))
             cv.waitKey(0)
             del copy
@@ -0,0 +1,155 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+'''
+Authors: Aswin Visva, John-Paul Oliveria, Ph.D
+'''
+
+PAGE_SIZE = 4096
+HEADER_LENGTH_FORMAT = "<Q"
+
+
+def _align(offset: int, alignment: int = PAGE_SIZE) -> int:
+    """
+    Round an offset up to the next multiple of alignment
+
+    :param offset: int, Byte offset
+    :param alignment: int, Alignment in bytes
+    :return: int, Aligned byte offset
+    """
+    return ((offset + alignment - 1) // alignment) * alignment
+
+
+class PointCache:
+
+    def __init__(self, cache_dir: str):
+        """
+        Point Cache class
+
+        Stores the marker stack, marker names and segmentation mask of a point in a single file so that later runs
+        can memory map the point instead of decoding its TIFs again. The file is a little-endian header length,
+        a JSON header and the page aligned raw arrays.
+
+        :param cache_dir: str, Directory holding the cached points
+        """
+        self.cache_dir = cache_dir
+
+    def path(self, point_name: str) -> str:
+        """
+        Get the cache file path of a point
+
+        :param point_name: str, Point name
+        :return: str, Path to the cached point
+        """
+        return os.path.join(self.cache_dir, "%s.mibi" % point_name)
+
+    def contains(self, point_name: str) -> bool:
+        """
+        Check if a point has been cached
+
+        :param point_name: str, Point name
+        :return: bool, True if the point has been cached
+        """
+        return os.path.isfile(self.path(point_name))
+
+    def write(self,
+              point_name: str,
+              segmentation_mask: np.ndarray,
+              marker_data: np.ndarray,
+              marker_names: list,
+              source: str = None):
+        """
+        Write a point to the cache
+
+        :param point_name: str, Point name
+        :param segmentation_mask: array_like, [point_size[0], point_size[1]] -> Segmentation mask
+        :param marker_data: array_like, [n_markers, point_size[0], point_size[1]] -> Marker data
+        :param marker_names: array_like, [n_markers] -> Names of markers
+        :param source: str, Fingerprint of the files and settings the point was decoded from
+        """
+
+        arrays = {"markers": np.ascontiguousarray(marker_data),
+                  "mask": np.ascontiguousarray(segmentation_mask)}
+
+        header = {"marker_names": list(marker_names), "source": source}
+
+        # The header size depends on the offsets, so reserve a full page for it and place the arrays after it
+        offset = PAGE_SIZE
+
+        for key, array in arrays.items():
+            header[key] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset = _align(offset + array.nbytes)
+
+        encoded_header = json.dumps(header).encode("utf-8")
+        assert struct.calcsize(HEADER_LENGTH_FORMAT) + len(encoded_header) <= PAGE_SIZE, \
+            "Point cache header is too large!"
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(point_name)
+        tmp_path = "%s.tmp%s" % (path, os.getpid())
+
+        with open(tmp_path, "wb") as f:
+            f.write(struct.pack(HEADER_LENGTH_FORMAT, len(encoded_header)))
+            f.write(encoded_header)
+
+            for key, array in arrays.items():
+                f.seek(header[key]["offset"])
+                f.write(array.tobytes())
+
+            f.truncate(offset)
+
+        # Replace atomically so that a crashed ingest never leaves a partially written point behind
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read_header(path: str) -> dict:
+        """
+        Read the header of a cached point
+
+        :param path: str, Path to the cached point
+        :return: dict, Header of the cached point
+        """
+
+        with open(path, "rb") as f:
+            header_length, = struct.unpack(HEADER_LENGTH_FORMAT, f.read(struct.calcsize(HEADER_LENGTH_FORMAT)))
+            return json.loads(f.read(header_length).decode("utf-8"))
+
+    def read_source(self, point_name: str) -> str:
+        """
+        Read the fingerprint of the files and settings a cached point was decoded from, without mapping its arrays
+
+        :param point_name: str, Point name
+        :return: str, Fingerprint the point was written with, None if the point is not cached or has no fingerprint
+        """
+
+        if not self.contains(point_name):
+            return None
+
+        return self._read_header(self.path(point_name)).get("source")
+
+    def read(self, point_name: str) -> (np.ndarray, np.ndarray, list):
+        """
+        Memory map a cached point, the returned arrays are read-only views into the cache file
+
+        :param point_name: str, Point name
+        :return: array_like, [point_size[0], point_size[1]] -> Segmentation mask,
+        array_like, [n_markers, point_size[0], point_size[1]] -> Marker data,
+        array_like, [n_markers] -> Names of markers
+        """
+
+        path = self.path(point_name)
+        header = self._read_header(path)
+
+        arrays = {}
+
+        for key in ["markers", "mask"]:
+            arrays[key] = np.memmap(path,
+                                    dtype=np.dtype(header[key]["dtype"]),
+                                    mode="r",
+                                    offset=header[key]["offset"],
+                                    shape=tuple(header[key]["shape"]))
+
+        return arrays["mask"], arrays["markers"], header["marker_names"]
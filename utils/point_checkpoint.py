@@ -0,0 +1,163 @@
+import glob
+import hashlib
+import json
+import os
+import logging
+import pickle
+
+from config.config_settings import Config
+from utils.stage_cache import READ_CONFIG_FIELDS, STAGE_CONFIG_FIELDS
+from utils.utils_functions import config_fingerprint
+
+'''
+Authors: Aswin Visva, John-Paul Oliveria, Ph.D
+'''
+
+# Settings the expansion features of a point depend on, before normalization
+POINT_FEATURE_CONFIG_FIELDS = (READ_CONFIG_FIELDS
+                               + STAGE_CONFIG_FIELDS["extract"]
+                               + STAGE_CONFIG_FIELDS["expand"])
+
+
+class PointCheckpoint:
+
+    def __init__(self, run_dir: str, config: Config, fields: list = None, marker_names: list = None):
+        """
+        Point Checkpoint class
+
+        Persists the expansion features of each point as soon as they are computed, so that a restarted run can skip
+        the points which were already finished. The run directory records a fingerprint of the settings and markers
+        the features depend on, and any blocks written under a different fingerprint are removed when the checkpoint
+        is opened.
+
+        :param run_dir: str, Directory to persist the point features in
+        :param config: Config, configuration settings
+        :param fields: list, [n_fields] -> Names of the settings the features depend on, defaults to
+        POINT_FEATURE_CONFIG_FIELDS
+        :param marker_names: list, [n_markers] -> Names of the markers read for every point, in stacking order
+        """
+        self.run_dir = run_dir
+        self.fields = list(fields) if fields is not None else list(POINT_FEATURE_CONFIG_FIELDS)
+        self.marker_names = list(marker_names) if marker_names is not None else None
+        self.fingerprint = config_fingerprint(config, self.fields)
+
+        if self.marker_names is not None:
+            encoded = "%s:%s" % (self.fingerprint, json.dumps(self.marker_names))
+            self.fingerprint = hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+        os.makedirs(self.run_dir, exist_ok=True)
+
+        self._invalidate_stale_points(config)
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.run_dir, "checkpoint.json")
+
+    def path(self, point_num: int) -> str:
+        """
+        Get the checkpoint file path of a point
+
+        :param point_num: int, Point number starting from 1
+        :return: str, Path to the point features
+        """
+        return os.path.join(self.run_dir, "Point%s.pkl" % point_num)
+
+    def contains(self, point_num: int) -> bool:
+        """
+        Check if the features of a point have been persisted
+
+        :param point_num: int, Point number starting from 1
+        :return: bool, True if the point has been persisted
+        """
+        return os.path.isfile(self.path(point_num))
+
+    def completed_points(self) -> list:
+        """
+        Get the points whose features have been persisted
+
+        :return: list, Point numbers starting from 1
+        """
+        paths = glob.glob(os.path.join(self.run_dir, "Point*.pkl"))
+
+        return sorted(int(os.path.basename(path)[len("Point"):-len(".pkl")]) for path in paths)
+
+    def _write_atomically(self, path: str, data: bytes):
+        """
+        Write a file atomically, so that a crashed run never leaves a partially written file behind
+
+        :param path: str, Path to write
+        :param data: bytes, Contents of the file
+        """
+
+        tmp_path = "%s.tmp%s" % (path, os.getpid())
+
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, path)
+
+    def _invalidate_stale_points(self, config: Config):
+        """
+        Remove the persisted points if they were computed with different settings, and record the current settings
+
+        :param config: Config, configuration settings
+        """
+
+        manifest = None
+
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+
+        if manifest is not None and manifest["fingerprint"] == self.fingerprint:
+            return
+
+        stale_points = self.completed_points()
+
+        if len(stale_points) > 0:
+            logging.info("Settings changed since the checkpoint in %s was written, discarding %s point(s)" % (
+                self.run_dir, len(stale_points)))
+
+        for point_num in stale_points:
+            os.remove(self.path(point_num))
+
+        manifest = {
+            "fingerprint": self.fingerprint,
+            "fields": {field: repr(getattr(config, field, None)) for field in self.fields},
+            "marker_names": self.marker_names
+        }
+
+        self._write_atomically(self.manifest_path, json.dumps(manifest, indent=4).encode("utf-8"))
+
+    def save(self, point_num: int, point_data):
+        """
+        Persist the features of a point
+
+        :param point_num: int, Point number starting from 1
+        :param point_data: object, Picklable features of the point
+        """
+
+        self._write_atomically(self.path(point_num),
+                               pickle.dumps({"fingerprint": self.fingerprint, "data": point_data},
+                                            protocol=pickle.HIGHEST_PROTOCOL))
+
+    def load(self, point_num: int):
+        """
+        Load the persisted features of a point
+
+        :param point_num: int, Point number starting from 1
+        :return: object, Features of the point, None if the point has not been persisted or is stale
+        """
+
+        if not self.contains(point_num):
+            return None
+
+        with open(self.path(point_num), "rb") as f:
+            block = pickle.load(f)
+
+        if block["fingerprint"] != self.fingerprint:
+            return None
+
+        return block["data"]
@@ -0,0 +1,312 @@
+import math
+
+import numpy as np
+import cv2 as cv
+from scipy import ndimage
+
+from utils.ring_histogram import RingHistogram
+
+'''
+Authors: Aswin Visva, John-Paul Oliveria, Ph.D
+'''
+
+_FLOAT32_MAX = float(np.finfo(np.float32).max)
+
+
+def get_vessel_owner_labels(per_point_contours: list, img_shape: (int, int)) -> np.ndarray:
+    """
+    Get the vessel which owns each pixel, i.e. the vessel strictly closest to it. A vessel cannot expand beyond the
+    pixels it owns, which avoids vessels encroaching on other vessel's space. Pixels equidistant from two vessels are
+    owned by neither of them.
+
+    All vessels are filled into one label image and a single Euclidean distance transform returns the distance to
+    the closest vessel for every pixel, along with a closest vessel which breaks ties arbitrarily. To find the ties,
+    each vessel's exact distance transform is computed in a window around the pixels assigned to it, grown until no
+    pixel on the window border comes within two pixels of being as close to the vessel as to the closest one, so the
+    window holds every pixel the vessel ties for. The distances are square roots of whole numbers, so equidistant
+    pixels compare exactly equal.
+
+    :param per_point_contours: list, [n_vessels] -> List of vessel contours in a given point
+    :param img_shape: tuple, Point data size ex. (1024, 1024)
+    :return: array_like, [point_size[0], point_size[1]] -> Index of the vessel owning each pixel, -1 if no vessel owns
+    it
+    """
+
+    if len(per_point_contours) == 0:
+        return np.full(img_shape, -1, np.int32)
+
+    vessel_labels = np.full(img_shape, -1, np.int32)
+
+    for i in range(len(per_point_contours)):
+        cv.drawContours(vessel_labels, per_point_contours, i, i, cv.FILLED)
+
+    # Distance from every pixel to its closest vessel pixel, along with that vessel pixel's coordinates
+    closest_distances, (closest_y, closest_x) = ndimage.distance_transform_edt(vessel_labels < 0,
+                                                                               return_indices=True)
+    owner_labels = vessel_labels[closest_y, closest_x]
+
+    # Bounding box of the pixels each vessel was assigned, None for a vessel hidden under overlapping vessels
+    cells = ndimage.find_objects(owner_labels + 1, max_label=len(per_point_contours))
+    tied = np.zeros(img_shape, bool)
+
+    for i, cnt in enumerate(per_point_contours):
+        x, y, w, h = cv.boundingRect(cnt)
+        top, bottom, left, right = y, y + h, x, x + w
+
+        if cells[i] is not None:
+            top, bottom = min(top, cells[i][0].start), max(bottom, cells[i][0].stop)
+            left, right = min(left, cells[i][1].start), max(right, cells[i][1].stop)
+
+        pad = 2
+
+        while True:
+            window = (slice(max(top - pad, 0), min(bottom + pad, img_shape[0])),
+                      slice(max(left - pad, 0), min(right + pad, img_shape[1])))
+
+            inverted = np.ones((window[0].stop - window[0].start, window[1].stop - window[1].start), np.uint8)
+            cv.drawContours(inverted, per_point_contours, i, 0, cv.FILLED, offset=(-window[1].start, -window[0].start))
+
+            # Every pixel of the vessel lies inside its window, so the distances inside the window are exact
+            distances = ndimage.distance_transform_edt(inverted)
+            closest = closest_distances[window]
+
+            # The cell is star shaped around the vessel, so if it reached past the window, it would cross a border
+            # pixel which is within one pixel of being as close to the vessel as to its closest vessel, checked with
+            # a margin of two pixels against rounding. Borders on the edge of the image are not checked, the cell
+            # cannot reach past them
+            border = np.zeros(distances.shape, bool)
+            border[0, :] = window[0].start > 0
+            border[-1, :] = window[0].stop < img_shape[0]
+            border[:, 0] |= window[1].start > 0
+            border[:, -1] |= window[1].stop < img_shape[1]
+
+            if not np.any(border & (distances <= closest + 2)):
+                break
+
+            pad *= 2
+
+        tied[window] |= (distances == closest) & (owner_labels[window] != i)
+
+    owner_labels[tied] = -1
+
+    return owner_labels
+
+
+class PointGeometry:
+
+    def __init__(self, per_point_vessel_contours: list, img_shape: (int, int), max_distance: float = None):
+        """
+        Point Geometry class
+
+        Caches the geometry of the vessels in a point, which never changes between expansions: the vessel owning each
+        pixel and one signed distance field per vessel. Every inward and outward ring of every expansion is cut from
+        the signed distance field by thresholding alone. Everything is computed lazily on first use and kept until
+        release() is called once the point is finished.
+
+        When the maximum expansion distance is known, the per vessel kernels only process a window made of the
+        vessel's bounding rectangle plus that distance, clipped to the image, since no ring can reach past it.
+
+        :param per_point_vessel_contours: list, [n_vessels] -> Contours of vessels in the point
+        :param img_shape: tuple, Point data size ex. (1024, 1024)
+        :param max_distance: float, Largest distance any ring will be expanded to, None to process full frames
+        """
+        self.contours = per_point_vessel_contours
+        self.img_shape = tuple(img_shape)
+        self.max_distance = max_distance
+
+        self._owner_labels = None
+        self._signed_distances = {}
+        self._ring_histograms = {}
+
+    @property
+    def owner_labels(self) -> np.ndarray:
+        if self._owner_labels is None:
+            self._owner_labels = get_vessel_owner_labels(self.contours, self.img_shape)
+
+        return self._owner_labels
+
+    def window(self, idx: int, distance: float = 0) -> (slice, slice):
+        """
+        Get the window around a vessel which holds every ring up to a given distance, the full frame if the distance
+        is beyond the maximum expansion distance
+
+        :param idx: int, Vessel index
+        :param distance: float, Largest distance the rings cut from the window will reach
+        :return: tuple, (rows, columns) -> Window slices
+        """
+        if self.max_distance is None or distance > self.max_distance:
+            return slice(0, self.img_shape[0]), slice(0, self.img_shape[1])
+
+        x, y, w, h = cv.boundingRect(self.contours[idx])
+
+        # Pad by at least one pixel so the vessel boundary is surrounded by background as it would be in the frame
+        pad = int(math.ceil(self.max_distance)) + 1
+
+        return (slice(max(y - pad, 0), min(y + h + pad, self.img_shape[0])),
+                slice(max(x - pad, 0), min(x + w + pad, self.img_shape[1])))
+
+    def to_full_frame(self, window: (slice, slice), cropped: np.ndarray) -> np.ndarray:
+        """
+        Write a cropped mask back into a full size frame
+
+        :param window: tuple, (rows, columns) -> Window slices
+        :param cropped: array_like, Mask inside the window
+        :return: array_like, [point_size[0], point_size[1]] -> Full size mask
+        """
+        full_frame = np.zeros(self.img_shape, cropped.dtype)
+        full_frame[window] = cropped
+
+        return full_frame
+
+    def region(self, idx: int, window: (slice, slice) = None) -> np.ndarray:
+        """
+        Get the region a vessel owns, beyond which it cannot expand
+
+        :param idx: int, Vessel index
+        :param window: tuple, (rows, columns) -> Window slices, None for the full frame
+        :return: array_like, [point_size[0], point_size[1]] -> Region mask
+        """
+        owner_labels = self.owner_labels if window is None else self.owner_labels[window]
+
+        return (owner_labels == idx).astype(np.uint8)
+
+    def signed_distance(self, idx: int, window: (slice, slice) = None) -> np.ndarray:
+        """
+        Get the signed distance field of a vessel, the distance to the vessel for pixels outside of it and minus the
+        distance to the vessel boundary for pixels inside of it
+
+        :param idx: int, Vessel index
+        :param window: tuple, (rows, columns) -> Window slices, None for the full frame
+        :return: array_like, Signed distance field inside the window
+        """
+        if window is None:
+            window = self.window(idx, distance=math.inf)
+
+        key = (idx, window[0].start, window[0].stop, window[1].start, window[1].stop)
+
+        if key not in self._signed_distances:
+            fill = np.zeros((window[0].stop - window[0].start, window[1].stop - window[1].start), np.uint8)
+            cv.drawContours(fill, self.contours, idx, (1, 1, 1), cv.FILLED,
+                            offset=(-window[1].start, -window[0].start))
+
+            # Outside the vessel the inward distance is exactly 0 and inside the vessel the outward distance is
+            # exactly 0, so their difference keeps both distances intact
+            signed_distance = cv.distanceTransform(1 - fill, cv.DIST_L2, cv.DIST_MASK_PRECISE)
+            signed_distance -= cv.distanceTransform(fill, cv.DIST_L2, cv.DIST_MASK_PRECISE)
+
+            self._signed_distances[key] = signed_distance
+
+        return self._signed_distances[key]
+
+    def vessel_mask(self, idx: int, window: (slice, slice) = None) -> np.ndarray:
+        """
+        Get the filled vessel mask
+
+        :param idx: int, Vessel index
+        :param window: tuple, (rows, columns) -> Window slices, None for the full frame
+        :return: array_like, Vessel mask inside the window
+        """
+        return (self.signed_distance(idx, window) < 0).astype(np.uint8)
+
+    def expand(self, idx: int, upper_bound: int = 5, lower_bound: int = 0, window: (slice, slice) = None) -> np.ndarray:
+        """
+        Create an expanded vessel mask, equivalent to expand_vessel_region
+
+        :param idx: int, Vessel index
+        :param upper_bound: int, Pixel expansion
+        :param lower_bound: int, Pixel Lower Bound
+        :param window: tuple, (rows, columns) -> Window slices, None for the full frame
+        :return: array_like, Vessel ring mask inside the window
+        """
+
+        # The outward distance of every pixel inside the vessel is 0
+        if lower_bound <= 0:
+            lower_bound = -_FLOAT32_MAX
+
+        ring = cv.inRange(self.signed_distance(idx, window), lower_bound, upper_bound)
+
+        return (ring / 255).astype(np.uint8)
+
+    def contract(self,
+                 idx: int,
+                 upper_bound: int = 5,
+                 lower_bound: int = 0,
+                 window: (slice, slice) = None) -> np.ndarray:
+        """
+        Create a contracted vessel mask, equivalent to contract_vessel_region
+
+        :param idx: int, Vessel index
+        :param upper_bound: int, Pixel upper bound to contract by
+        :param lower_bound: int, Pixel lower bound to contract by
+        :param window: tuple, (rows, columns) -> Window slices, None for the full frame
+        :return: array_like, Vessel ring mask inside the window
+        """
+        if lower_bound == 0:
+            lower_bound = 0.25
+
+        # The inward distance of every pixel outside the vessel is 0
+        upper_signed_bound = -lower_bound if lower_bound > 0 else _FLOAT32_MAX
+
+        ring = cv.inRange(self.signed_distance(idx, window), -abs(upper_bound), upper_signed_bound)
+
+        return (ring / 255).astype(np.uint8)
+
+    def ring_labels(self, upper_bounds: list) -> np.ndarray:
+        """
+        Label every pixel with the vessel owning it and the outward ring it falls in. Bin 0 is the vessel itself, bin
+        i is the ring between upper_bounds[i - 2] (0 for bin 1) and upper_bounds[i - 1], matching the rings cut by
+        expand, and the last bin holds the owned pixels beyond the last ring.
+
+        :param upper_bounds: list, [n_rings] -> Increasing upper bound of every ring
+        :return: array_like, [point_size[0], point_size[1]] -> vessel * (n_rings + 2) + bin for every pixel, -1 for
+        pixels no vessel owns
+        """
+
+        # inRange compares float32 distances against the bounds cast to float32, so bin against the same values
+        bounds = np.asarray(upper_bounds, np.float32)
+        n_bins = len(bounds) + 2
+
+        bins = np.full(self.img_shape, n_bins - 1, np.int64)
+
+        for idx in range(len(self.contours)):
+            window = self.window(idx, distance=float(bounds.max()) if len(bounds) > 0 else 0)
+
+            owned = self.owner_labels[window] == idx
+            signed_distance = self.signed_distance(idx, window)[owned]
+
+            vessel_bins = np.searchsorted(bounds, signed_distance, side="left") + 1
+            vessel_bins[signed_distance < 0] = 0
+
+            bins[window][owned] = vessel_bins
+
+        labels = self.owner_labels * n_bins + bins
+        labels[self.owner_labels < 0] = -1
+
+        return labels
+
+    def ring_histogram(self, per_point_marker_data, upper_bounds: list) -> RingHistogram:
+        """
+        Get the marker sums of every vessel in every outward ring, computed in one pass over the point
+
+        :param per_point_marker_data: array_like or SparseMarkerData, [n_markers, point_size[0], point_size[1]] ->
+        Pixel data for each marker
+        :param upper_bounds: list, [n_rings] -> Increasing upper bound of every ring
+        :return: RingHistogram, Per vessel, per bin and per marker sums
+        """
+        key = tuple(upper_bounds)
+
+        if key not in self._ring_histograms:
+            self._ring_histograms[key] = RingHistogram(per_point_marker_data,
+                                                       self.ring_labels(upper_bounds),
+                                                       len(self.contours),
+                                                       len(upper_bounds) + 2)
+
+        return self._ring_histograms[key]
+
+    def release(self):
+        """
+        Evict everything cached for the point
+        """
+        self._owner_labels = None
+        self._signed_distances.clear()
+        self._ring_histograms.clear()
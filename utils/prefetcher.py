@@ -0,0 +1,101 @@
+import datetime
+import queue
+import threading
+
+'''
+Authors: Aswin Visva, John-Paul Oliveria, Ph.D
+'''
+
+_END_OF_DATA = object()
+
+
+class Prefetcher:
+
+    def __init__(self, iterable, depth: int = 2):
+        """
+        Prefetcher class
+
+        Consumes an iterable on a background thread and keeps up to depth items ready in a bounded queue, so that
+        producing item N + 1 (ex. decoding a point) overlaps with processing item N. The time the consumer spends
+        waiting for items is recorded as stall time.
+
+        :param iterable: iterable, Items to prefetch
+        :param depth: int, Maximum number of items to hold ready
+        """
+        self.iterable = iterable
+        self.depth = max(1, depth)
+        self.stall_times = []
+
+        self._queue = queue.Queue(maxsize=self.depth)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+
+    @property
+    def total_stall_time(self) -> float:
+        return sum(self.stall_times)
+
+    def _put(self, item) -> bool:
+        """
+        Put an item on the queue, giving up if the consumer has stopped
+
+        :param item: object, Item to put
+        :return: bool, True if the item was queued
+        """
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def _produce(self):
+        """
+        Fill the queue from the iterable, forwarding any exception to the consumer
+        """
+        try:
+            for item in self.iterable:
+                if not self._put((item, None)):
+                    return
+
+            self._put((_END_OF_DATA, None))
+        except BaseException as e:
+            self._put((_END_OF_DATA, e))
+
+    def __iter__(self):
+        self._thread.start()
+
+        try:
+            while True:
+                start = datetime.datetime.now()
+                item, exception = self._queue.get()
+                end = datetime.datetime.now()
+
+                if item is _END_OF_DATA:
+                    if exception is not None:
+                        raise exception
+
+                    return
+
+                self.stall_times.append((end - start).total_seconds())
+
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stop the background thread and close the iterable, so that a generator releases its resources (ex. open files
+        or a reading pool) when the consumer stops early
+        """
+        self._stopped.set()
+
+        if self._thread.is_alive():
+            self._thread.join()
+
+        # The producer has exited, so the iterable is no longer executing and can be closed from this thread
+        close_iterable = getattr(self.iterable, "close", None)
+
+        if close_iterable is not None:
+            close_iterable()
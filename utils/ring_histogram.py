@@ -0,0 +1,108 @@
+import numpy as np
+
+from utils.sparse_markers import SparseMarkerData
+
+'''
+Authors: Aswin Visva, John-Paul Oliveria, Ph.D
+'''
+
+
+class RingHistogram:
+
+    def __init__(self, per_point_marker_data, ring_labels: np.ndarray, n_vessels: int, n_bins: int):
+        """
+        Ring Histogram class
+
+        Reduces the marker data of a point over every (vessel, distance bin) pair in a single pass over its pixels.
+        Every pixel is labelled with the vessel owning it and the ring it falls in, so the sums of every marker in
+        every ring of every expansion come from one bincount per marker.
+
+        :param per_point_marker_data: array_like or SparseMarkerData, [n_markers, point_size[0], point_size[1]] ->
+        Pixel data for each marker
+        :param ring_labels: array_like, [point_size[0], point_size[1]] -> vessel * n_bins + bin for every pixel, -1
+        for pixels no vessel owns
+        :param n_vessels: int, Number of vessels in the point
+        :param n_bins: int, Number of distance bins per vessel
+        """
+        self.n_vessels = n_vessels
+        self.n_bins = n_bins
+
+        n_labels = n_vessels * n_bins
+        n_markers = len(per_point_marker_data)
+
+        labels = ring_labels.reshape(-1)
+        owned = labels >= 0
+        owned_labels = labels[owned]
+
+        sums = np.zeros((n_markers, n_labels), np.float64)
+        nonzero_counts = np.zeros((n_markers, n_labels), np.int64)
+
+        if isinstance(per_point_marker_data, SparseMarkerData):
+            # Only the nonzero counts are visited, keyed by both the marker and the ring they fall in. The counts are
+            # ordered by pixel, so every pixel label is repeated once per count of the pixel
+            count_labels = np.repeat(labels, np.diff(per_point_marker_data.indptr))
+            inside = count_labels >= 0
+            keys = per_point_marker_data.marker_indices[inside].astype(np.int64) * n_labels + count_labels[inside]
+
+            sums = np.bincount(keys,
+                               weights=per_point_marker_data.data[inside],
+                               minlength=n_markers * n_labels).reshape(n_markers, n_labels)
+            nonzero_counts = np.bincount(keys, minlength=n_markers * n_labels).reshape(n_markers, n_labels)
+        else:
+            for marker_idx, marker in enumerate(per_point_marker_data):
+                values = np.asarray(marker).reshape(-1)[owned]
+
+                sums[marker_idx] = np.bincount(owned_labels, weights=values, minlength=n_labels)
+                nonzero_counts[marker_idx] = np.bincount(owned_labels[values != 0], minlength=n_labels)
+
+        # [n_vessels, n_bins, n_markers]
+        self.sums = sums.T.reshape(n_vessels, n_bins, n_markers)
+        self.nonzero_counts = nonzero_counts.T.reshape(n_vessels, n_bins, n_markers)
+
+        # [n_vessels, n_bins]
+        self.pixel_counts = np.bincount(owned_labels, minlength=n_labels).reshape(n_vessels, n_bins)
+
+        # The bins partition the region each vessel owns, so sums over the bins up to a distance, and over the whole
+        # region, are running totals over the bins
+        self.cumulative_sums = np.cumsum(self.sums, axis=1)
+        self.cumulative_nonzero_counts = np.cumsum(self.nonzero_counts, axis=1)
+        self.cumulative_pixel_counts = np.cumsum(self.pixel_counts, axis=1)
+
+    def ring(self, vessel_idx: int, bin_num: int) -> (np.ndarray, np.ndarray, int):
+        """
+        Get the marker sums of a vessel in a single bin
+
+        :param vessel_idx: int, Vessel index
+        :param bin_num: int, Bin number
+        :return: array_like, [n_markers] -> Sum of marker counts, array_like, [n_markers] -> Number of nonzero
+        pixels, int, Number of pixels
+        """
+        return (self.sums[vessel_idx, bin_num],
+                self.nonzero_counts[vessel_idx, bin_num],
+                self.pixel_counts[vessel_idx, bin_num])
+
+    def within(self, vessel_idx: int, bin_num: int) -> (np.ndarray, np.ndarray, int):
+        """
+        Get the marker sums of a vessel over every bin up to and including a bin, i.e. the vessel expanded up to it
+
+        :param vessel_idx: int, Vessel index
+        :param bin_num: int, Bin number
+        :return: array_like, [n_markers] -> Sum of marker counts, array_like, [n_markers] -> Number of nonzero
+        pixels, int, Number of pixels
+        """
+        return (self.cumulative_sums[vessel_idx, bin_num],
+                self.cumulative_nonzero_counts[vessel_idx, bin_num],
+                self.cumulative_pixel_counts[vessel_idx, bin_num])
+
+    def beyond(self, vessel_idx: int, bin_num: int) -> (np.ndarray, np.ndarray, int):
+        """
+        Get the marker sums of a vessel over every bin after a bin, i.e. the rest of the region the vessel owns
+
+        :param vessel_idx: int, Vessel index
+        :param bin_num: int, Bin number
+        :return: array_like, [n_markers] -> Sum of marker counts, array_like, [n_markers] -> Number of nonzero
+        pixels, int, Number of pixels
+        """
+        return (self.cumulative_sums[vessel_idx, -1] - self.cumulative_sums[vessel_idx, bin_num],
+                self.cumulative_nonzero_counts[vessel_idx, -1] - self.cumulative_nonzero_counts[vessel_idx, bin_num],
+                self.cumulative_pixel_counts[vessel_idx, -1] - self.cumulative_pixel_counts[vessel_idx, bin_num])
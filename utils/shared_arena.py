@@ -0,0 +1,174 @@
+import sys
+import threading
+import uuid
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+'''
+Authors: Aswin Visva, John-Paul Oliveria, Ph.D
+'''
+
+# Held while resource tracking is suppressed for an attachment, and while segments are created so that their
+# registration is never suppressed
+_tracking_lock = threading.Lock()
+
+
+def _attach_untracked(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to a shared memory segment without registering it with the resource tracker
+
+    The arena that published the segment owns it. Before Python 3.13 attaching registers the segment as well, so a
+    worker whose resource tracker is not the arena's unlinks it when the worker exits (bpo-38119), while unregistering
+    it after attaching would drop the arena's own registration when the tracker is shared.
+
+    :param name: str, Shared memory segment name
+    :return: SharedMemory, Attached segment
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    with _tracking_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args: None
+
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class SharedArrayHandle:
+
+    def __init__(self, name: str, shape: tuple, dtype: str):
+        """
+        Shared Array Handle class
+
+        Names an array published in shared memory. The handle is what gets pickled to worker processes instead of
+        the array itself.
+
+        :param name: str, Shared memory segment name
+        :param shape: tuple, Array shape
+        :param dtype: str, Array data type
+        """
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = dtype
+
+    def attach(self):
+        """
+        Attach to the shared memory segment of the array
+
+        :return: AttachedArray, Attached array, closed by the caller once it is no longer used
+        """
+        return AttachedArray(self)
+
+
+class AttachedArray:
+
+    def __init__(self, handle: SharedArrayHandle):
+        """
+        Attached Array class
+
+        A read-only view of an array published in shared memory, held open until close is called
+
+        :param handle: SharedArrayHandle, Handle of the published array
+        """
+        self._shm = _attach_untracked(handle.name)
+
+        self.array = np.ndarray(handle.shape, dtype=handle.dtype, buffer=self._shm.buf)
+        self.array.flags.writeable = False
+
+    def close(self):
+        """
+        Detach from the shared memory segment
+        """
+        self.array = None
+
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:
+                # A view of the array is still referenced, the mapping is released along with the last view
+                pass
+
+            self._shm = None
+
+
+class SharedArena:
+
+    def __init__(self, prefix: str = "mibi"):
+        """
+        Shared Arena class
+
+        Publishes arrays once into shared memory so that worker processes can attach to them by name instead of
+        receiving a pickled copy. The arena owns every segment it creates: segments are unlinked when they are
+        released, when the arena is closed, or when the with block using the arena exits, including on an exception.
+
+        :param prefix: str, Prefix of the shared memory segment names
+        """
+        self.prefix = "%s_%s" % (prefix, uuid.uuid4().hex[:12])
+        self._segments = {}
+        self._n_published = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._segments)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(shm.size for shm in self._segments.values())
+
+    def publish(self, key, array: np.ndarray) -> SharedArrayHandle:
+        """
+        Copy an array into a new shared memory segment
+
+        :param key: hashable, Key to release the segment by
+        :param array: array_like, Array to publish
+        :return: SharedArrayHandle, Handle to attach to the array by
+        """
+        assert key not in self._segments, "Key %s is already published!" % str(key)
+
+        array = np.ascontiguousarray(array)
+
+        with _tracking_lock:
+            shm = shared_memory.SharedMemory(name="%s_%s" % (self.prefix, self._n_published),
+                                             create=True,
+                                             size=max(array.nbytes, 1))
+
+        self._n_published += 1
+
+        try:
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+
+        self._segments[key] = shm
+
+        return SharedArrayHandle(shm.name, array.shape, array.dtype.str)
+
+    def release(self, key):
+        """
+        Unlink the shared memory segment of a published array
+
+        :param key: hashable, Key the array was published with
+        """
+        shm = self._segments.pop(key, None)
+
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    def close(self):
+        """
+        Unlink every shared memory segment the arena still owns
+        """
+        for key in list(self._segments.keys()):
+            self.release(key)
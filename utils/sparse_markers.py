@@ -0,0 +1,181 @@
+import numpy as np
+
+'''
+Authors: Aswin Visva, John-Paul Oliveria, Ph.D
+'''
+
+
+def _smallest_index_dtype(max_value: int) -> np.dtype:
+    """
+    Get the smallest unsigned integer type which can hold an index
+
+    :param max_value: int, Largest index to hold
+    :return: np.dtype, Index data type
+    """
+    for dtype in [np.uint8, np.uint16, np.uint32]:
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+
+    return np.dtype(np.uint64)
+
+
+class SparseMarkerData:
+
+    def __init__(self,
+                 data: np.ndarray,
+                 marker_indices: np.ndarray,
+                 indptr: np.ndarray,
+                 n_markers: int,
+                 point_size: (int, int)):
+        """
+        Sparse Marker Data class
+
+        Stores the marker stack of a point pixel by pixel, keeping only the nonzero ion counts: the counts of pixel p
+        are data[indptr[p]:indptr[p + 1]], for the markers in marker_indices[indptr[p]:indptr[p + 1]]. Reducing over a
+        mask then only visits the counts of the pixels inside it. Indexing or iterating returns dense marker images,
+        which keeps the class usable wherever a [n_markers, point_size[0], point_size[1]] array is expected.
+
+        :param data: array_like, [n_nonzero] -> Nonzero marker counts, ordered by pixel
+        :param marker_indices: array_like, [n_nonzero] -> Marker index of every count
+        :param indptr: array_like, [point_size[0] * point_size[1] + 1] -> Offset of the first count of every pixel
+        :param n_markers: int, Number of markers
+        :param point_size: tuple, Point data size ex. (1024, 1024)
+        """
+        self.data = data
+        self.marker_indices = marker_indices
+        self.indptr = indptr
+        self.n_markers = n_markers
+        self.point_size = tuple(point_size)
+
+    @classmethod
+    def from_dense(cls, marker_data: np.ndarray):
+        """
+        Create sparse marker data from a dense marker stack
+
+        :param marker_data: array_like, [n_markers, point_size[0], point_size[1]] -> Marker data
+        :return: SparseMarkerData, Sparse marker data
+        """
+        marker_data = np.asarray(marker_data)
+        n_markers = marker_data.shape[0]
+        point_size = marker_data.shape[1:]
+        n_pixels = point_size[0] * point_size[1]
+
+        # Pixel major view of the stack, so the nonzero counts come out ordered by pixel
+        pixel_major = marker_data.reshape(n_markers, n_pixels).T
+        pixel_indices, marker_indices = np.nonzero(pixel_major)
+
+        indptr_dtype = np.int32 if len(pixel_indices) < np.iinfo(np.int32).max else np.int64
+        indptr = np.zeros(n_pixels + 1, indptr_dtype)
+        np.cumsum(np.bincount(pixel_indices, minlength=n_pixels), out=indptr[1:])
+
+        return cls(pixel_major[pixel_indices, marker_indices],
+                   marker_indices.astype(_smallest_index_dtype(n_markers - 1)),
+                   indptr,
+                   n_markers,
+                   point_size)
+
+    @property
+    def shape(self) -> tuple:
+        return (self.n_markers,) + self.point_size
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.data.dtype
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + self.marker_indices.nbytes + self.indptr.nbytes
+
+    def __len__(self) -> int:
+        return self.n_markers
+
+    def __getitem__(self, marker_idx: int) -> np.ndarray:
+        selected = self.marker_indices == marker_idx
+
+        image = np.zeros(self.point_size[0] * self.point_size[1], self.dtype)
+        image[self.pixel_indices()[selected]] = self.data[selected]
+
+        return image.reshape(self.point_size)
+
+    def __iter__(self):
+        for marker_idx in range(len(self)):
+            yield self[marker_idx]
+
+    def pixel_indices(self) -> np.ndarray:
+        """
+        Get the flat pixel index of every stored count
+
+        :return: array_like, [n_nonzero] -> Pixel index of every count
+        """
+        return np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
+
+    def toarray(self) -> np.ndarray:
+        """
+        Convert to a dense marker stack
+
+        :return: array_like, [n_markers, point_size[0], point_size[1]] -> Marker data
+        """
+        marker_data = np.zeros((self.n_markers, self.point_size[0] * self.point_size[1]), self.dtype)
+        marker_data[self.marker_indices, self.pixel_indices()] = self.data
+
+        return marker_data.reshape(self.shape)
+
+    def _gather(self, pixel_indices: np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+        Get the positions of the stored counts of a set of pixels
+
+        :param pixel_indices: array_like, [n_pixels] -> Flat pixel indices
+        :return: array_like, [n_counts] -> Positions of the counts in data, array_like, [n_counts] -> Position of the
+        pixel each count belongs to in pixel_indices
+        """
+        starts = self.indptr[pixel_indices].astype(np.int64)
+        lengths = self.indptr[pixel_indices + 1] - starts
+
+        owners = np.repeat(np.arange(len(pixel_indices)), lengths)
+
+        # Offset of every count from the start of its pixel
+        offsets = np.arange(len(owners)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+        return starts[owners] + offsets, owners
+
+    def masked_sums(self, mask: np.ndarray, window: (slice, slice) = None) -> (np.ndarray, np.ndarray):
+        """
+        Sum every marker over a mask, in time proportional to the number of nonzero counts inside the mask
+
+        :param mask: array_like, [point_size[0], point_size[1]] -> Mask to sum over, cropped to the window if one is
+        given
+        :param window: tuple, (rows, columns) -> Window slices the mask was cropped to, None if it is full size
+        :return: array_like, [n_markers] -> Sum of counts inside the mask,
+        array_like, [n_markers] -> Number of nonzero pixels inside the mask
+        """
+        rows, cols = np.nonzero(mask)
+
+        if window is not None:
+            rows += window[0].start
+            cols += window[1].start
+
+        positions, _ = self._gather(rows.astype(np.int64) * self.point_size[1] + cols)
+        marker_indices = self.marker_indices[positions]
+
+        sums = np.bincount(marker_indices, weights=self.data[positions], minlength=self.n_markers)
+        nonzero_counts = np.bincount(marker_indices, minlength=self.n_markers)
+
+        return sums, nonzero_counts
+
+    def crop(self, x: int, y: int, w: int, h: int) -> np.ndarray:
+        """
+        Get a dense window of every marker
+
+        :param x: int, Window left edge
+        :param y: int, Window top edge
+        :param w: int, Window width
+        :param h: int, Window height
+        :return: array_like, [n_markers, h, w] -> Marker data inside the window
+        """
+        rows, cols = np.mgrid[y:y + h, x:x + w]
+        positions, owners = self._gather((rows * self.point_size[1] + cols).reshape(-1))
+
+        window = np.zeros((self.n_markers, h * w), self.dtype)
+        window[self.marker_indices[positions], owners] = self.data[positions]
+
+        return window.reshape(self.n_markers, h, w)
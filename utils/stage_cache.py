@@ -0,0 +1,220 @@
+import glob
+import hashlib
+import json
+import os
+import logging
+import pickle
+
+from config.config_settings import Config
+from utils.utils_functions import config_fingerprint
+
+'''
+Authors: Aswin Visva, John-Paul Oliveria, Ph.D
+'''
+
+# Settings the points that are read depend on. Reading is not a cached stage, these settings are covered by the input
+# fingerprint instead.
+READ_CONFIG_FIELDS = [
+    "data_dir",
+    "masks_dir",
+    "caud_hip_mfg_separate_dir",
+    "n_points_per_dir",
+    "point_dir",
+    "tifs_dir",
+    "multipage_tiff_name",
+    "markers_to_ignore",
+    "markers_to_load",
+    "marker_clusters",
+    "marker_data_dtype",
+    "selected_segmentation_mask_type",
+    "load_rgb_segmentation_masks",
+    "segmentation_mask_size"
+]
+
+# Settings each cached pipeline stage depends on, a stage also depends on every stage before it and on the input
+# fingerprint
+STAGE_CONFIG_FIELDS = {
+    "extract": [
+        "minimum_contour_area_to_remove",
+        "use_guassian_blur_when_extracting_vessels",
+        "guassian_blur"
+    ],
+    "expand": [
+        "expression_type",
+        "feature_precision",
+        "pixel_interval",
+        "max_expansions",
+        "perform_inward_expansions",
+        "max_inward_expansion"
+    ],
+    "normalize": [
+        "scaling_factor",
+        "transformation_type",
+        "normalization_type",
+        "percentile_to_normalize",
+        "n_markers",
+        "SMA_positive_threshold",
+        "large_vessel_threshold"
+    ]
+}
+
+STAGES = ["extract", "expand", "normalize"]
+
+
+def input_fingerprint(config: Config, point_locations: list, marker_names: list) -> str:
+    """
+    Fingerprint the points that are read from the read settings, the markers and the file system entries of the
+    input files, without reading them
+
+    :param config: Config, configuration settings
+    :param point_locations: list, [n_points] -> (Point name, Marker data directory, Segmentation mask path)
+    :param marker_names: list, [n_markers] -> Names of the markers read for every point, in stacking order
+    :return: str, SHA-256 hex digest of the read settings, the marker names and the name, size and modification time
+    of every input file
+    """
+
+    digest = hashlib.sha256()
+
+    digest.update(("%s\n" % config_fingerprint(config, READ_CONFIG_FIELDS)).encode("utf-8"))
+    digest.update(("%s\n" % json.dumps(list(marker_names))).encode("utf-8"))
+
+    for fov, data_loc, mask_loc in point_locations:
+        paths = [mask_loc]
+
+        if os.path.isdir(data_loc):
+            paths.extend(os.path.join(data_loc, name) for name in sorted(os.listdir(data_loc)))
+
+        for path in paths:
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                entry = "%s:%s:%s:%s\n" % (fov, path, stat.st_size, stat.st_mtime_ns)
+            else:
+                entry = "%s:%s:missing\n" % (fov, path)
+
+            digest.update(entry.encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+class StageCache:
+
+    def __init__(self, cache_dir: str, max_bytes: int = None):
+        """
+        Stage Cache class
+
+        Memoizes the output of pipeline stages on disk, keyed on a hash of the settings and input files each stage
+        depends on. Entries are evicted least recently used first once the cache grows past max_bytes.
+
+        :param cache_dir: str, Directory to store the stage outputs in
+        :param max_bytes: int, Maximum total size of the cache in bytes, None for no limit
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def stage_keys(config: Config, inputs: str) -> dict:
+        """
+        Get the cache key of every stage, each key covers the settings of its stage and of every stage before it
+
+        :param config: Config, configuration settings
+        :param inputs: str, Fingerprint of the points that are read
+        :return: dict, Stage name -> Cache key
+        """
+
+        keys = {}
+        key = inputs
+
+        for stage in STAGES:
+            encoded = "%s:%s:%s" % (stage, key, config_fingerprint(config, STAGE_CONFIG_FIELDS[stage]))
+            key = hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+            keys[stage] = key
+
+        return keys
+
+    @property
+    def nbytes(self) -> int:
+        return sum(os.path.getsize(path) for path in self._entries())
+
+    def _entries(self) -> list:
+        return glob.glob(os.path.join(self.cache_dir, "*.pkl"))
+
+    def path(self, stage: str, key: str) -> str:
+        """
+        Get the path of a cache entry
+
+        :param stage: str, Stage name
+        :param key: str, Cache key
+        :return: str, Path to the cache entry
+        """
+        return os.path.join(self.cache_dir, "%s-%s.pkl" % (stage, key))
+
+    def get(self, stage: str, key: str):
+        """
+        Load the output of a stage
+
+        :param stage: str, Stage name
+        :param key: str, Cache key
+        :return: object, Output of the stage, None if it is not cached
+        """
+
+        path = self.path(stage, key)
+
+        if not os.path.isfile(path):
+            return None
+
+        with open(path, "rb") as f:
+            value = pickle.load(f)
+
+        # The modification time orders the entries for eviction
+        os.utime(path)
+
+        logging.info("Loaded the %s stage from the cache" % stage)
+
+        return value
+
+    def put(self, stage: str, key: str, value):
+        """
+        Store the output of a stage, evicting the least recently used entries if the cache is full
+
+        :param stage: str, Stage name
+        :param key: str, Cache key
+        :param value: object, Picklable output of the stage
+        """
+
+        path = self.path(stage, key)
+        tmp_path = "%s.tmp%s" % (path, os.getpid())
+
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # Replace atomically so that a crashed run never leaves a partially written entry behind
+        os.replace(tmp_path, path)
+
+        self.evict(keep=path)
+
+    def evict(self, keep: str = None):
+        """
+        Remove the least recently used entries until the cache fits in max_bytes
+
+        :param keep: str, Path of an entry to never evict, ex. the entry that was just stored
+        """
+
+        if self.max_bytes is None:
+            return
+
+        entries = sorted(((os.stat(path).st_mtime_ns, os.path.getsize(path), path) for path in self._entries()))
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+
+            if path == keep:
+                continue
+
+            os.remove(path)
+            total -= size
+
+            logging.debug("Evicted %s from the stage cache" % os.path.basename(path))
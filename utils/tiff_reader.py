@@ -1,22 +1,64 @@
 import os
+import json
 import logging
+import xml.etree.ElementTree as ElementTree
 
 import numpy as np
 from tifffile.tifffile import TiffFile
 import cv2 as cv
 
 
-def read(path: str, describe: bool = False) -> np.ndarray:
+def cast(img: np.ndarray, dtype: np.dtype, path: str = "") -> np.ndarray:
+    """
+    Cast marker counts to another data type, refusing casts which would change any value
+
+    :param img: array_like, [point_size[0], point_size[1]] -> MIBI tiff data
+    :param dtype: np.dtype, Data type to cast to
+    :param path: str, Path the data was read from, used in error messages
+    :return: array_like, [point_size[0], point_size[1]] -> MIBI tiff data
+    """
+
+    dtype = np.dtype(dtype)
+    casted = img.astype(dtype)
+
+    if not np.can_cast(img.dtype, dtype) and not np.array_equal(casted, img):
+        raise ValueError("Cannot cast %s from %s to %s without losing values" % (path, str(img.dtype), str(dtype)))
+
+    return casted
+
+
+def read_header(path: str) -> (tuple, np.dtype):
+    """
+    Read the shape and data type of a Tiff file from its header without decoding any pixels
+
+    :param path: str, Path to file
+    :return: tuple, Image shape,
+    np.dtype, Image data type
+    """
+
+    with TiffFile(path) as tif:
+        page = tif.pages[0]
+
+        return tuple(page.shape), np.dtype(page.dtype)
+
+
+def read(path: str, describe: bool = False, out: np.ndarray = None, dtype: np.dtype = None) -> np.ndarray:
     """
     Read a Tiff file and collect a numpy array
 
     :param path: str, Path to file
     :param describe: bool, Provide a description of data
+    :param out: array_like, [point_size[0], point_size[1]] -> Preallocated array to decode into, must match the shape
+    and data type of the file
+    :param dtype: np.dtype, Data type to cast to, the native data type of the file is kept if None
     :return: array_like, [point_size[0], point_size[1]] -> MIBI tiff data
     """
 
     with TiffFile(path) as tif:
-        img = tif.asarray()
+        img = tif.asarray(out=out)
+
+        if dtype is not None and img.dtype != dtype:
+            img = cast(img, dtype, path)
 
         if describe:
             logging.debug(tif)
@@ -26,3 +68,120 @@ def read(path: str, describe: bool = False) -> np.ndarray:
             cv.waitKey(0)
 
     return img
+
+
+def _get_pages(tif: TiffFile) -> list:
+    """
+    Get every page of a Tiff file as a page with its tags, rather than a lightweight frame
+
+    :param tif: TiffFile, Open Tiff file
+    :return: list, [n_pages] -> Tiff pages
+    """
+
+    if hasattr(tif.pages, "get"):
+        return [tif.pages.get(i, aspage=True) for i in range(len(tif.pages))]
+
+    return [tif.pages[i] for i in range(len(tif.pages))]
+
+
+def _get_page_channel_name(page) -> str:
+    """
+    Get the channel name of a single page from its PageName tag or its image description
+
+    :param page: TiffPage, Tiff page
+    :return: str, Channel name, None if the page does not name its channel
+    """
+
+    page_name = page.tags.get("PageName")
+
+    if page_name is not None and page_name.value:
+        return str(page_name.value)
+
+    description = page.description
+
+    if description:
+        try:
+            description = json.loads(description)
+        except ValueError:
+            return description.strip()
+
+        if isinstance(description, dict):
+            for key in ["channel.target", "channel_name", "name"]:
+                if key in description:
+                    return str(description[key])
+
+    return None
+
+
+def get_channel_names(tif: TiffFile) -> list:
+    """
+    Get the channel names of a multi-page or OME-TIFF stack from its metadata
+
+    :param tif: TiffFile, Open Tiff file
+    :return: list, [n_pages] -> Channel name of every page
+    """
+
+    if tif.is_ome:
+        root = ElementTree.fromstring(tif.ome_metadata)
+        channel_names = [element.get("Name") for element in root.iter() if element.tag.endswith("}Channel")]
+    else:
+        channel_names = [_get_page_channel_name(page) for page in _get_pages(tif)]
+
+    if len(channel_names) != len(tif.pages) or any(name is None for name in channel_names):
+        raise ValueError("Could not read a channel name for every page of %s" % tif.filehandle.path)
+
+    return channel_names
+
+
+def read_channel_names(path: str) -> list:
+    """
+    Read the channel names of a multi-page or OME-TIFF stack from its metadata without decoding any pixels
+
+    :param path: str, Path to file
+    :return: list, [n_pages] -> Channel name of every page
+    """
+
+    with TiffFile(path) as tif:
+        return get_channel_names(tif)
+
+
+def read_stack(path: str,
+               channel_names: list = None,
+               describe: bool = False,
+               out: np.ndarray = None) -> (np.ndarray, list):
+    """
+    Read several channels of a multi-page or OME-TIFF stack with a single open and decode
+
+    :param path: str, Path to file
+    :param channel_names: list, [n_channels] -> Names of channels to read in stacking order, all channels if None
+    :param describe: bool, Provide a description of data
+    :param out: array_like, [n_channels, point_size[0], point_size[1]] -> Preallocated array to decode into
+    :return: array_like, [n_channels, point_size[0], point_size[1]] -> MIBI tiff data,
+    list, [n_channels] -> Names of channels
+    """
+
+    with TiffFile(path) as tif:
+        available_channel_names = get_channel_names(tif)
+
+        if channel_names is None:
+            channel_names = available_channel_names
+
+        missing_channels = [name for name in channel_names if name not in available_channel_names]
+
+        if len(missing_channels) > 0:
+            raise ValueError("Channels %s are missing from %s" % (str(missing_channels), path))
+
+        pages = [available_channel_names.index(name) for name in channel_names]
+
+        if out is None:
+            page = tif.pages[0]
+            out = np.empty((len(pages),) + tuple(page.shape), dtype=page.dtype)
+
+        # Decode the selected pages directly into the stack, a single page would otherwise be decoded as 2D
+        tif.asarray(key=pages, out=out if len(pages) > 1 else out[0])
+
+        if describe:
+            logging.debug(tif)
+            logging.debug("Channels: %s" % str(available_channel_names))
+
+    return out, list(channel_names)
@@ -1,4 +1,6 @@
 import datetime
+import hashlib
+import json
 import random
 from collections import Counter
 import os
@@ -34,3 +36,19 @@ def get_contour_areas_list(contours: list) -> list:
     """
 
     return [cv.contourArea(cnt) for cnt in contours]
+
+
+def config_fingerprint(config, fields: list) -> str:
+    """
+    Fingerprint the values of a set of configuration settings
+
+    :param config: Config, configuration settings
+    :param fields: list, [n_fields] -> Names of the settings to fingerprint, settings which are not defined are
+    fingerprinted as None
+    :return: str, SHA-256 hex digest of the settings
+    """
+
+    values = {field: getattr(config, field, None) for field in fields}
+    encoded = json.dumps(values, sort_keys=True, default=repr).encode("utf-8")
+
+    return hashlib.sha256(encoded).hexdigest()
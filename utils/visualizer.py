@@ -12,6 +12,7 @@ from config.config_settings import Config
 from utils.mibi_reader import MIBIReader
 from utils.object_extractor import ObjectExtractor
 from utils.markers_feature_gen import *
+from utils.feature_store import FeatureStore
 from utils.utils_functions import mkdir_p, get_contour_areas_list
 
 '''
@@ -32,12 +33,12 @@ class Visualizer:
 
     def __init__(self,
                  config: Config,
-                 all_samples_features: pd.DataFrame,
+                 feature_store: FeatureStore,
                  markers_names: list,
                  all_points_vessel_contours: list,
                  all_points_removed_vessel_contours: list,
                  all_points_vessel_contours_areas: list,
-                 all_points_marker_data: np.array,
+                 all_points_marker_data: np.array
                  ):
 
         """
@@ -50,47 +51,34 @@ class Visualizer:
         for each point
         :param all_points_vessel_contours: array_like, [n_points, n_vessels] -> list of vessel contours for each point
         :param all_points_marker_data: array_like, [n_points, n_markers, point_size[0], point_size[1]] ->
-        list of marker data for each point
+        list of marker data for each point, None to read the points again whenever marker data is needed
+        :param feature_store: FeatureStore, Expression features of every vessel, feature DataFrames are built from it
+        when a plot needs one
         """
 
         self.config = config
-        self.all_samples_features = all_samples_features
         self.markers_names = markers_names
         self.all_points_vessel_contours = all_points_vessel_contours
         self.all_points_vessel_contours_areas = all_points_vessel_contours_areas
         self.all_points_marker_data = all_points_marker_data
         self.all_points_removed_vessel_contours = all_points_removed_vessel_contours
+        self.feature_store = feature_store
 
-    def vessel_region_plots(self, n_expansions: int):
+    def _get_line_plot_features(self, n_expansions: int, point_num: int) -> pd.DataFrame:
         """
-        Create vessel region line plots for all marker bins, average marker bins and per marker bins
+        Get the expression of every marker of a point in long format for the line plots
 
         :param n_expansions: int, Number of expansions
-        :return:
+        :param point_num: int, Point number starting from 1
+        :return: pd.DataFrame, [n_rows * n_markers, 7] -> Expression of every marker with its marker cluster and
+        expansion distance, indexed by (Point, Vessel, Data Type)
         """
         marker_clusters = self.config.marker_clusters
-        color_maps = self.config.line_plots_color_maps
-        colors = self.config.line_plots_bin_colors
-
-        marker_color_dict = {}
-        for marker_cluster in marker_clusters.keys():
-            for marker in marker_clusters[marker_cluster]:
-                marker_color_dict[marker] = colors[marker_cluster]
-
-        perbin_marker_color_dict = {}
-        for key in marker_clusters.keys():
-            colors_clusters = color_maps[key](np.linspace(0, 1, len(marker_clusters[key]) + 2))
-            color_idx = 2
 
-            for marker, marker_name in enumerate(marker_clusters[key]):
-                perbin_marker_color_dict[marker_name] = colors_clusters[color_idx]
-                color_idx += 1
-
-        idx = pd.IndexSlice
-        plot_features = self.all_samples_features.loc[idx[:,
-                                                      :,
-                                                      :n_expansions,
-                                                      "Data"], :]
+        plot_features = self.feature_store.to_dataframe(self.config.large_vessel_threshold,
+                                                        point_num=point_num,
+                                                        expansion=slice(None, n_expansions),
+                                                        data_type="Data")
 
         plot_features = pd.melt(plot_features,
                                 id_vars=["Contour Area",
@@ -114,6 +102,33 @@ class Visualizer:
         plot_features = plot_features.rename(
             columns={'Expansion': "Distance Expanded (%s)" % self.config.data_resolution_units})
 
+        return plot_features
+
+    def vessel_region_plots(self, n_expansions: int):
+        """
+        Create vessel region line plots for all marker bins, average marker bins and per marker bins
+
+        :param n_expansions: int, Number of expansions
+        :return:
+        """
+        marker_clusters = self.config.marker_clusters
+        color_maps = self.config.line_plots_color_maps
+        colors = self.config.line_plots_bin_colors
+
+        marker_color_dict = {}
+        for marker_cluster in marker_clusters.keys():
+            for marker in marker_clusters[marker_cluster]:
+                marker_color_dict[marker] = colors[marker_cluster]
+
+        perbin_marker_color_dict = {}
+        for key in marker_clusters.keys():
+            colors_clusters = color_maps[key](np.linspace(0, 1, len(marker_clusters[key]) + 2))
+            color_idx = 2
+
+            for marker, marker_name in enumerate(marker_clusters[key]):
+                perbin_marker_color_dict[marker_name] = colors_clusters[color_idx]
+                color_idx += 1
+
         for point in self.config.vessel_line_plots_points:
             all_bins_dir = "%s/mean_per_vessel_per_point_per_brain_region/point_%s_vessels_%s_expansions_allbins" \
                            % (self.config.visualization_results_dir, str(point), str(n_expansions - 1))
@@ -126,15 +141,11 @@ class Visualizer:
             mkdir_p(average_bins_dir)
             mkdir_p(per_bin_dir)
 
-            idx = pd.IndexSlice
-            n_vessels = len(self.all_samples_features.loc[idx[point,
-                                                          :,
-                                                          0,
-                                                          "Data"], self.markers_names].to_numpy())
+            point_features = self._get_line_plot_features(n_expansions, point)
+
+            n_vessels = self.feature_store.n_vessels(point)
             for vessel in range(n_vessels):
-                vessel_features = plot_features.loc[idx[point,
-                                                        vessel,
-                                                        "Data"], :]
+                vessel_features = point_features.xs(vessel, level="Vessel")
                 plt.figure(figsize=(22, 10))
 
                 # Average Bins
@@ -217,45 +228,13 @@ class Visualizer:
                 perbin_marker_color_dict[marker_name] = colors_clusters[color_idx]
                 color_idx += 1
 
-        idx = pd.IndexSlice
-        plot_features = self.all_samples_features.loc[idx[:,
-                                                      :,
-                                                      :n_expansions,
-                                                      "Data"], :]
-
-        plot_features = pd.melt(plot_features,
-                                id_vars=["Contour Area",
-                                         "Vessel Size",
-                                         "SMA Presence"],
-                                ignore_index=False)
-
-        plot_features = plot_features.rename(columns={'variable': 'Marker',
-                                                      'value': 'Expression'})
-
-        plot_features.reset_index(level=['Expansion'], inplace=True)
-
-        for key in marker_clusters.keys():
-            for marker, marker_name in enumerate(marker_clusters[key]):
-                plot_features.loc[plot_features["Marker"] == marker_name, "Marker Label"] = key
-
-        plot_features['Expansion'] = plot_features['Expansion'].apply(lambda x:
-                                                                      round_to_nearest_half(
-                                                                          x * self.config.pixel_interval
-                                                                          * self.config.pixels_to_distance))
-        plot_features = plot_features.rename(
-            columns={'Expansion': "Distance Expanded (%s)" % self.config.data_resolution_units})
-
         output_dir = "%s/mean_per_point_per_brain_region/points_%s_expansions" % (
             self.config.visualization_results_dir, str(n_expansions - 1))
         mkdir_p(output_dir)
 
         for point in range(self.config.n_points):
 
-            idx = pd.IndexSlice
-
-            point_features = plot_features.loc[idx[point + 1,
-                                               :,
-                                               "Data"], :]
+            point_features = self._get_line_plot_features(n_expansions, point + 1)
             plt.figure(figsize=(22, 10))
 
             # Average Bins
@@ -338,11 +317,9 @@ class Visualizer:
                 perbin_marker_color_dict[marker_name] = colors_clusters[color_idx]
                 color_idx += 1
 
-        idx = pd.IndexSlice
-        plot_features = self.all_samples_features.loc[idx[:,
-                                                      :,
-                                                      :n_expansions,
-                                                      "Data"], :]
+        plot_features = self.feature_store.to_dataframe(self.config.large_vessel_threshold,
+                                                        expansion=slice(None, n_expansions),
+                                                        data_type="Data")
 
         plot_features = pd.melt(plot_features,
                                 id_vars=["Contour Area",
@@ -446,7 +423,7 @@ class Visualizer:
             original_not_included_point_mask = np.zeros(self.config.segmentation_mask_size, np.uint8)
             original_included_point_mask = np.zeros(self.config.segmentation_mask_size, np.uint8)
 
-            regions = get_assigned_regions(point_data, self.config.segmentation_mask_size)
+            owner_labels = get_vessel_owner_labels(point_data, self.config.segmentation_mask_size)
 
             for vessel_idx, vessel in enumerate(point_data):
                 original_not_included_mask = expand_vessel_region(vessel,
@@ -455,13 +432,14 @@ class Visualizer:
                                                                   lower_bound=0.5)
 
                 original_not_included_mask = cv.bitwise_and(original_not_included_mask,
-                                                            regions[vessel_idx].astype(np.uint8))
+                                                            (owner_labels == vessel_idx).astype(np.uint8))
 
                 original_included_mask = expand_vessel_region(vessel,
                                                               self.config.segmentation_mask_size,
                                                               upper_bound=expansion_upper_bound)
 
-                original_included_mask = cv.bitwise_and(original_included_mask, regions[vessel_idx].astype(np.uint8))
+                original_included_mask = cv.bitwise_and(original_included_mask,
+                                                        (owner_labels == vessel_idx).astype(np.uint8))
 
                 original_not_included_point_mask = np.bitwise_or(original_not_included_point_mask,
                                                                  original_not_included_mask)
@@ -495,7 +473,7 @@ class Visualizer:
             original_not_included_point_mask = np.zeros(self.config.segmentation_mask_size, np.uint8)
             original_included_point_mask = np.zeros(self.config.segmentation_mask_size, np.uint8)
 
-            regions = get_assigned_regions(point_data, self.config.segmentation_mask_size)
+            owner_labels = get_vessel_owner_labels(point_data, self.config.segmentation_mask_size)
 
             for vessel_idx, vessel in enumerate(point_data):
                 original_not_included_mask = expand_vessel_region(vessel,
@@ -504,13 +482,14 @@ class Visualizer:
                                                                   lower_bound=0.5)
 
                 original_not_included_mask = cv.bitwise_and(original_not_included_mask,
-                                                            regions[vessel_idx].astype(np.uint8))
+                                                            (owner_labels == vessel_idx).astype(np.uint8))
 
                 original_included_mask = expand_vessel_region(vessel,
                                                               self.config.segmentation_mask_size,
                                                               upper_bound=expansion_upper_bound)
 
-                original_included_mask = cv.bitwise_and(original_included_mask, regions[vessel_idx].astype(np.uint8))
+                original_included_mask = cv.bitwise_and(original_included_mask,
+                                                        (owner_labels == vessel_idx).astype(np.uint8))
 
                 original_not_included_point_mask[np.where(original_not_included_mask == 1)] = vessel_idx + 1
                 original_included_point_mask[np.where(original_included_mask == 1)] = vessel_idx + 1
@@ -547,11 +526,9 @@ class Visualizer:
                 perbin_marker_color_dict[marker_name] = colors_clusters[color_idx]
                 color_idx += 1
 
-        idx = pd.IndexSlice
-        plot_features = self.all_samples_features.loc[idx[:,
-                                                      :,
-                                                      :n_expansions,
-                                                      "Data"], :]
+        plot_features = self.feature_store.to_dataframe(self.config.large_vessel_threshold,
+                                                        expansion=slice(None, n_expansions),
+                                                        data_type="Data")
 
         plot_features = pd.melt(plot_features,
                                 id_vars=["Contour Area",
@@ -668,13 +645,17 @@ class Visualizer:
 
             colors = pl.cm.Greys(np.linspace(0, 1, n_expansions + 10))
 
+            per_point_vessel_contours = self.all_points_vessel_contours[point_num]
+            geometry = PointGeometry(per_point_vessel_contours, expansion_image.shape,
+                                     max_distance=interval * n_expansions)
+
             for x in range(n_expansions):
-                per_point_vessel_contours = self.all_points_vessel_contours[point_num]
                 expansion_ring_plots(per_point_vessel_contours,
                                      expansion_image,
                                      pixel_expansion_upper_bound=current_interval,
                                      pixel_expansion_lower_bound=current_interval - interval,
-                                     color=colors[x + 5] * 255)
+                                     color=colors[x + 5] * 255,
+                                     geometry=geometry)
 
                 if x + 1 in expansions:
                     child_dir = parent_dir + "/expansion_%s" % str(x + 1)
@@ -684,6 +665,8 @@ class Visualizer:
 
                 current_interval += interval
 
+            geometry.release()
+
     def expression_histogram(self):
         """
         Histogram for visualizing Marker Expressions
@@ -691,18 +674,15 @@ class Visualizer:
         :return:
         """
 
-        n_points = self.config.n_points
-
         all_points_vessels_expression = []
 
         output_dir = "%s/expression_histograms" % self.config.visualization_results_dir
         mkdir_p(output_dir)
 
         # Iterate through each point
-        for i in range(n_points):
+        for i, marker_data, _ in self._iter_point_marker_data():
             contours = self.all_points_vessel_contours[i]
             contour_areas = self.all_points_vessel_contours_areas[i]
-            marker_data = self.all_points_marker_data[i]
             start_expression = datetime.datetime.now()
 
             vessel_expression_data = calculate_composition_marker_expression(self.config,
@@ -720,7 +700,7 @@ class Visualizer:
                 "Finished calculating expression for Point %s in %s" % (str(i + 1), end_expression - start_expression))
 
         all_samples_features = pd.concat(all_points_vessels_expression).fillna(0)
-        all_samples_features = self.all_samples_features.sort_index()
+        all_samples_features = self.feature_store.to_dataframe(self.config.large_vessel_threshold)
 
         scaling_factor = self.config.scaling_factor
         transformation = self.config.transformation_type
@@ -734,10 +714,9 @@ class Visualizer:
                                                          normalization=normalization,
                                                          scaling_factor=scaling_factor,
                                                          n_markers=n_markers)
-        idx = pd.IndexSlice
 
         x = "SMA"
-        x_data = self.all_samples_features.loc[idx[:, :, 0, "Data"], x].values
+        x_data = self.feature_store.get(expansion=0, data_type="Data", markers=x)
 
         plt.hist(x_data, density=True, bins=30, label="Data")
         mn, mx = plt.xlim()
@@ -757,18 +736,15 @@ class Visualizer:
 
         :return:
         """
-        n_points = self.config.n_points
-
         all_points_vessels_expression = []
 
         output_dir = "%s/biaxial_scatter_plots" % self.config.visualization_results_dir
         mkdir_p(output_dir)
 
         # Iterate through each point
-        for i in range(n_points):
+        for i, marker_data, _ in self._iter_point_marker_data():
             contours = self.all_points_vessel_contours[i]
             contour_areas = self.all_points_vessel_contours_areas[i]
-            marker_data = self.all_points_marker_data[i]
             start_expression = datetime.datetime.now()
 
             vessel_expression_data = calculate_composition_marker_expression(self.config,
@@ -786,7 +762,7 @@ class Visualizer:
                 "Finished calculating expression for Point %s in %s" % (str(i + 1), end_expression - start_expression))
 
         all_samples_features = pd.concat(all_points_vessels_expression).fillna(0)
-        all_samples_features = self.all_samples_features.sort_index()
+        all_samples_features = self.feature_store.to_dataframe(self.config.large_vessel_threshold)
 
         scaling_factor = self.config.scaling_factor
         transformation = self.config.transformation_type
@@ -801,16 +777,14 @@ class Visualizer:
                                                          scaling_factor=scaling_factor,
                                                          n_markers=n_markers)
 
-        idx = pd.IndexSlice
-
         x = "SMA"
         y = "GLUT1"
 
-        x_data = self.all_samples_features.loc[idx[:, :, 0, "Data"], x].values
-        y_data = self.all_samples_features.loc[idx[:, :, 0, "Data"], y].values
+        x_data = self.feature_store.get(expansion=0, data_type="Data", markers=x)
+        y_data = self.feature_store.get(expansion=0, data_type="Data", markers=y)
 
-        positive_sma = len(self.all_samples_features.loc[all_samples_features[x] > 0.1].values)
-        all_vess = len(self.all_samples_features.values)
+        positive_sma = len(all_samples_features.loc[all_samples_features[x] > 0.1].values)
+        all_vess = len(all_samples_features.values)
 
         logging.debug("There are %s / %s vessels which are positive for SMA" % (positive_sma, all_vess))
 
@@ -829,11 +803,11 @@ class Visualizer:
         x = "SMA"
         y = "CD31"
 
-        x_data = self.all_samples_features.loc[idx[:, :, 0, "Data"], x].values
-        y_data = self.all_samples_features.loc[idx[:, :, 0, "Data"], y].values
+        x_data = self.feature_store.get(expansion=0, data_type="Data", markers=x)
+        y_data = self.feature_store.get(expansion=0, data_type="Data", markers=y)
 
-        positive_sma = len(self.all_samples_features.loc[all_samples_features[x] > 0.1].values)
-        all_vess = len(self.all_samples_features.values)
+        positive_sma = len(all_samples_features.loc[all_samples_features[x] > 0.1].values)
+        all_vess = len(all_samples_features.values)
 
         logging.debug("There are %s / %s vessels which are positive for SMA" % (positive_sma, all_vess))
 
@@ -852,11 +826,11 @@ class Visualizer:
         x = "SMA"
         y = "vWF"
 
-        x_data = self.all_samples_features.loc[idx[:, :, 0, "Data"], x].values
-        y_data = self.all_samples_features.loc[idx[:, :, 0, "Data"], y].values
+        x_data = self.feature_store.get(expansion=0, data_type="Data", markers=x)
+        y_data = self.feature_store.get(expansion=0, data_type="Data", markers=y)
 
-        positive_sma = len(self.all_samples_features.loc[all_samples_features[x] > 0.1].values)
-        all_vess = len(self.all_samples_features.values)
+        positive_sma = len(all_samples_features.loc[all_samples_features[x] > 0.1].values)
+        all_vess = len(all_samples_features.values)
 
         logging.debug("There are %s / %s vessels which are positive for SMA" % (positive_sma, all_vess))
 
@@ -916,11 +890,9 @@ class Visualizer:
                 perbin_marker_color_dict[marker_name] = colors_clusters[color_idx]
                 color_idx += 1
 
-        idx = pd.IndexSlice
-        plot_features = self.all_samples_features.loc[idx[:,
-                                                      :,
-                                                      :n_expansions,
-                                                      "Data"], :]
+        plot_features = self.feature_store.to_dataframe(self.config.large_vessel_threshold,
+                                                        expansion=slice(None, n_expansions),
+                                                        data_type="Data")
 
         plot_features = pd.melt(plot_features,
                                 id_vars=["Contour Area",
@@ -1039,38 +1011,22 @@ class Visualizer:
         all_markers_dir = "%s/all_markers" % parent_dir
         mkdir_p(all_markers_dir)
 
-        for point_idx, marker_data in enumerate(self.all_points_marker_data):
-            marker_dict = dict(zip(self.markers_names, marker_data))
-            data = []
+        for cluster, cluster_dir in [("Vessels", vessels_dir), ("Astrocytes", astrocytes_dir)]:
+            for point_idx, marker_dict in self._iter_marker_dicts(cluster):
+                data = []
 
-            for marker in self.config.marker_clusters["Vessels"]:
-                data.append(marker_dict[marker])
-
-            data = np.nanmean(np.array(data), axis=0)
-            blurred_data = gaussian_filter(data, sigma=4)
-            color_map = plt.imshow(blurred_data)
-            color_map.set_cmap("jet")
-            plt.colorbar()
-            plt.savefig("%s/Point%s" % (vessels_dir, str(point_idx + 1)))
-            plt.clf()
+                for marker in self.config.marker_clusters[cluster]:
+                    data.append(marker_dict[marker])
 
-        for point_idx, marker_data in enumerate(self.all_points_marker_data):
-            marker_dict = dict(zip(self.markers_names, marker_data))
-            data = []
-
-            for marker in self.config.marker_clusters["Astrocytes"]:
-                data.append(marker_dict[marker])
-
-            data = np.nanmean(np.array(data), axis=0)
-            blurred_data = gaussian_filter(data, sigma=4)
-            color_map = plt.imshow(blurred_data)
-            color_map.set_cmap("jet")
-            plt.colorbar()
-            plt.savefig("%s/Point%s" % (astrocytes_dir, str(point_idx + 1)))
-            plt.clf()
+                data = np.nanmean(np.array(data), axis=0)
+                blurred_data = gaussian_filter(data, sigma=4)
+                color_map = plt.imshow(blurred_data)
+                color_map.set_cmap("jet")
+                plt.colorbar()
+                plt.savefig("%s/Point%s" % (cluster_dir, str(point_idx + 1)))
+                plt.clf()
 
-        for point_idx, marker_data in enumerate(self.all_points_marker_data):
-            marker_dict = dict(zip(self.markers_names, marker_data))
+        for point_idx, marker_dict in self._iter_marker_dicts():
 
             point_dir = "%s/Point%s" % (all_markers_dir, str(point_idx + 1))
             mkdir_p(point_dir)
@@ -1086,6 +1042,59 @@ class Visualizer:
                 plt.savefig("%s/%s" % (point_dir, marker_name))
                 plt.clf()
 
+    def _iter_point_marker_data(self, markers=None):
+        """
+        Iterate over the marker data of every point
+
+        If the marker data is not held in memory, the points are read from disk one at a time, and only the
+        requested markers are read
+
+        :param markers: list or str, Marker names or the name of a marker cluster, all markers if None
+        :return: generator, yields (int, Point index, array_like, [n_markers, point_size[0], point_size[1]] -> Marker
+        data, list, [n_markers] -> Names of markers)
+        """
+
+        if self.all_points_marker_data is not None:
+            for point_idx, marker_data in enumerate(self.all_points_marker_data):
+                yield point_idx, marker_data, self.markers_names
+        else:
+            mibi_reader = MIBIReader(self.config)
+
+            if markers is None:
+                markers = self.markers_names
+
+            for point_num, _, marker_data, marker_names in mibi_reader.iter_point_data(markers=markers):
+                yield point_num - 1, marker_data, marker_names
+
+    def _iter_marker_dicts(self, markers=None):
+        """
+        Iterate over the marker data of every point, keyed by marker name
+
+        If the marker data is not held in memory, only the requested markers are read from disk
+
+        :param markers: list or str, Marker names or the name of a marker cluster, all markers if None
+        :return: generator, yields (int, Point index, dict, Marker name -> [point_size[0], point_size[1]] marker data)
+        """
+
+        for point_idx, marker_data, marker_names in self._iter_point_marker_data(markers=markers):
+            yield point_idx, dict(zip(marker_names, marker_data))
+
+    def _get_sma_split_features(self, sma_positive: bool, point_num, expansion, data_type: str) -> np.ndarray:
+        """
+        Get the features of the SMA positive or SMA negative vessels for an expansion and data type
+
+        :param sma_positive: bool, Get the SMA positive vessels if True, the SMA negative vessels otherwise
+        :param point_num: int or slice, Point number or range of point numbers, None for all points
+        :param expansion: int or slice, Expansion number or range of expansion numbers, None for all expansions
+        :param data_type: str, Data type
+        :return: array_like, [n_rows, n_markers] -> Features
+        """
+
+        features = self.feature_store.get(point_num=point_num, expansion=expansion, data_type=data_type)
+        positive = features[:, self.feature_store.marker_names.index("SMA")] >= self.config.SMA_positive_threshold
+
+        return features[positive if sma_positive else ~positive]
+
     def vessel_nonvessel_heatmap(self, n_expansions: int):
         """
         Vessel/Non-vessel heatmaps for marker expression
@@ -1096,26 +1105,14 @@ class Visualizer:
         brain_regions = self.config.brain_region_point_ranges
         marker_clusters = self.config.marker_clusters
 
+        mfg_points, hip_points, caud_points = [slice(*point_range) for point_range in brain_regions]
+        expansions = slice(1, n_expansions)
+
         # Vessel Space (SMA Positive)
-        positve_sma = self.all_samples_features.loc[
-            self.all_samples_features["SMA"] >= self.config.SMA_positive_threshold]
-
-        idx = pd.IndexSlice
-        all_vessels_sma_data = positve_sma.loc[idx[:, :,
-                                               0,
-                                               "Data"], self.markers_names].to_numpy()
-        mfg_vessels_sma_data = positve_sma.loc[idx[brain_regions[0][0]:brain_regions[0][1],
-                                               :,
-                                               0,
-                                               "Data"], self.markers_names].to_numpy()
-        hip_vessels_sma_data = positve_sma.loc[idx[brain_regions[1][0]:brain_regions[1][1],
-                                               :,
-                                               0,
-                                               "Data"], self.markers_names].to_numpy()
-        caud_vessels_sma_data = positve_sma.loc[idx[brain_regions[2][0]:brain_regions[2][1],
-                                                :,
-                                                0,
-                                                "Data"], self.markers_names].to_numpy()
+        all_vessels_sma_data = self._get_sma_split_features(True, None, 0, "Data")
+        mfg_vessels_sma_data = self._get_sma_split_features(True, mfg_points, 0, "Data")
+        hip_vessels_sma_data = self._get_sma_split_features(True, hip_points, 0, "Data")
+        caud_vessels_sma_data = self._get_sma_split_features(True, caud_points, 0, "Data")
 
         all_vessels_sma_data = np.mean(all_vessels_sma_data, axis=0)
         mfg_vessels_sma_data = np.mean(mfg_vessels_sma_data, axis=0)
@@ -1123,25 +1120,10 @@ class Visualizer:
         caud_vessels_sma_data = np.mean(caud_vessels_sma_data, axis=0)
 
         # Vessel Space (SMA Negative)
-        negative_sma = self.all_samples_features.loc[
-            self.all_samples_features["SMA"] < self.config.SMA_positive_threshold]
-
-        idx = pd.IndexSlice
-        all_vessels_non_sma_data = negative_sma.loc[idx[:, :,
-                                                    0,
-                                                    "Data"], self.markers_names].to_numpy()
-        mfg_vessels_non_sma_data = negative_sma.loc[idx[brain_regions[0][0]:brain_regions[0][1],
-                                                    :,
-                                                    0,
-                                                    "Data"], self.markers_names].to_numpy()
-        hip_vessels_non_sma_data = negative_sma.loc[idx[brain_regions[1][0]:brain_regions[1][1],
-                                                    :,
-                                                    0,
-                                                    "Data"], self.markers_names].to_numpy()
-        caud_vessels_non_sma_data = negative_sma.loc[idx[brain_regions[2][0]:brain_regions[2][1],
-                                                     :,
-                                                     0,
-                                                     "Data"], self.markers_names].to_numpy()
+        all_vessels_non_sma_data = self._get_sma_split_features(False, None, 0, "Data")
+        mfg_vessels_non_sma_data = self._get_sma_split_features(False, mfg_points, 0, "Data")
+        hip_vessels_non_sma_data = self._get_sma_split_features(False, hip_points, 0, "Data")
+        caud_vessels_non_sma_data = self._get_sma_split_features(False, caud_points, 0, "Data")
 
         all_vessels_non_sma_data = np.mean(all_vessels_non_sma_data, axis=0)
         mfg_vessels_non_sma_data = np.mean(mfg_vessels_non_sma_data, axis=0)
@@ -1150,40 +1132,20 @@ class Visualizer:
 
         # Non-vessel Space
 
-        all_nonmask_sma_data = positve_sma.loc[idx[:, :, :,
-                                               "Non-Vascular Space"], self.markers_names].to_numpy()
-        mfg_nonmask_sma_data = positve_sma.loc[idx[brain_regions[0][0]:brain_regions[0][1],
-                                               :,
-                                               1:n_expansions,
-                                               "Non-Vascular Space"], self.markers_names].to_numpy()
-        hip_nonmask_sma_data = positve_sma.loc[idx[brain_regions[1][0]:brain_regions[1][1],
-                                               :,
-                                               1:n_expansions,
-                                               "Non-Vascular Space"], self.markers_names].to_numpy()
-        caud_nonmask_sma_data = positve_sma.loc[idx[brain_regions[2][0]:brain_regions[2][1],
-                                                :,
-                                                1:n_expansions,
-                                                "Non-Vascular Space"], self.markers_names].to_numpy()
+        all_nonmask_sma_data = self._get_sma_split_features(True, None, None, "Non-Vascular Space")
+        mfg_nonmask_sma_data = self._get_sma_split_features(True, mfg_points, expansions, "Non-Vascular Space")
+        hip_nonmask_sma_data = self._get_sma_split_features(True, hip_points, expansions, "Non-Vascular Space")
+        caud_nonmask_sma_data = self._get_sma_split_features(True, caud_points, expansions, "Non-Vascular Space")
 
         all_nonmask_sma_data = np.mean(all_nonmask_sma_data, axis=0)
         mfg_nonmask_sma_data = np.mean(mfg_nonmask_sma_data, axis=0)
         hip_nonmask_sma_data = np.mean(hip_nonmask_sma_data, axis=0)
         caud_nonmask_sma_data = np.mean(caud_nonmask_sma_data, axis=0)
 
-        all_nonmask_non_sma_data = negative_sma.loc[idx[:, :, :,
-                                                    "Non-Vascular Space"], self.markers_names].to_numpy()
-        mfg_nonmask_non_sma_data = negative_sma.loc[idx[brain_regions[0][0]:brain_regions[0][1],
-                                                    :,
-                                                    1:n_expansions,
-                                                    "Non-Vascular Space"], self.markers_names].to_numpy()
-        hip_nonmask_non_sma_data = negative_sma.loc[idx[brain_regions[1][0]:brain_regions[1][1],
-                                                    :,
-                                                    1:n_expansions,
-                                                    "Non-Vascular Space"], self.markers_names].to_numpy()
-        caud_nonmask_non_sma_data = negative_sma.loc[idx[brain_regions[2][0]:brain_regions[2][1],
-                                                     :,
-                                                     1:n_expansions,
-                                                     "Non-Vascular Space"], self.markers_names].to_numpy()
+        all_nonmask_non_sma_data = self._get_sma_split_features(False, None, None, "Non-Vascular Space")
+        mfg_nonmask_non_sma_data = self._get_sma_split_features(False, mfg_points, expansions, "Non-Vascular Space")
+        hip_nonmask_non_sma_data = self._get_sma_split_features(False, hip_points, expansions, "Non-Vascular Space")
+        caud_nonmask_non_sma_data = self._get_sma_split_features(False, caud_points, expansions, "Non-Vascular Space")
 
         all_nonmask_non_sma_data = np.mean(all_nonmask_non_sma_data, axis=0)
         mfg_nonmask_non_sma_data = np.mean(mfg_nonmask_non_sma_data, axis=0)
@@ -1192,42 +1154,32 @@ class Visualizer:
 
         # Vessel environment space
 
-        all_vessels_environment_sma_data = positve_sma.loc[idx[:, :,
-                                                           1:n_expansions,
-                                                           "Vascular Space"], self.markers_names].to_numpy()
-        mfg_vessels_environment_sma_data = positve_sma.loc[idx[brain_regions[0][0]:brain_regions[0][1],
-                                                           :,
-                                                           1:n_expansions,
-                                                           "Vascular Space"], self.markers_names].to_numpy()
-        hip_vessels_environment_sma_data = positve_sma.loc[idx[brain_regions[1][0]:brain_regions[1][1],
-                                                           :,
-                                                           1:n_expansions,
-                                                           "Vascular Space"], self.markers_names].to_numpy()
-        caud_vessels_environment_sma_data = positve_sma.loc[idx[brain_regions[2][0]:brain_regions[2][1],
-                                                            :,
-                                                            1:n_expansions,
-                                                            "Vascular Space"], self.markers_names].to_numpy()
+        all_vessels_environment_sma_data = self._get_sma_split_features(True, None, expansions, "Vascular Space")
+        mfg_vessels_environment_sma_data = self._get_sma_split_features(True, mfg_points, expansions, "Vascular Space")
+        hip_vessels_environment_sma_data = self._get_sma_split_features(True, hip_points, expansions, "Vascular Space")
+        caud_vessels_environment_sma_data = self._get_sma_split_features(True,
+                                                                         caud_points,
+                                                                         expansions,
+                                                                         "Vascular Space")
 
         all_vessels_environment_sma_data = np.mean(all_vessels_environment_sma_data, axis=0)
         mfg_vessels_environment_sma_data = np.mean(mfg_vessels_environment_sma_data, axis=0)
         hip_vessels_environment_sma_data = np.mean(hip_vessels_environment_sma_data, axis=0)
         caud_vessels_environment_sma_data = np.mean(caud_vessels_environment_sma_data, axis=0)
 
-        all_vessels_environment_non_sma_data = negative_sma.loc[idx[:, :,
-                                                                1:n_expansions,
-                                                                "Vascular Space"], self.markers_names].to_numpy()
-        mfg_vessels_environment_non_sma_data = negative_sma.loc[idx[brain_regions[0][0]:brain_regions[0][1],
-                                                                :,
-                                                                1:n_expansions,
-                                                                "Vascular Space"], self.markers_names].to_numpy()
-        hip_vessels_environment_non_sma_data = negative_sma.loc[idx[brain_regions[1][0]:brain_regions[1][1],
-                                                                :,
-                                                                1:n_expansions,
-                                                                "Vascular Space"], self.markers_names].to_numpy()
-        caud_vessels_environment_non_sma_data = negative_sma.loc[idx[brain_regions[2][0]:brain_regions[2][1],
-                                                                 :,
-                                                                 1:n_expansions,
-                                                                 "Vascular Space"], self.markers_names].to_numpy()
+        all_vessels_environment_non_sma_data = self._get_sma_split_features(False, None, expansions, "Vascular Space")
+        mfg_vessels_environment_non_sma_data = self._get_sma_split_features(False,
+                                                                            mfg_points,
+                                                                            expansions,
+                                                                            "Vascular Space")
+        hip_vessels_environment_non_sma_data = self._get_sma_split_features(False,
+                                                                            hip_points,
+                                                                            expansions,
+                                                                            "Vascular Space")
+        caud_vessels_environment_non_sma_data = self._get_sma_split_features(False,
+                                                                             caud_points,
+                                                                             expansions,
+                                                                             "Vascular Space")
 
         all_vessels_environment_non_sma_data = np.mean(all_vessels_environment_non_sma_data, axis=0)
         mfg_vessels_environment_non_sma_data = np.mean(mfg_vessels_environment_non_sma_data, axis=0)
@@ -1361,41 +1313,29 @@ class Visualizer:
         hip_mask_data = []
         caud_mask_data = []
 
-        for i in sorted(self.all_samples_features.index.unique("Expansion").tolist()):
+        for i in self.feature_store.expansions.tolist():
             if i <= 0:
-                idx = pd.IndexSlice
-                current_expansion_all = self.all_samples_features.loc[idx[:, :,
-                                                                      i,
-                                                                      "Data"], self.markers_names].to_numpy()
-                current_expansion_mfg = self.all_samples_features.loc[idx[brain_regions[0][0]:brain_regions[0][1],
-                                                                      :,
-                                                                      i,
-                                                                      "Data"], self.markers_names].to_numpy()
-                current_expansion_hip = self.all_samples_features.loc[idx[brain_regions[1][0]:brain_regions[1][1],
-                                                                      :,
-                                                                      i,
-                                                                      "Data"], self.markers_names].to_numpy()
-                current_expansion_caud = self.all_samples_features.loc[idx[brain_regions[2][0]:brain_regions[2][1],
-                                                                       :,
-                                                                       i,
-                                                                       "Data"], self.markers_names].to_numpy()
+                current_expansion_all = self.feature_store.get(expansion=i, data_type="Data")
+                current_expansion_mfg = self.feature_store.get(point_num=slice(*brain_regions[0]),
+                                                               expansion=i,
+                                                               data_type="Data")
+                current_expansion_hip = self.feature_store.get(point_num=slice(*brain_regions[1]),
+                                                               expansion=i,
+                                                               data_type="Data")
+                current_expansion_caud = self.feature_store.get(point_num=slice(*brain_regions[2]),
+                                                                expansion=i,
+                                                                data_type="Data")
             else:
-                idx = pd.IndexSlice
-                current_expansion_all = self.all_samples_features.loc[idx[:, :,
-                                                                      i,
-                                                                      "Vascular Space"], self.markers_names].to_numpy()
-                current_expansion_mfg = self.all_samples_features.loc[idx[brain_regions[0][0]:brain_regions[0][1],
-                                                                      :,
-                                                                      i,
-                                                                      "Vascular Space"], self.markers_names].to_numpy()
-                current_expansion_hip = self.all_samples_features.loc[idx[brain_regions[1][0]:brain_regions[1][1],
-                                                                      :,
-                                                                      i,
-                                                                      "Vascular Space"], self.markers_names].to_numpy()
-                current_expansion_caud = self.all_samples_features.loc[idx[brain_regions[2][0]:brain_regions[2][1],
-                                                                       :,
-                                                                       i,
-                                                                       "Vascular Space"], self.markers_names].to_numpy()
+                current_expansion_all = self.feature_store.get(expansion=i, data_type="Vascular Space")
+                current_expansion_mfg = self.feature_store.get(point_num=slice(*brain_regions[0]),
+                                                               expansion=i,
+                                                               data_type="Vascular Space")
+                current_expansion_hip = self.feature_store.get(point_num=slice(*brain_regions[1]),
+                                                               expansion=i,
+                                                               data_type="Vascular Space")
+                current_expansion_caud = self.feature_store.get(point_num=slice(*brain_regions[2]),
+                                                                expansion=i,
+                                                                data_type="Vascular Space")
 
             if current_expansion_all.size > 0:
                 all_mask_data.append(np.mean(np.array(current_expansion_all), axis=0))
@@ -1422,22 +1362,16 @@ class Visualizer:
         hip_mask_data = np.array(hip_mask_data)
         caud_mask_data = np.array(caud_mask_data)
 
-        idx = pd.IndexSlice
-        all_nonmask_data = self.all_samples_features.loc[idx[:, :,
-                                                         i,
-                                                         "Non-Vascular Space"], self.markers_names].to_numpy()
-        mfg_nonmask_data = self.all_samples_features.loc[idx[brain_regions[0][0]:brain_regions[0][1],
-                                                         :,
-                                                         i,
-                                                         "Non-Vascular Space"], self.markers_names].to_numpy()
-        hip_nonmask_data = self.all_samples_features.loc[idx[brain_regions[1][0]:brain_regions[1][1],
-                                                         :,
-                                                         i,
-                                                         "Non-Vascular Space"], self.markers_names].to_numpy()
-        caud_nonmask_data = self.all_samples_features.loc[idx[brain_regions[2][0]:brain_regions[2][1],
-                                                          :,
-                                                          i,
-                                                          "Non-Vascular Space"], self.markers_names].to_numpy()
+        all_nonmask_data = self.feature_store.get(expansion=i, data_type="Non-Vascular Space")
+        mfg_nonmask_data = self.feature_store.get(point_num=slice(*brain_regions[0]),
+                                                  expansion=i,
+                                                  data_type="Non-Vascular Space")
+        hip_nonmask_data = self.feature_store.get(point_num=slice(*brain_regions[1]),
+                                                  expansion=i,
+                                                  data_type="Non-Vascular Space")
+        caud_nonmask_data = self.feature_store.get(point_num=slice(*brain_regions[2]),
+                                                   expansion=i,
+                                                   data_type="Non-Vascular Space")
 
         mean_nonmask_data = np.mean(all_nonmask_data, axis=0)
 
@@ -1457,7 +1391,7 @@ class Visualizer:
         hip_mask_data = np.transpose(hip_mask_data)
         caud_mask_data = np.transpose(caud_mask_data)
 
-        x_tick_labels = np.array(sorted(self.all_samples_features.index.unique("Expansion").tolist())) * pixel_interval
+        x_tick_labels = np.array(self.feature_store.expansions.tolist()) * pixel_interval
         x_tick_labels = x_tick_labels.tolist()
         x_tick_labels = [str(x) for x in x_tick_labels]
         x_tick_labels.append("Nonvessel Space")
@@ -1691,13 +1625,12 @@ class Visualizer:
         parent_dir = "%s/expression_masks" % self.config.visualization_results_dir
         mkdir_p(parent_dir)
 
-        for i in range(len(self.all_points_vessel_contours)):
+        for i, marker_data, _ in self._iter_point_marker_data():
             point_dir = parent_dir + "/Point_%s" % str(i + 1)
             mkdir_p(point_dir)
 
             contours = self.all_points_vessel_contours[i]
             contour_areas = self.all_points_vessel_contours_areas[i]
-            marker_data = self.all_points_marker_data[i]
 
             img_shape = marker_data[0].shape
 
@@ -1724,8 +1657,6 @@ class Visualizer:
         """
         Create kept vs. removed vessel expression comparison using Box Plots
         """
-        n_points = self.config.n_points
-
         all_points_vessels_expression = []
         all_points_removed_vessels_expression = []
 
@@ -1733,12 +1664,11 @@ class Visualizer:
         mkdir_p(parent_dir)
 
         # Iterate through each point
-        for i in range(n_points):
+        for i, marker_data, _ in self._iter_point_marker_data():
             contours = self.all_points_vessel_contours[i]
             contour_areas = self.all_points_vessel_contours_areas[i]
             removed_contours = self.all_points_removed_vessel_contours[i]
             removed_areas = get_contour_areas_list(removed_contours)
-            marker_data = self.all_points_marker_data[i]
             start_expression = datetime.datetime.now()
 
             vessel_expression_data = calculate_composition_marker_expression(self.config,
@@ -2011,7 +1941,7 @@ class Visualizer:
 
         for point_num, per_point_vessel_contours in enumerate(self.all_points_vessel_contours):
 
-            regions = get_assigned_regions(per_point_vessel_contours, img_shape)
+            owner_labels = get_vessel_owner_labels(per_point_vessel_contours, img_shape)
 
             output_dir = "%s/vessel_nonvessel_masks/%s_%s_expansion" % (self.config.visualization_results_dir,
                                                                         str(math.ceil(n_expansions *
@@ -2023,8 +1953,8 @@ class Visualizer:
             for idx, cnt in enumerate(per_point_vessel_contours):
                 mask_expanded = expand_vessel_region(cnt, img_shape,
                                                      upper_bound=self.config.pixel_interval * n_expansions)
-                mask_expanded = cv.bitwise_and(mask_expanded, regions[idx].astype(np.uint8))
-                dark_space_mask = regions[idx].astype(np.uint8) - mask_expanded
+                mask_expanded = cv.bitwise_and(mask_expanded, (owner_labels == idx).astype(np.uint8))
+                dark_space_mask = (owner_labels == idx).astype(np.uint8) - mask_expanded
 
                 example_img[np.where(dark_space_mask == 1)] = self.config.nonvessel_mask_colour  # red
                 example_img[np.where(mask_expanded == 1)] = self.config.vessel_space_colour  # green